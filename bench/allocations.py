@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Memory allocated per delivered message on the fan-out path, traced with
+tracemalloc, and the write calls the outboxes need to flush it.
+
+The clients are ClientHandlers on writers that discard what they get, so
+only the server's own work is traced: a PUBLIC_MESSAGE_FROM is delivered
+to every client, its frames stay queued in the outboxes and then each
+outbox flushes them.
+"""
+from message import Message, shared
+from server import Server, ClientHandler
+import argparse
+import asyncio
+import tracemalloc
+import time
+
+
+class NullWriter:
+    def __init__(self):
+        self.calls = 0
+        self.frames = 0
+
+    def write(self, data):
+        self.calls += 1
+        self.frames += 1
+
+    def writelines(self, data):
+        self.calls += 1
+        self.frames += len(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def traced(snapshot):
+    return snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+
+
+async def fanout(clients, messages):
+    server = Server("127.0.0.1", 0, presence_window=0)
+    writers = []
+    for i in range(clients):
+        writer = NullWriter()
+        handler = ClientHandler(None, writer)
+        handler.username = f"usuario{i}"
+        server.state.add_user(handler.username, handler)
+        writers.append(writer)
+    sender = "usuario0"
+    batch = [Message({"type": "PUBLIC_MESSAGE_FROM", "username": sender,
+                      "message": f"hola a todos {i}"})
+             for i in range(messages)]
+    tracemalloc.start()
+    before = traced(tracemalloc.take_snapshot())
+    for message in batch:
+        await server.send_to_all(sender, message)
+    after = traced(tracemalloc.take_snapshot())
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    deliveries = messages * (clients - 1)
+    blocks = sum(stat.count_diff for stat in stats) / deliveries
+    size = sum(stat.size_diff for stat in stats) / deliveries
+    for handler in server.state.local.values():
+        handler.outbox.start()
+    await asyncio.sleep(0)
+    calls = sum(writer.calls for writer in writers)
+    frames = sum(writer.frames for writer in writers)
+    for handler in server.state.local.values():
+        handler.outbox.task.cancel()
+    return blocks, size, frames / max(calls, 1)
+
+
+def replies(count):
+    """µs to build and encode a static reply, new each time and shared."""
+    def fresh():
+        return Message({"type": "INFO", "message": "success",
+                        "operation": "STATUS"}).encoded
+
+    def cached():
+        return shared(type="INFO", message="success",
+                      operation="STATUS").encoded
+
+    results = []
+    for build in (fresh, cached):
+        start = time.perf_counter()
+        for _ in range(count):
+            build()
+        results.append((time.perf_counter() - start) / count * 1e6)
+    return results
+
+
+async def main(clients, messages):
+    blocks, size, batch = await fanout(clients, messages)
+    print(f"{clients} clients, {messages} messages each")
+    print(f"allocated blocks per delivery: {blocks:.2f}")
+    print(f"allocated bytes per delivery:  {size:.1f}")
+    print(f"frames per write call:         {batch:.1f}")
+    fresh, cached = replies(100_000)
+    print(f"static reply, new Message:     {fresh:.2f} µs")
+    print(f"static reply, shared frame:    {cached:.2f} µs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--clients", type=int, default=1000,
+                        help="clients each message is delivered to")
+    parser.add_argument("-n", "--messages", type=int, default=50,
+                        help="messages delivered to every client")
+    args = parser.parse_args()
+    asyncio.run(main(args.clients, args.messages))
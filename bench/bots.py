@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""What a bot pays to start and how many requests per second it gets
+through, with the headless connection and with the terminal client.
+
+Startup is the wall time of a fresh interpreter importing each module,
+the terminal interface counted as what client.py used to import at load.
+Requests go to a spawned server without rate limits, one at a time,
+waiting for each reply, and pipelined with up to --window in flight.
+"""
+from bench.load import spawn_server, UNLIMITED
+from connection import Connection
+import statistics
+import subprocess
+import argparse
+import asyncio
+import time
+import sys
+
+IMPORTS = [("connection", "import connection"),
+           ("client", "import client"),
+           ("client + terminal UI", "import client, prompt_toolkit, "
+            "prompt_toolkit.patch_stdout")]
+
+
+def startup(code, runs):
+    """Median ms for a new interpreter to run code."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        times.append((time.perf_counter() - start) * 1e3)
+    return statistics.median(times)
+
+
+async def throughput(args, window):
+    """Requests per second with up to window of them waiting a reply."""
+    connection = Connection(args.host, args.port)
+    await connection.connect()
+    await connection.login("bot")
+    slots = asyncio.Semaphore(window)
+
+    async def one():
+        async with slots:
+            await connection.ask(type="USERS")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - start
+    await connection.close()
+    return args.requests / elapsed
+
+
+def main(args):
+    print(f"{'startup':>22} {'ms':>8}")
+    for name, code in IMPORTS:
+        try:
+            print(f"{name:>22} {startup(code, args.runs):>8.1f}")
+        except subprocess.CalledProcessError:
+            print(f"{name:>22} {'n/a':>8}")
+    server = spawn_server(args)
+    try:
+        print(f"{'requests':>22} {'req/s':>8}")
+        for window in (1, args.window):
+            rate = asyncio.run(throughput(args, window))
+            name = "one at a time" if window == 1 else f"{window} in flight"
+            print(f"{name:>22} {rate:>8.0f}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8080)
+    parser.add_argument("-n", "--requests", type=int, default=20_000)
+    parser.add_argument("-w", "--window", type=int, default=100,
+                        help="requests in flight when pipelining")
+    parser.add_argument("-r", "--runs", type=int, default=10,
+                        help="interpreters started for each import")
+    args = parser.parse_args()
+    args.server_arg = UNLIMITED
+    main(args)
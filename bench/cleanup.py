@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+from subscriptions import ALL
+from state import ChatState
+import argparse
+import time
+
+MEMBERSHIPS = 3
+
+
+class User:
+    events = ALL
+
+
+def populate(rooms):
+    state = ChatState()
+    for i in range(rooms):
+        state.add_user(f"user{i}", User())
+        state.create_room(f"room{i}", f"user{i}")
+    return state
+
+
+def scan_disconnect(state, username):
+    # what Server.cleanup did before the membership index
+    del state.users[username]
+    for room in state.rooms.values():
+        if username in room.users:
+            room.users.discard(username)
+        elif username in room.invites:
+            room.invites.discard(username)
+
+
+def indexed_disconnect(state, username):
+    state.remove_user(username)
+
+
+def measure(disconnect, rooms, users):
+    state = populate(rooms)
+    names = [f"user{i}" for i in range(users)]
+    for username in names:
+        for j in range(1, MEMBERSHIPS + 1):
+            room = state.rooms[f"room{(hash(username) + j) % rooms}"]
+            if username not in room.users:
+                state.join(room, username)
+    start = time.perf_counter()
+    for username in names:
+        disconnect(state, username)
+    return (time.perf_counter() - start) / users
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-u", "--users", type=int, default=100,
+                        help="users disconnected per measurement")
+    args = parser.parse_args()
+    print(f"{'rooms':>8} {'scan µs':>10} {'indexed µs':>11}")
+    for rooms in [1_000, 10_000, 50_000, 100_000]:
+        scan = measure(scan_disconnect, rooms, args.users)
+        indexed = measure(indexed_disconnect, rooms, args.users)
+        print(f"{rooms:>8} {scan * 1e6:>10.1f} {indexed * 1e6:>11.1f}")
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Encode, decode and round trip cost of JSON and of each codec a client
+can negotiate, on the frames bench.compression generates.
+
+Encoding starts from the fields, as the server builds its replies, and
+decoding goes from the bytes read off the socket to a Message whose type
+was read, as the server dispatches them.
+"""
+from bench.compression import traffic
+from binary import BINARY
+from compression import DEFLATE
+from framing import FrameDecoder
+from message import Message
+import argparse
+import json
+import time
+
+
+class Json:
+    name = "JSON"
+
+    def encode(self, message):
+        return message.encoded
+
+    def decoder(self):
+        return FrameDecoder()
+
+    def decode(self, decoder, data):
+        return [Message.from_encoded(frame) for frame in decoder.feed(data)]
+
+
+class Codec:
+    def __init__(self, codec):
+        self.codec = codec
+        self.name = codec.name
+
+    def encode(self, message):
+        return self.codec.encode(message)
+
+    def decoder(self):
+        return self.codec.decoder()
+
+    def decode(self, decoder, data):
+        return [self.codec.decode(frame) for frame in decoder.feed(data)]
+
+
+def best(run, rounds):
+    elapsed = float("inf")
+    for _ in range(rounds):
+        start = time.process_time()
+        run()
+        elapsed = min(elapsed, time.process_time() - start)
+    return elapsed
+
+
+def measure(codec, fields, rounds):
+    """Wire bytes, and µs per frame to encode, decode and both."""
+    wire = [codec.encode(Message(frame)) for frame in fields]
+
+    def encode():
+        for frame in fields:
+            codec.encode(Message(frame))
+
+    def decode():
+        decoder = codec.decoder()
+        for data in wire:
+            for message in codec.decode(decoder, data):
+                message["type"]
+
+    def round_trip():
+        decoder = codec.decoder()
+        for frame in fields:
+            for message in codec.decode(decoder,
+                                        codec.encode(Message(frame))):
+                message["type"]
+
+    count = len(fields)
+    return (sum(map(len, wire)) / count,
+            *(best(run, rounds) / count * 1e6
+              for run in (encode, decode, round_trip)))
+
+
+def main(count, users, rounds):
+    fields = [json.loads(frame) for frame in traffic(count, users)]
+    print(f"{'codec':>8} {'bytes':>7} {'encode µs':>10} {'decode µs':>10} "
+          f"{'round trip µs':>14}")
+    for codec in [Json(), Codec(BINARY), Codec(DEFLATE)]:
+        size, encode, decode, round_trip = measure(codec, fields, rounds)
+        print(f"{codec.name:>8} {size:>7.1f} {encode:>10.2f} {decode:>10.2f} "
+              f"{round_trip:>14.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--frames", type=int, default=20_000,
+                        help="frames to encode and decode")
+    parser.add_argument("-u", "--users", type=int, default=200,
+                        help="distinct usernames in the traffic")
+    parser.add_argument("-r", "--rounds", type=int, default=5,
+                        help="runs of each measure, the best one counts")
+    args = parser.parse_args()
+    main(args.frames, args.users, args.rounds)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+from compression import DEFLATE, LEVEL, MEM_LEVEL, WBITS
+from message import Message
+import argparse
+import random
+import time
+import zlib
+
+WORDS = ("hola que tal alguien sabe si mañana hay clase nos vemos en la "
+         "biblioteca a las cinco traigan sus apuntes de la tarea").split()
+
+
+def traffic(count, users):
+    """Frames in about the mix a busy server sends."""
+    rng = random.Random(0)
+    names = [f"usuario{i}" for i in range(users)]
+    frames = []
+    for _ in range(count):
+        username = rng.choice(names)
+        text = " ".join(rng.choices(WORDS, k=rng.randint(2, 15)))
+        frames.append(rng.choices([
+            {"type": "PUBLIC_MESSAGE_FROM", "username": username,
+             "message": text},
+            {"type": "ROOM_MESSAGE_FROM", "roomname": "sala",
+             "username": username, "message": text},
+            {"type": "MESSAGE_FROM", "username": username, "message": text},
+            {"type": "NEW_STATUS", "username": username, "status": "AWAY"},
+            {"type": "NEW_USER", "username": username},
+            {"type": "PING"},
+        ], weights=[40, 25, 10, 10, 10, 5])[0])
+    return [Message(frame).encoded for frame in frames]
+
+
+class Stream:
+    """A deflate stream per connection, the alternative to DEFLATE: better
+    ratios, but every frame is compressed again for every recipient."""
+
+    name = "stream"
+
+    def __init__(self):
+        self.compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, -WBITS,
+                                           MEM_LEVEL)
+        self.decompressor = zlib.decompressobj(-WBITS)
+
+    def encode(self, frame):
+        return (self.compressor.compress(frame)
+                + self.compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def decode(self, data):
+        return [self.decompressor.decompress(data)]
+
+
+class Frames:
+    """DEFLATE as the server uses it, each frame on its own."""
+
+    name = DEFLATE.name
+
+    def __init__(self):
+        self.decoder = DEFLATE.decoder()
+
+    def encode(self, frame):
+        return DEFLATE.encode(Message.from_trusted(frame))
+
+    def decode(self, data):
+        return self.decoder.feed(data)
+
+
+def measure(codec, frames):
+    """Wire bytes, and µs per frame to encode and decode."""
+    start = time.process_time()
+    wire = [codec.encode(frame) for frame in frames]
+    encode = time.process_time() - start
+    start = time.process_time()
+    for data in wire:
+        codec.decode(data)
+    decode = time.process_time() - start
+    return (sum(map(len, wire)), encode / len(frames) * 1e6,
+            decode / len(frames) * 1e6)
+
+
+def main(count, users, recipients):
+    frames = traffic(count, users)
+    raw = sum(map(len, frames))
+    print(f"{count} frames, {raw / count:.1f} bytes each as JSON")
+    print(f"{'codec':>8} {'bytes':>7} {'ratio':>6} {'encode µs':>10} "
+          f"{'decode µs':>10} {'broadcast µs':>13}")
+    for codec in [Frames(), Stream()]:
+        size, encode, decode = measure(codec, frames)
+        # the cost of sending one frame to every recipient
+        copies = 1 if codec.name == DEFLATE.name else recipients
+        print(f"{codec.name:>8} {size / count:>7.1f} {raw / size:>6.2f} "
+              f"{encode:>10.2f} {decode:>10.2f} {encode * copies:>13.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--frames", type=int, default=20_000,
+                        help="frames to compress")
+    parser.add_argument("-u", "--users", type=int, default=200,
+                        help="distinct usernames in the traffic")
+    parser.add_argument("-r", "--recipients", type=int, default=100,
+                        help="clients a broadcast goes to")
+    args = parser.parse_args()
+    main(args.frames, args.users, args.recipients)
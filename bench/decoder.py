@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+from message import Message
+import framing
+import asyncio
+import argparse
+import time
+
+
+def make_stream(frames):
+    messages = [
+        {"type": "PUBLIC_MESSAGE_FROM", "username": f"user{i}",
+         "message": "hola a todos " * (i % 8 + 1)}
+        for i in range(frames)
+    ]
+    return b"".join(Message(message).encoded for message in messages)
+
+
+async def readuntil_path(stream, decode):
+    # the decoding loop BaseChat.recv used before the streaming decoder
+    reader = asyncio.StreamReader(limit=len(stream) + 1)
+    reader.feed_data(stream)
+    reader.feed_eof()
+    count = 0
+    while True:
+        try:
+            data = await reader.readuntil(b"}")
+        except asyncio.IncompleteReadError:
+            return count
+        if decode:
+            Message.from_encoded(data.lstrip(b"\x00\n"))
+        count += 1
+
+
+async def decoder_path(stream, decode):
+    reader = asyncio.StreamReader(limit=len(stream) + 1)
+    reader.feed_data(stream)
+    reader.feed_eof()
+    decoder = framing.FrameDecoder()
+    count = 0
+    while data := await reader.read(framing.READ_SIZE):
+        for frame in decoder.feed(data):
+            if decode:
+                Message.from_encoded(frame)
+            count += 1
+    return count
+
+
+def measure(path, stream, rounds, decode):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        count = asyncio.run(path(stream, decode))
+        best = min(best, time.perf_counter() - start)
+    return count, best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--frames", type=int, default=100_000)
+    parser.add_argument("-r", "--rounds", type=int, default=5)
+    args = parser.parse_args()
+    stream = make_stream(args.frames)
+    print(f"{args.frames} frames, {len(stream)} bytes")
+    # splitting alone shows the framing cost apart from the JSON parsing
+    # both pay, readuntil is only correct while no string holds a brace
+    for decode in (False, True):
+        print("split and decoded" if decode else "split only")
+        for name, path in [("readuntil", readuntil_path),
+                           ("decoder", decoder_path)]:
+            count, elapsed = measure(path, stream, args.rounds, decode)
+            print(f"{name:>10}: {count} frames in {elapsed:.3f}s "
+                  f"({count / elapsed:,.0f} frames/s)")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+from message import Message
+from server import Server
+import argparse
+import timeit
+
+FRAMES = [
+    {"type": "STATUS", "status": "AWAY"},
+    {"type": "USERS"},
+    {"type": "MESSAGE", "username": "Luis", "message": "Hola Luis"},
+    {"type": "PUBLIC_MESSAGE", "message": "¡Hola todos!"},
+    {"type": "NEW_ROOM", "roomname": "Sala 1"},
+    {"type": "INVITE", "roomname": "Sala 1", "usernames": ["Luis", "Kim"]},
+    {"type": "JOIN_ROOM", "roomname": "Sala 1"},
+    {"type": "ROOM_USERS", "roomname": "Sala 1"},
+    {"type": "ROOM_MESSAGE", "roomname": "Sala 1", "message": "¡Hola!"},
+    {"type": "LEAVE_ROOM", "roomname": "Sala 1"},
+    {"type": "DISCONNECT"},
+]
+
+
+def match_chain(response):
+    # the patterns of the match statement Server.recv_messages used before
+    # the dispatch table, without the bodies
+    match response:
+        case {"type": "STATUS",
+              "status": ("AWAY" | "ACTIVE" | "BUSY") as status}:
+            return status
+        case {"type": "USERS"}:
+            return None
+        case {"type": "MESSAGE", "username": str(username),
+              "message": str(message)}:
+            return username, message
+        case {"type": "PUBLIC_MESSAGE", "message": str(message)}:
+            return message
+        case {"type": "NEW_ROOM", "roomname": str(roomname)}:
+            return roomname
+        case {"type": "INVITE", "roomname": str(roomname),
+              "usernames": list(usernames)}:
+            return roomname, usernames
+        case {"type": "JOIN_ROOM", "roomname": str(roomname)}:
+            return roomname
+        case {"type": "ROOM_USERS", "roomname": str(roomname)}:
+            return roomname
+        case {"type": "ROOM_MESSAGE", "roomname": str(roomname),
+              "message": str(message)}:
+            return roomname, message
+        case {"type": "LEAVE_ROOM", "roomname": roomname}:
+            return roomname
+        case {"type": "DISCONNECT"}:
+            return None
+        case _:
+            raise ValueError(response)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=200_000)
+    args = parser.parse_args()
+    resolve = Server.commands.resolve
+    print(f"{'type':>15} {'match ns':>10} {'table ns':>10}")
+    for frame in FRAMES:
+        message = Message(frame)
+        chain = timeit.timeit(lambda: match_chain(message),
+                              number=args.number)
+        table = timeit.timeit(lambda: resolve(message), number=args.number)
+        print(f"{frame['type']:>15} {chain / args.number * 1e9:>10.0f} "
+              f"{table / args.number * 1e9:>10.0f}")
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""Resident memory of a server per idle, logged-in connection.
+
+Opens --clients connections over loopback, each one logs in, unsubscribes
+from every event and then only answers PING. The server's resident set
+size is read from /proc before the first connection and once all of them
+are in. Source addresses are spread over 127.0.0.0/8 so a single client
+address doesn't run out of ephemeral ports. Linux only.
+"""
+from bench.load import raise_file_limit, spawn_server
+from framing import FrameDecoder
+from message import Message
+import argparse
+import asyncio
+import json
+import time
+
+# ephemeral ports used per source address
+PORTS_PER_SOURCE = 20_000
+
+PONG = Message({"type": "PONG"}).encoded
+SUBSCRIBE = Message({"type": "SUBSCRIBE", "events": []}).encoded
+
+
+class Idle(asyncio.Protocol):
+    """A logged-in client that does nothing but answer PING."""
+
+    def __init__(self, username, ready):
+        self.username = username
+        self.ready = ready
+        self.transport = None
+        self.decoder = FrameDecoder()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.write(Message({"type": "IDENTIFY",
+                                 "username": self.username,
+                                 "capabilities": ["PING"]}).encoded)
+
+    def data_received(self, data):
+        for frame in self.decoder.feed(data):
+            kind = Message.from_encoded(frame)["type"]
+            if kind == "PING":
+                self.transport.write(PONG)
+            elif not self.ready.done():
+                if kind == "INFO":
+                    self.transport.write(SUBSCRIBE)
+                self.ready.set_result(kind == "INFO")
+
+    def connection_lost(self, exc):
+        if not self.ready.done():
+            self.ready.set_result(False)
+
+
+def rss(pid):
+    """Resident set size of a process in bytes."""
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError(f"No VmRSS for process {pid}")
+
+
+async def connect(args, index):
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    block = index // PORTS_PER_SOURCE
+    source = f"127.0.{block // 250}.{block % 250 + 2}"
+    try:
+        transport, _ = await loop.create_connection(
+            lambda: Idle(f"idle{index}", ready), args.host, args.port,
+            local_addr=(source, 0))
+    except OSError:
+        return None
+    return transport if await ready else None
+
+
+async def measure(args, pid):
+    before = rss(pid)
+    start = time.monotonic()
+    transports = []
+    failed = 0
+    for first in range(0, args.clients, args.batch):
+        for transport in await asyncio.gather(*(
+                connect(args, index) for index in
+                range(first, min(first + args.batch, args.clients)))):
+            if transport is None:
+                failed += 1
+            else:
+                transports.append(transport)
+    elapsed = time.monotonic() - start
+    await asyncio.sleep(args.settle)
+    after = rss(pid)
+    for transport in transports:
+        transport.close()
+    connected = len(transports)
+    return {"clients": args.clients, "connected": connected,
+            "failed": failed, "connect_seconds": round(elapsed, 2),
+            "rss_before_mib": round(before / 2 ** 20, 1),
+            "rss_after_mib": round(after / 2 ** 20, 1),
+            "bytes_per_connection": round((after - before)
+                                          / max(connected, 1))}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8080)
+    parser.add_argument("-c", "--clients", type=int, default=100_000)
+    parser.add_argument("--batch", type=int, default=500,
+                        help="connections opened at a time")
+    parser.add_argument("--settle", type=float, default=2,
+                        help="seconds to wait before reading the memory")
+    parser.add_argument("--pid", type=int,
+                        help="measure this running server instead of "
+                        "starting one")
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="extra argument for the spawned server")
+    args = parser.parse_args()
+    raise_file_limit(args.clients)
+
+    server = None if args.pid else spawn_server(args)
+    try:
+        result = asyncio.run(measure(args, args.pid or server.pid))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    result["server_args"] = args.server_arg
+    print(json.dumps(result, indent=4))
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+"""Drive a pumachat server with many simulated clients.
+
+Every chat message carries the monotonic clock at send time, so receivers
+measure delivery latency. Results are written as JSON so runs on different
+commits can be compared with --compare.
+"""
+from utils import BaseChat
+from message import Message
+from limits import LIMITS
+from collections import Counter
+import subprocess
+import argparse
+import asyncio
+import logging
+import random
+import socket
+import json
+import time
+import sys
+import os
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DEFAULT_MIX = "public=1,message=4,room=3,status=1,churn=1"
+STATUSES = ["AWAY", "ACTIVE", "BUSY"]
+TIMED = {"PUBLIC_MESSAGE_FROM", "MESSAGE_FROM", "ROOM_MESSAGE_FROM"}
+# server arguments that lift every default rate limit
+UNLIMITED = [f"--rate-limit={kind}=0" for kind in LIMITS]
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        action, _, weight = item.partition("=")
+        if action not in Bot.actions:
+            raise argparse.ArgumentTypeError(f"unknown action {action!r}")
+        mix[action] = float(weight or 1)
+    return mix
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class Stats:
+    def __init__(self):
+        self.sent = Counter()
+        self.received = Counter()
+        self.bytes = Counter()
+        self.latencies = []
+
+
+class Bot(BaseChat):
+    actions = ("public", "message", "room", "status", "churn")
+
+    def __init__(self, index, args, stats):
+        self.index = index
+        self.username = f"bot{index}"
+        self.args = args
+        self.stats = stats
+        self.rooms = set()
+        self.status = "ACTIVE"
+        self.churns = 0
+        self.random = random.Random(args.seed + index)
+        self.joined = asyncio.Event()
+
+    async def request(self, message):
+        message = Message(message)
+        self.stats.sent[message["type"]] += 1
+        self.stats.bytes["sent"] += len(message.encoded)
+        await self.send(message)
+
+    def stamped(self):
+        return f"{time.monotonic_ns()} {self.args.payload}"
+
+    async def connect(self):
+        if self.args.unix is not None:
+            self.attach(*await asyncio.open_unix_connection(self.args.unix))
+        else:
+            self.attach(*await asyncio.open_connection(self.args.host,
+                                                       self.args.port))
+        await self.request({"type": "IDENTIFY", "username": self.username,
+                            "capabilities": ["PING"]})
+        response = await self.recv()
+        if response.get("message") != "success":
+            raise RuntimeError(f"{self.username} could not log in: "
+                               f"{response.__repr__()}")
+        if self.args.subscribe is not None:
+            await self.request({"type": "SUBSCRIBE",
+                                "events": self.args.subscribe})
+            while (await self.recv()).get("operation") != "SUBSCRIBE":
+                pass
+
+    async def listen(self):
+        async for message in self.messages():
+            kind = message.get("type")
+            self.stats.received[kind] += 1
+            self.stats.bytes["received"] += len(message.encoded)
+            if kind in TIMED:
+                sent = int(message["message"].partition(" ")[0])
+                self.stats.latencies.append(time.monotonic_ns() - sent)
+            elif kind == "PING":
+                await self.request({"type": "PONG"})
+            elif kind == "INVITATION":
+                await self.request({"type": "JOIN_ROOM",
+                                    "roomname": message["roomname"]})
+            elif (kind == "INFO"
+                  and message.get("operation") == "JOIN_ROOM"):
+                self.rooms.add(message["roomname"])
+                self.joined.set()
+
+    async def open_room(self, members):
+        roomname = f"room{self.index}"
+        await self.request({"type": "NEW_ROOM", "roomname": roomname})
+        self.rooms.add(roomname)
+        if members:
+            await self.request({"type": "INVITE", "roomname": roomname,
+                                "usernames": members})
+
+    async def act(self, action):
+        if action == "public":
+            await self.request({"type": "PUBLIC_MESSAGE",
+                                "message": self.stamped()})
+        elif action == "message":
+            peer = self.random.randrange(self.args.clients - 1)
+            peer += peer >= self.index
+            await self.request({"type": "MESSAGE", "username": f"bot{peer}",
+                                "message": self.stamped()})
+        elif action == "room" and self.rooms:
+            roomname = self.random.choice(sorted(self.rooms))
+            await self.request({"type": "ROOM_MESSAGE",
+                                "roomname": roomname,
+                                "message": self.stamped()})
+        elif action == "status":
+            self.status = self.random.choice(
+                [status for status in STATUSES if status != self.status])
+            await self.request({"type": "STATUS", "status": self.status})
+        elif action == "churn":
+            roomname = f"churn-{self.index}-{self.churns}"
+            self.churns += 1
+            await self.request({"type": "NEW_ROOM", "roomname": roomname})
+            await self.request({"type": "LEAVE_ROOM", "roomname": roomname})
+
+    async def run(self, deadline):
+        actions = list(self.args.mix)
+        weights = [self.args.mix[action] for action in actions]
+        interval = 1 / self.args.rate
+        await asyncio.sleep(self.random.random() * interval)
+        while (now := time.monotonic()) < deadline:
+            await self.act(self.random.choices(actions, weights)[0])
+            await asyncio.sleep(min(self.random.expovariate(self.args.rate),
+                                    deadline - now))
+
+
+async def simulate(args):
+    stats = Stats()
+    bots = [Bot(index, args, stats) for index in range(args.clients)]
+    for start in range(0, len(bots), args.connect_batch):
+        await asyncio.gather(*(bot.connect() for bot in
+                               bots[start:start + args.connect_batch]))
+    listeners = [asyncio.create_task(bot.listen()) for bot in bots]
+
+    owners = bots[:args.rooms]
+    for owner in owners:
+        members = [bot.username for bot in bots[len(owners):]
+                   if bot.index % len(owners) == owner.index]
+        await owner.open_room(members)
+    if len(bots) > len(owners):
+        await asyncio.wait_for(asyncio.gather(
+            *(bot.joined.wait() for bot in bots[len(owners):])), 30)
+    stats.sent.clear()
+    stats.received.clear()
+    stats.bytes.clear()
+    stats.latencies.clear()
+
+    start = time.monotonic()
+    await asyncio.gather(*(bot.run(start + args.duration) for bot in bots))
+    elapsed = time.monotonic() - start
+    # let in-flight frames arrive before closing
+    await asyncio.sleep(args.drain)
+    for bot in bots:
+        # without DISCONNECT the server would keep the session to resume
+        try:
+            await bot.send(Message({"type": "DISCONNECT"}))
+        except ConnectionError:
+            pass
+        bot.writer.close()
+    for listener in listeners:
+        listener.cancel()
+    await asyncio.gather(*listeners, return_exceptions=True)
+    return stats, elapsed
+
+
+def report(args, stats, elapsed):
+    latencies = sorted(stats.latencies)
+    delivered = sum(stats.received[kind] for kind in TIMED)
+    return {
+        "label": args.label,
+        "commit": git_commit(),
+        "config": {"clients": args.clients, "duration": args.duration,
+                   "rate": args.rate, "rooms": args.rooms, "mix": args.mix,
+                   "payload": len(args.payload),
+                   "subscribe": args.subscribe},
+        "elapsed": elapsed,
+        "sent": dict(stats.sent),
+        "received": dict(stats.received),
+        "bytes": {"sent": stats.bytes["sent"],
+                  "received": stats.bytes["received"]},
+        "throughput": {
+            "sent_per_s": sum(stats.sent.values()) / elapsed,
+            "delivered_per_s": delivered / elapsed,
+        },
+        "latency_ms": {
+            "samples": len(latencies),
+            "p50": ms(percentile(latencies, 0.5)),
+            "p99": ms(percentile(latencies, 0.99)),
+            "p999": ms(percentile(latencies, 0.999)),
+            "max": ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def ms(nanoseconds):
+    return None if nanoseconds is None else nanoseconds / 1e6
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, baseline):
+    print(f"compared with {baseline.get('label') or baseline.get('commit')}")
+    rows = [("bytes in", "bytes", "received"),
+            ("sent/s", "throughput", "sent_per_s"),
+            ("delivered/s", "throughput", "delivered_per_s"),
+            ("p50 ms", "latency_ms", "p50"),
+            ("p99 ms", "latency_ms", "p99"),
+            ("p999 ms", "latency_ms", "p999")]
+    for name, section, key in rows:
+        new = result[section][key]
+        old = baseline.get(section, {}).get(key)
+        if new is None or not old:
+            continue
+        print(f"{name:>12}: {old:12.3f} -> {new:12.3f} "
+              f"({(new - old) / old:+.1%})")
+
+
+def raise_file_limit(clients):
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = clients * 2 + 64
+    if soft < wanted:
+        limit = wanted if hard == resource.RLIM_INFINITY else min(wanted,
+                                                                   hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+
+
+def spawn_server(args):
+    command = [sys.executable, "server.py", "-m", args.host,
+               "-p", str(args.port), "--silent", *args.server_arg]
+    server = subprocess.Popen(command, cwd=os.path.dirname(
+        os.path.dirname(os.path.abspath(__file__))))
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((args.host, args.port), 0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("The server did not start")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-m", "--host", default=socket.gethostname())
+    parser.add_argument("-p", "--port", type=int, default=8080)
+    parser.add_argument("-c", "--clients", type=int, default=1000)
+    parser.add_argument("-d", "--duration", type=float, default=10,
+                        help="seconds of steady-state load")
+    parser.add_argument("-r", "--rate", type=float, default=1,
+                        help="actions per second of each client")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help=f"weighted actions, default {DEFAULT_MIX}")
+    parser.add_argument("--payload", default="x" * 64,
+                        help="text appended to every chat message")
+    parser.add_argument("--subscribe", type=lambda text: text.split(","),
+                        metavar="EVENTS",
+                        help="event classes each client subscribes to, "
+                        "comma separated, e.g. ROOM_MESSAGES,ROOMS")
+    parser.add_argument("--unix", metavar="PATH",
+                        help="connect over this Unix socket of the server "
+                        "instead of TCP")
+    parser.add_argument("--connect-batch", type=int, default=200)
+    parser.add_argument("--drain", type=float, default=1,
+                        help="seconds to wait for in-flight frames")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", help="name of this run in the results")
+    parser.add_argument("-o", "--output", help="write results to this file")
+    parser.add_argument("--compare", help="results file of a previous run")
+    parser.add_argument("--spawn", action="store_true",
+                        help="start server.py for the run")
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="extra argument for the spawned server")
+    args = parser.parse_args()
+    if args.clients < 2:
+        parser.error("--clients must be at least 2")
+    args.rooms = max(1, min(args.rooms, args.clients))
+    logging.basicConfig(level=logging.WARNING)
+    raise_file_limit(args.clients)
+
+    server = spawn_server(args) if args.spawn else None
+    try:
+        stats, elapsed = asyncio.run(simulate(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    result = report(args, stats, elapsed)
+    print(json.dumps(result, indent=4))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(result, output, indent=4)
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(result, json.load(baseline))
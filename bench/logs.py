@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""Throughput of the server fan-out paths under each logging setup.
+
+"loop" counts only the time the event loop spent, "drained" also waits for
+the background thread to write every queued record.
+"""
+from subscriptions import ALL
+from server import Server
+from message import Message
+import argparse
+import asyncio
+import logging
+import time
+import logs
+import os
+
+
+class Sink:
+    node = None
+    events = ALL
+    muted = None
+    capabilities = frozenset()
+
+    def __init__(self, username):
+        self.username = username
+
+    def post(self, message):
+        return False
+
+
+def direct(level, stream):
+    # what logging.basicConfig in server.py did before the queue
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(logs.FORMAT))
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+SETUPS = {
+    "off": lambda stream: logs.setup(logging.CRITICAL, stream=stream),
+    "info": lambda stream: logs.setup(logging.INFO, stream=stream),
+    "debug direct": lambda stream: direct(logging.DEBUG, stream),
+    "debug queued": lambda stream: logs.setup(logging.DEBUG, stream=stream),
+    "debug json": lambda stream: logs.setup(logging.DEBUG, "json",
+                                            stream=stream),
+    "debug sampled": lambda stream: logs.setup(
+        logging.DEBUG, sample=[("PUBLIC_MESSAGE_FROM", 100),
+                               ("ROOM_MESSAGE_FROM", 100),
+                               ("MESSAGE_FROM", 100)], stream=stream),
+}
+
+
+async def drive(server, messages):
+    room = server.state.rooms["room"]
+    for i in range(messages):
+        if i % 3 == 0:
+            await server.send_to_all("user0", Message(
+                {"type": "PUBLIC_MESSAGE_FROM", "username": "user0",
+                 "message": f"hola {i}"}))
+        elif i % 3 == 1:
+            await server.send_to_room(room, "user0", Message(
+                {"type": "ROOM_MESSAGE_FROM", "roomname": "room",
+                 "username": "user0", "message": f"hola {i}"}))
+        else:
+            await server.send_private_message("user0", "user1", Message(
+                {"type": "MESSAGE_FROM", "username": "user0",
+                 "message": f"hola {i}"}))
+
+
+def measure(setup, users, messages, stream):
+    server = Server("127.0.0.1", 0)
+    for i in range(users):
+        server.state.add_user(f"user{i}", Sink(f"user{i}"))
+    server.state.create_room("room", "user0")
+    for i in range(1, users, 2):
+        server.state.join(server.state.rooms["room"], f"user{i}")
+    setup(stream)
+    start = time.perf_counter()
+    asyncio.run(drive(server, messages))
+    loop = time.perf_counter() - start
+    logs.shutdown()
+    stream.flush()
+    return messages / loop, messages / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-u", "--users", type=int, default=100)
+    parser.add_argument("-n", "--messages", type=int, default=20000)
+    args = parser.parse_args()
+    print(f"{'setup':>14} {'loop msg/s':>12} {'drained msg/s':>14}")
+    with open(os.devnull, "w") as stream:
+        for name, setup in SETUPS.items():
+            loop, drained = measure(setup, args.users, args.messages, stream)
+            print(f"{name:>14} {loop:>12.0f} {drained:>14.0f}")
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""Replay a capture recorded with server.py --capture against a server.
+
+Every captured connection is opened at its original offset and sends its
+frames in order at their original offsets, scaled by --speed; --speed 0
+replays as fast as the server answers. The login latency is the time from
+a connection's first frame, its IDENTIFY, to the server's first reply.
+A server started with --spawn has no rate limits unless --server-arg sets
+them.
+"""
+from bench.load import (UNLIMITED, percentile, ms, git_commit, compare,
+                        raise_file_limit, spawn_server)
+from capture import read_capture, OPEN, FRAME, CLOSE
+from message import Message
+from server import CODECS
+from utils import BaseChat, MessageException
+from collections import Counter
+import argparse
+import asyncio
+import logging
+import socket
+import json
+import time
+
+
+class Session:
+    def __init__(self, connection, opened):
+        self.connection = connection
+        self.opened = opened
+        self.frames = []
+        self.closed = None
+
+
+def load_sessions(path):
+    sessions = {}
+    for kind, connection, elapsed, payload in read_capture(path):
+        if kind == OPEN:
+            sessions[connection] = Session(connection, elapsed)
+        elif kind == FRAME:
+            sessions[connection].frames.append((elapsed, payload))
+        elif kind == CLOSE:
+            sessions[connection].closed = elapsed
+    return sorted(sessions.values(), key=lambda session: session.opened)
+
+
+def plain(frame):
+    """The IDENTIFY of a capture without the codecs it asked for, since the
+    capture holds every frame as JSON."""
+    try:
+        message = Message.from_encoded(frame)
+    except MessageException:
+        return frame
+    if isinstance(message.get("capabilities"), list):
+        message["capabilities"] = [capability for capability
+                                   in message["capabilities"]
+                                   if capability not in CODECS]
+    return message.encoded
+
+
+class Stats:
+    def __init__(self):
+        self.frames = Counter()
+        self.bytes = Counter()
+        self.logins = []
+        self.failed = 0
+        self.last = None
+
+
+class Replayer(BaseChat):
+    def __init__(self, session, args, stats):
+        self.session = session
+        self.args = args
+        self.stats = stats
+        self.identified = None
+
+    async def sleep_until(self, start, elapsed):
+        if self.args.speed:
+            delay = start + elapsed / 1e6 / self.args.speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def listen(self):
+        async for message in self.messages():
+            if self.identified is not None:
+                self.stats.logins.append(time.monotonic_ns()
+                                         - self.identified)
+                self.identified = None
+            self.stats.frames["received"] += 1
+            self.stats.bytes["received"] += len(message.encoded)
+
+    async def run(self, start):
+        session = self.session
+        await self.sleep_until(start, session.opened)
+        try:
+            self.attach(*await asyncio.open_connection(self.args.host,
+                                                       self.args.port))
+        except OSError:
+            self.stats.failed += 1
+            return
+        listener = asyncio.create_task(self.listen())
+        try:
+            for index, (elapsed, frame) in enumerate(session.frames):
+                await self.sleep_until(start, elapsed)
+                if index == 0:
+                    frame = plain(frame)
+                    self.identified = time.monotonic_ns()
+                self.writer.write(frame)
+                await self.writer.drain()
+                self.stats.frames["sent"] += 1
+                self.stats.bytes["sent"] += len(frame)
+                self.stats.last = time.monotonic()
+            if session.closed is not None:
+                await self.sleep_until(start, session.closed)
+            # give the server a moment to answer the last frames
+            await asyncio.sleep(self.args.drain)
+        except ConnectionError:
+            self.stats.failed += 1
+        finally:
+            self.writer.close()
+            listener.cancel()
+            await asyncio.gather(listener, return_exceptions=True)
+
+
+async def replay(args, sessions):
+    stats = Stats()
+    start = time.monotonic()
+    await asyncio.gather(*(Replayer(session, args, stats).run(start)
+                           for session in sessions))
+    # the drain after the last frame isn't part of the replay
+    return stats, (stats.last or time.monotonic()) - start
+
+
+def report(args, sessions, stats, elapsed):
+    logins = sorted(stats.logins)
+    return {
+        "label": args.label,
+        "commit": git_commit(),
+        "config": {"capture": args.capture, "speed": args.speed,
+                   "connections": len(sessions)},
+        "elapsed": elapsed,
+        "failed": stats.failed,
+        "frames": dict(stats.frames),
+        "bytes": {"sent": stats.bytes["sent"],
+                  "received": stats.bytes["received"]},
+        "throughput": {
+            "sent_per_s": stats.frames["sent"] / elapsed,
+            "delivered_per_s": stats.frames["received"] / elapsed,
+        },
+        "latency_ms": {
+            "samples": len(logins),
+            "p50": ms(percentile(logins, 0.5)),
+            "p99": ms(percentile(logins, 0.99)),
+            "p999": ms(percentile(logins, 0.999)),
+            "max": ms(logins[-1] if logins else None),
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("capture", help="file written by server.py --capture")
+    parser.add_argument("-m", "--host", default=socket.gethostname())
+    parser.add_argument("-p", "--port", type=int, default=8080)
+    parser.add_argument("-s", "--speed", type=float, default=1,
+                        help="time scale of the replay, 0 replays as fast "
+                        "as possible")
+    parser.add_argument("--drain", type=float, default=1,
+                        help="seconds each connection waits for replies "
+                        "before closing")
+    parser.add_argument("--label", help="name of this run in the results")
+    parser.add_argument("-o", "--output", help="write results to this file")
+    parser.add_argument("--compare", help="results file of a previous run")
+    parser.add_argument("--spawn", action="store_true",
+                        help="start server.py for the run")
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="extra argument for the spawned server")
+    args = parser.parse_args()
+    if args.speed < 0:
+        parser.error("--speed can't be negative")
+    logging.basicConfig(level=logging.WARNING)
+    sessions = load_sessions(args.capture)
+    raise_file_limit(len(sessions))
+
+    args.server_arg = [*UNLIMITED, *args.server_arg]
+    server = spawn_server(args) if args.spawn else None
+    try:
+        stats, elapsed = asyncio.run(replay(args, sessions))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    result = report(args, sessions, stats, elapsed)
+    print(json.dumps(result, indent=4))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(result, output, indent=4)
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(result, json.load(baseline))
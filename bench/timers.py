@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+from timers import TimingWheel
+import argparse
+import asyncio
+import time
+
+
+def noop():
+    pass
+
+
+async def measure(schedule, connections, rounds):
+    """Microseconds to rearm the timeout of each connection once, as on
+    every frame received, and the timers left in the event loop."""
+    loop = asyncio.get_running_loop()
+    timers = [schedule(30, noop) for _ in range(connections)]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for i, timer in enumerate(timers):
+            timer.cancel()
+            timers[i] = schedule(30, noop)
+    elapsed = (time.perf_counter() - start) / (connections * rounds)
+    scheduled = len(loop._scheduled)
+    for timer in timers:
+        timer.cancel()
+    return elapsed, scheduled
+
+
+async def main(rounds):
+    print(f"{'connections':>11} {'call_later µs':>14} {'handles':>8} "
+          f"{'wheel µs':>9} {'handles':>8}")
+    for connections in [1_000, 10_000, 100_000]:
+        loop = asyncio.get_running_loop()
+        later, later_handles = await measure(loop.call_later, connections,
+                                             rounds)
+        # let the loop drop the cancelled handles before the next run
+        await asyncio.sleep(0)
+        wheel = TimingWheel()
+        timed, wheel_handles = await measure(wheel.schedule, connections,
+                                             rounds)
+        wheel.close()
+        print(f"{connections:>11} {later * 1e6:>14.2f} {later_handles:>8} "
+              f"{timed * 1e6:>9.2f} {wheel_handles:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--rounds", type=int, default=5,
+                        help="times each connection's timeout is rearmed")
+    args = parser.parse_args()
+    asyncio.run(main(args.rounds))
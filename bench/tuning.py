@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Delivery latency of bench.load against servers started with each of the
+socket and listener options of server.py, next to one with the defaults.
+
+Every case starts its own server, without rate limits, and runs the same
+load on it, so only the option changes between rows. The second bind and
+Unix socket cases send the load to that listener instead of the main one.
+"""
+from bench.load import (DEFAULT_MIX, UNLIMITED, parse_mix, raise_file_limit,
+                        simulate, spawn_server, percentile, ms)
+from listeners import LOOPS
+import importlib.util
+import argparse
+import asyncio
+import logging
+import tempfile
+import os
+
+
+def cases(args, sockets):
+    path = os.path.join(sockets, "chat.sock")
+    yield "defaults", [], {}
+    yield "Nagle on", ["--no-nodelay"], {}
+    yield "backlog 4096", ["--backlog=4096"], {}
+    yield "4 KiB socket buffers", ["--sndbuf=4096", "--rcvbuf=4096"], {}
+    yield "4 KiB stream limits", ["--read-limit=4096",
+                                  "--write-limit=4096"], {}
+    yield ("second bind", [f"--bind={args.host}:{args.port + 1}"],
+           {"port": args.port + 1})
+    yield "Unix socket", [f"--bind=unix:{path}"], {"unix": path}
+    for loop in LOOPS[1:]:
+        if importlib.util.find_spec(loop) is not None:
+            yield loop, [f"--loop={loop}"], {}
+
+
+def run(args, server_args, load):
+    server = spawn_server(argparse.Namespace(
+        **vars(args), server_arg=[*UNLIMITED, *server_args]))
+    case = argparse.Namespace(**{**vars(args), "unix": None,
+                                 "subscribe": None, **load})
+    try:
+        stats, elapsed = asyncio.run(simulate(case))
+    finally:
+        server.terminate()
+        server.wait()
+    latencies = sorted(stats.latencies)
+    return (len(latencies) / elapsed,
+            *(ms(percentile(latencies, fraction))
+              for fraction in (0.5, 0.99, 0.999)))
+
+
+def main(args):
+    print(f"{'case':>22} {'delivered/s':>12} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'p999 ms':>8}")
+    with tempfile.TemporaryDirectory(prefix="pumachat-") as sockets:
+        for name, server_args, load in cases(args, sockets):
+            rate, p50, p99, p999 = run(args, server_args, load)
+            print(f"{name:>22} {rate:>12.1f} {p50:>8.3f} {p99:>8.3f} "
+                  f"{p999:>8.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8080)
+    parser.add_argument("-c", "--clients", type=int, default=200)
+    parser.add_argument("-d", "--duration", type=float, default=5,
+                        help="seconds of steady-state load of each case")
+    parser.add_argument("-r", "--rate", type=float, default=5,
+                        help="actions per second of each client")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument("--payload", default="x" * 64)
+    parser.add_argument("--connect-batch", type=int, default=200)
+    parser.add_argument("--drain", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    args.label = None
+    args.rooms = max(1, min(args.rooms, args.clients))
+    logging.basicConfig(level=logging.WARNING)
+    raise_file_limit(args.clients)
+    main(args)
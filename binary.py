@@ -0,0 +1,240 @@
+from framing import HEADER, LengthDecoder
+from message import Message
+import struct
+import utils
+
+# Interned strings, sent as their index in a single byte. Only ever append
+# to them, the indexes are part of the protocol.
+TYPES = (
+    "ERROR", "WARNING", "INFO", "IDENTIFY", "STATUS", "USERS", "MESSAGE",
+    "PUBLIC_MESSAGE", "NEW_ROOM", "INVITE", "JOIN_ROOM", "ROOM_USERS",
+    "ROOM_MESSAGE", "LEAVE_ROOM", "DISCONNECT", "RESUME", "HISTORY", "STATS",
+    "SUBSCRIBE", "PING", "PONG", "NEW_USER", "NEW_STATUS", "USER_LIST",
+    "USER_LIST_DELTA", "MESSAGE_FROM", "PUBLIC_MESSAGE_FROM", "JOINED_ROOM",
+    "ROOM_USER_LIST", "ROOM_USER_LIST_DELTA", "ROOM_MESSAGE_FROM",
+    "INVITATION", "LEFT_ROOM", "DISCONNECTED", "HISTORY_LIST", "STATS_REPORT",
+    "PRESENCE_UPDATE",
+)
+KEYS = (
+    "type", "message", "username", "roomname", "operation", "status",
+    "usernames", "users", "version", "since", "added", "removed", "after",
+    "limit", "cursor", "before", "messages", "token", "offset",
+    "capabilities", "events", "mute", "retry_after", "stats",
+)
+
+_TYPES = {name: code for code, name in enumerate(TYPES)}
+_KEYS = {name: code for code, name in enumerate(KEYS)}
+_TYPE = _KEYS["type"]
+
+_UINT8 = struct.Struct(">BB")
+_UINT16 = struct.Struct(">BH")
+_UINT32 = struct.Struct(">BI")
+_UINT64 = struct.Struct(">BQ")
+_INT64 = struct.Struct(">Bq")
+_FLOAT = struct.Struct(">Bd")
+
+
+def _pack_str(value, out):
+    data = value.encode("utf8")
+    size = len(data)
+    if size < 0x20:
+        out.append(0xa0 | size)
+    elif size < 0x100:
+        out += _UINT8.pack(0xd9, size)
+    elif size < 0x10000:
+        out += _UINT16.pack(0xda, size)
+    else:
+        out += _UINT32.pack(0xdb, size)
+    out += data
+
+
+def _pack_int(value, out):
+    if 0 <= value < 0x80:
+        out.append(value)
+    elif -0x20 <= value < 0:
+        out.append(value & 0xff)
+    elif 0 <= value < 0x100:
+        out += _UINT8.pack(0xcc, value)
+    elif 0 <= value < 0x10000:
+        out += _UINT16.pack(0xcd, value)
+    elif 0 <= value < 0x100000000:
+        out += _UINT32.pack(0xce, value)
+    elif 0 <= value < 2 ** 64:
+        out += _UINT64.pack(0xcf, value)
+    elif -2 ** 63 <= value < 0:
+        out += _INT64.pack(0xd3, value)
+    else:
+        raise ValueError(f"Integer out of range: {value}")
+
+
+def _pack_header(size, small, tag16, tag32, out):
+    if size < 0x10:
+        out.append(small | size)
+    elif size < 0x10000:
+        out += _UINT16.pack(tag16, size)
+    else:
+        out += _UINT32.pack(tag32, size)
+
+
+def _pack_map(value, out):
+    _pack_header(len(value), 0x80, 0xde, 0xdf, out)
+    for key, item in value.items():
+        code = _KEYS.get(key)
+        if code is not None:
+            out.append(code)
+        elif type(key) is str:
+            _pack_str(key, out)
+        else:
+            raise TypeError(f"Keys must be str, got {key!r}")
+        if code == _TYPE:
+            if type(item) is str and item in _TYPES:
+                out.append(_TYPES[item])
+                continue
+            if type(item) is int and 0 <= item < 0x80:
+                # a fixint would read as an interned type
+                out += _UINT8.pack(0xcc, item)
+                continue
+        _pack(item, out)
+
+
+def _pack(value, out):
+    kind = type(value)
+    if kind is str:
+        _pack_str(value, out)
+    elif kind is dict:
+        _pack_map(value, out)
+    elif kind is int:
+        _pack_int(value, out)
+    elif kind is list or kind is tuple:
+        _pack_header(len(value), 0x90, 0xdc, 0xdd, out)
+        for item in value:
+            _pack(item, out)
+    elif value is None:
+        out.append(0xc0)
+    elif value is True:
+        out.append(0xc3)
+    elif value is False:
+        out.append(0xc2)
+    elif kind is float:
+        out += _FLOAT.pack(0xcb, value)
+    else:
+        raise TypeError(f"Can't encode {kind.__name__}")
+
+
+def _unpack_str(data, pos, size):
+    end = pos + size
+    if end > len(data):
+        raise ValueError("Truncated string")
+    return data[pos:end].decode("utf8"), end
+
+
+def _unpack_map(data, pos, size):
+    result = {}
+    for _ in range(size):
+        byte = data[pos]
+        if byte < 0x80:
+            key = KEYS[byte]
+            pos += 1
+        else:
+            key, pos = _unpack(data, pos)
+            if type(key) is not str:
+                raise ValueError("Keys must be str")
+        if key == "type" and data[pos] < 0x80:
+            result[key] = TYPES[data[pos]]
+            pos += 1
+        else:
+            result[key], pos = _unpack(data, pos)
+    return result, pos
+
+
+def _unpack_list(data, pos, size):
+    result = []
+    for _ in range(size):
+        item, pos = _unpack(data, pos)
+        result.append(item)
+    return result, pos
+
+
+def _unpack(data, pos):
+    byte = data[pos]
+    pos += 1
+    if byte < 0x80:
+        return byte, pos
+    if byte >= 0xe0:
+        return byte - 0x100, pos
+    if byte >= 0xa0 and byte < 0xc0:
+        return _unpack_str(data, pos, byte & 0x1f)
+    if byte < 0x90:
+        return _unpack_map(data, pos, byte & 0x0f)
+    if byte < 0xa0:
+        return _unpack_list(data, pos, byte & 0x0f)
+    if byte == 0xc0:
+        return None, pos
+    if byte == 0xc2:
+        return False, pos
+    if byte == 0xc3:
+        return True, pos
+    if byte == 0xd9:
+        return _unpack_str(data, pos + 1, data[pos])
+    fixed = _FIXED.get(byte)
+    if fixed is not None:
+        fmt, size = fixed
+        return fmt.unpack_from(data, pos)[0], pos + size
+    sized = _SIZED.get(byte)
+    if sized is None:
+        raise ValueError(f"Unknown tag {byte:#x}")
+    fmt, read = sized
+    size, = fmt.unpack_from(data, pos)
+    return read(data, pos + fmt.size, size)
+
+
+_FIXED = {tag: (struct.Struct(fmt), struct.calcsize(fmt))
+          for tag, fmt in [(0xcc, ">B"), (0xcd, ">H"), (0xce, ">I"),
+                           (0xcf, ">Q"), (0xd3, ">q"), (0xcb, ">d")]}
+_SIZED = {0xda: (struct.Struct(">H"), _unpack_str),
+          0xdb: (struct.Struct(">I"), _unpack_str),
+          0xdc: (struct.Struct(">H"), _unpack_list),
+          0xdd: (struct.Struct(">I"), _unpack_list),
+          0xde: (struct.Struct(">H"), _unpack_map),
+          0xdf: (struct.Struct(">I"), _unpack_map)}
+
+
+def pack(fields):
+    """A frame as it goes on the wire: its length and fields in the
+    MessagePack format, with interned keys and types."""
+    out = bytearray(HEADER.size)
+    _pack(fields, out)
+    HEADER.pack_into(out, 0, len(out) - HEADER.size)
+    return bytes(out)
+
+
+def unpack(payload):
+    """The fields of a frame payload."""
+    try:
+        fields, end = _unpack(payload, 0)
+    except (IndexError, ValueError, UnicodeDecodeError, struct.error,
+            RecursionError):
+        raise utils.MessageException("Mensaje binario inválido") from None
+    if end != len(payload) or type(fields) is not dict:
+        raise utils.MessageException("Mensaje binario inválido")
+    return fields
+
+
+class Binary:
+    """The BINARY capability: frames in a subset of MessagePack, so they
+    decode without a JSON parser and without the keys the protocol
+    repeats in every message."""
+
+    name = "BINARY"
+
+    def encode(self, message):
+        return pack(message.store)
+
+    def decode(self, frame):
+        return Message.from_store(unpack(frame))
+
+    def decoder(self, **options):
+        return LengthDecoder(**options)
+
+
+BINARY = Binary()
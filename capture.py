@@ -0,0 +1,67 @@
+import itertools
+import struct
+import time
+
+MAGIC = b"PUMACAP1"
+
+OPEN = 0
+FRAME = 1
+CLOSE = 2
+
+# kind, connection, microseconds since the capture started, payload length
+RECORD = struct.Struct("<BIQI")
+
+
+class CaptureWriter:
+    """Records the inbound frames of every connection to a binary log.
+
+    The log is the MAGIC header followed by RECORD headers, each one
+    followed by its payload: the frame bytes for FRAME and the peer address
+    for OPEN. Writes go through a buffered file so a record costs a memory
+    copy on the event loop.
+    """
+
+    def __init__(self, path, buffering=2 ** 16):
+        self.file = open(path, "wb", buffering=buffering)
+        self.file.write(MAGIC)
+        self.start = time.monotonic_ns()
+        self._ids = itertools.count()
+
+    def _write(self, kind, connection, payload=b""):
+        elapsed = (time.monotonic_ns() - self.start) // 1000
+        self.file.write(RECORD.pack(kind, connection, elapsed, len(payload)))
+        self.file.write(payload)
+
+    def open(self, peer=""):
+        connection = next(self._ids)
+        self._write(OPEN, connection, str(peer).encode("utf8"))
+        return connection
+
+    def frame(self, connection, frame):
+        self._write(FRAME, connection, frame)
+
+    def close(self, connection):
+        self._write(CLOSE, connection)
+
+    def flush(self):
+        self.file.flush()
+
+    def shutdown(self):
+        self.file.close()
+
+
+def read_capture(path):
+    """Yield (kind, connection, microseconds, payload) from a capture.
+
+    A truncated last record, as left by a server that was killed, ends the
+    capture.
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a pumachat capture")
+        while len(header := file.read(RECORD.size)) == RECORD.size:
+            kind, connection, elapsed, length = RECORD.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length:
+                return
+            yield kind, connection, elapsed, payload
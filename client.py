@@ -1,38 +1,39 @@
 #!/usr/bin/env python
-from utils import BaseChat, MessageException
+from utils import MessageException
 from message import Message
-from prompt_toolkit import PromptSession
-from prompt_toolkit.patch_stdout import patch_stdout
+from connection import Connection
+from compression import DEFLATE
+from binary import BINARY
 import asyncio
 import socket
 import logging
 import argparse
+import json
 import sys
 
 
-class Client(BaseChat):
+class Client(Connection):
+    """The terminal interface of the chat, prompt_toolkit is only imported
+    once it runs."""
 
-    def __init__(self, host, port):
-        self.host = host
-        self.port = port
-        self.reader = None
-        self.writer = None
-        self.session = PromptSession()
+    session = None
 
-    async def connect(self):
-        self.reader, self.writer = await \
-            asyncio.open_connection(self.host, self.port)
+    async def prompt(self, text):
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.patch_stdout import patch_stdout
+        if self.session is None:
+            self.session = PromptSession()
+        with patch_stdout():
+            return await self.session.prompt_async(text)
 
     async def run(self):
         try:
             while True:
                 await self.connect()
-                if not await self.login():
-                    with patch_stdout():
-                        if (await self.session.prompt_async(
-                                "Reintentar login? [y/n] "
-                        )).lower() in ["yes", "y"]:
-                            continue
+                if not await self.prompt_login():
+                    answer = await self.prompt("Reintentar login? [y/n] ")
+                    if answer.lower() in ["yes", "y"]:
+                        continue
                 break
             send_task = asyncio.create_task(self.send_messages())
             recv_task = asyncio.create_task(self.recv_messages())
@@ -51,12 +52,9 @@ class Client(BaseChat):
         finally:
             await self.cleanup()
 
-    async def login(self):
-        with patch_stdout():
-            username = await self.session.prompt_async("Enter your username: ")
-        await self.send(Message({"type": "IDENTIFY",
-                                 "username": username}))
-        response = await self.recv()
+    async def prompt_login(self):
+        username = await self.prompt("Enter your username: ")
+        response = await self.login(username)
         logging.debug(f"Received: {response.__repr__()}")
         match response:
             case {"type": "INFO", "message": "success"}:
@@ -71,8 +69,7 @@ class Client(BaseChat):
 
     async def send_messages(self):
         while True:
-            with patch_stdout():
-                msg = await self.session.prompt_async("> ")
+            msg = await self.prompt("> ")
             if not msg.startswith("/"):
                 await self.send(Message({"type": "PUBLIC_MESSAGE",
                                          "message": msg}))
@@ -152,6 +149,8 @@ class Client(BaseChat):
                         print("Uso: /leave_room\n")
 
                     case [("/disconnect" | "/DISCONNECT")]:
+                        # the server ends the session, don't resume it
+                        self.token = None
                         await self.send(Message({"type": "DISCONNECT"}))
                         sys.exit(0)
 
@@ -164,96 +163,168 @@ class Client(BaseChat):
                               "/room_message, /leave_room, /disconnect\n")
 
     async def recv_messages(self):
-        while True:
-            response = await self.recv()
-            logging.debug(f"Received: {response.__repr__()}")
-            match response:
-                case {"type": "NEW_USER", "username": username}:
-                    print(f"*{username} se conectó*")
-
-                case {"type": "NEW_STATUS", "username": username,
-                      "status": status}:
-                    print(f"*{username} cambio su estado a {status}*")
-
-                case {"type": "USER_LIST", "usernames": usernames}:
-                    print(f"*Usuarios conectados: {', '.join(usernames)}*")
-
-                case {"type": "MESSAGE_FROM", "username": username,
-                      "message": message}:
-                    print(f"(privado) {username}: {message}")
-
-                case {"type": "PUBLIC_MESSAGE_FROM", "username": username,
-                      "message": message}:
-                    print(f"{username}: {message}")
-
-                case {"type": "JOINED_ROOM", "roomname": roomname,
-                      "username": username}:
-                    print(f"*{username} se unió a {roomname}*")
-
-                case {"type": "ROOM_USER_LIST", "usernames": usernames}:
-                    print(f"*Usuarios en {roomname}: {', '.join(usernames)}*")
-
-                case {"type": "ROOM_MESSAGE_FROM", "roomname": roomname,
-                      "username": username, "message": message}:
-                    print(f"({roomname}) {username}: {message}")
-
-                case {"type": "INVITATION", "username": _,
-                      "roomname": _, "message": message}:
-                    print(f"*{message}*")
-
-                case {"type": "LEFT_ROOM", "roomname": roomname,
-                      "username": username}:
-                    print(f"*{username} abandonó {roomname}*")
-
-                case {"type": "DISCONNECTED", "username": username}:
-                    print(f"*{username} se desconectó*")
-
-                case {"type": "INFO", "operation": "STATUS",
-                      "message": "success"}:
-                    print("*Cambio de estado exitoso*")
-
-                case {"type": "INFO", "operation": "NEW_ROOM",
-                      "roomname": roomname, "message": "success"}:
-                    print(f"*Se creó el cuarto {roomname}*")
-
-                case {"type": "INFO", "operation": "INVITE",
-                      "roomname": roomname, "message": "success"}:
-                    print(f"*Invitaciones a {roomname} enviadas*")
-
-                case {"type": "INFO", "operation": "JOIN_ROOM",
-                      "roomname": roomname, "message": "success"}:
-                    print(f"*Te uniste a {roomname}*")
-
-                case {"type": "INFO", "operation": "LEAVE_ROOM",
-                      "roomname": roomname, "message": "success"}:
-                    print(f"*Abandonaste el cuarto {roomname}*")
-
-                case {"type": "WARNING", "message": message,
-                      "operation": (
-                          "STATUS"
-                          | "MESSAGE"
-                          | "NEW_ROOM"
-                          | "INVITE"
-                          | "JOIN_ROOM"
-                          | "ROOM_USERS"
-                          | "ROOM_MESSAGE"
-                          | "LEAVE_ROOM"
-                      )}:
-                    print(f"*{message}*")
-
-                case _:
-                    logging.debug("Mensaje no reconocido",
-                                  response.__repr__())
+        async for response in self.events():
+            self.show(response)
+        raise ConnectionResetError("El servidor cerró la conexión")
+
+    async def reconnect(self):
+        if self.token is not None:
+            print("*Conexión perdida, reconectando...*")
+        if not await super().reconnect():
+            return False
+        print("*Conexión recuperada*")
+        return True
+
+    def show(self, response):
+        logging.debug(f"Received: {response.__repr__()}")
+        match response:
+            case {"type": "NEW_USER", "username": username}:
+                print(f"*{username} se conectó*")
+
+            case {"type": "NEW_STATUS", "username": username,
+                  "status": status}:
+                print(f"*{username} cambio su estado a {status}*")
+
+            case {"type": "USER_LIST", "usernames": usernames}:
+                print(f"*Usuarios conectados: {', '.join(usernames)}*")
+
+            case {"type": "MESSAGE_FROM", "username": username,
+                  "message": message}:
+                print(f"(privado) {username}: {message}")
+
+            case {"type": "PUBLIC_MESSAGE_FROM", "username": username,
+                  "message": message}:
+                print(f"{username}: {message}")
+
+            case {"type": "JOINED_ROOM", "roomname": roomname,
+                  "username": username}:
+                print(f"*{username} se unió a {roomname}*")
+
+            case {"type": "ROOM_USER_LIST", "roomname": roomname,
+                  "usernames": usernames}:
+                print(f"*Usuarios en {roomname}: {', '.join(usernames)}*")
+
+            case {"type": "ROOM_MESSAGE_FROM", "roomname": roomname,
+                  "username": username, "message": message}:
+                print(f"({roomname}) {username}: {message}")
+
+            case {"type": "INVITATION", "username": _,
+                  "roomname": _, "message": message}:
+                print(f"*{message}*")
+
+            case {"type": "LEFT_ROOM", "roomname": roomname,
+                  "username": username}:
+                print(f"*{username} abandonó {roomname}*")
+
+            case {"type": "DISCONNECTED", "username": username}:
+                print(f"*{username} se desconectó*")
+
+            case {"type": "PRESENCE_UPDATE", "users": users}:
+                for username, status in users.items():
+                    if username == self.username:
+                        continue
+                    elif status is None:
+                        print(f"*{username} se desconectó*")
+                    else:
+                        print(f"*{username} está {status}*")
+
+            case {"type": "INFO", "operation": "STATUS",
+                  "message": "success"}:
+                print("*Cambio de estado exitoso*")
+
+            case {"type": "INFO", "operation": "NEW_ROOM",
+                  "roomname": roomname, "message": "success"}:
+                print(f"*Se creó el cuarto {roomname}*")
+
+            case {"type": "INFO", "operation": "INVITE",
+                  "roomname": roomname, "message": "success"}:
+                print(f"*Invitaciones a {roomname} enviadas*")
+
+            case {"type": "INFO", "operation": "JOIN_ROOM",
+                  "roomname": roomname, "message": "success"}:
+                print(f"*Te uniste a {roomname}*")
+
+            case {"type": "INFO", "operation": "LEAVE_ROOM",
+                  "roomname": roomname, "message": "success"}:
+                print(f"*Abandonaste el cuarto {roomname}*")
+
+            case {"type": "WARNING", "message": message,
+                  "retry_after": _}:
+                print(f"*{message}*")
+
+            case {"type": "WARNING", "message": message,
+                  "operation": (
+                      "STATUS"
+                      | "MESSAGE"
+                      | "NEW_ROOM"
+                      | "INVITE"
+                      | "JOIN_ROOM"
+                      | "ROOM_USERS"
+                      | "ROOM_MESSAGE"
+                      | "LEAVE_ROOM"
+                      | "RESUME"
+                  )}:
+                print(f"*{message}*")
+
+            case _:
+                logging.debug("Mensaje no reconocido",
+                              response.__repr__())
 
     async def cleanup(self):
+        if self.task is not None:
+            self.task.cancel()
         if self.writer is not None:
             self.writer.close()
             await self.writer.wait_closed()
 
 
-async def main(host, port):
-    client = Client(host, port)
-    await client.run()
+async def bot(connection, username):
+    """Log in as username, send every JSON object read from stdin as a
+    request and print the replies and events as JSON, one per line."""
+    await connection.connect()
+    response = await connection.login(username)
+    print(json.dumps(response.store, ensure_ascii=False), flush=True)
+    if connection.task is None:
+        await connection.close()
+        return
+
+    async def show_events():
+        async for event in connection.events():
+            print(json.dumps(event.store, ensure_ascii=False), flush=True)
+
+    def show_reply(future):
+        if not future.cancelled() and future.exception() is None:
+            print(json.dumps(future.result().store, ensure_ascii=False),
+                  flush=True)
+
+    events = asyncio.create_task(show_events())
+    loop = asyncio.get_running_loop()
+    try:
+        while line := await loop.run_in_executor(None, sys.stdin.readline):
+            try:
+                fields = json.loads(line)
+            except ValueError:
+                print(f"JSON inválido: {line.strip()}", file=sys.stderr)
+                continue
+            if not isinstance(fields, dict) or "type" not in fields:
+                print(f"Se esperaba un objeto con type: {line.strip()}",
+                      file=sys.stderr)
+                continue
+            # quiet requests have no future, their failures are events
+            future = await connection.request(**fields)
+            if future is not None:
+                future.add_done_callback(show_reply)
+        await connection.sync()
+    finally:
+        await connection.close()
+        await events
+
+
+async def main(host, port, codecs, username=None):
+    if username is not None:
+        await bot(Connection(host, port, codecs), username)
+    else:
+        await Client(host, port, codecs).run()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -263,15 +334,27 @@ if __name__ == "__main__":
                         help="port to connect to on server host")
     parser.add_argument("--debug", action="store_true",
                         help="show debug information")
+    parser.add_argument("--binary", action="store_true",
+                        help="ask the server for the BINARY codec")
+    parser.add_argument("--compression", action="store_true",
+                        help="ask the server to compress the messages")
+    parser.add_argument("--bot", metavar="USERNAME",
+                        help="log in as USERNAME without the terminal "
+                        "interface, send each JSON object read from stdin "
+                        "and print what the server sends as JSON lines")
     args = parser.parse_args()
     format = "%(levelname)s [%(name)s: %(lineno)d] %(message)s"
     if args.debug:
         logging.basicConfig(level=logging.DEBUG, format=format)
     else:
         logging.basicConfig(level=logging.CRITICAL, format=format)
+    codecs = [codec for codec, wanted in [(BINARY, args.binary),
+                                          (DEFLATE, args.compression)]
+              if wanted]
     try:
-        asyncio.run(main(args.host, args.port))
+        asyncio.run(main(args.host, args.port, codecs, args.bot))
     except KeyboardInterrupt:
         pass
     finally:
-        print("Cerrando el chat, adiós")
+        if args.bot is None:
+            print("Cerrando el chat, adiós")
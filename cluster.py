@@ -0,0 +1,383 @@
+from utils import BaseChat, MessageException
+from message import Message
+from dispatch import Dispatcher
+from outbox import Outbox, SlowConsumerPolicy
+from history import PUBLIC
+import multiprocessing
+import itertools
+import signal
+import asyncio
+import logging
+import zlib
+
+CLAIM_TIMEOUT = 5
+CLAIM_TTL = 10
+RETRY_MIN = 0.05
+RETRY_MAX = 5
+LINK_HIGH_WATER = 2 ** 24
+LINK_LOW_WATER = 2 ** 22
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Expected HOST:PORT, got {text!r}")
+    return host.strip("[]"), int(port)
+
+
+async def open_stream(address):
+    if isinstance(address, str):
+        return await asyncio.open_unix_connection(address)
+    return await asyncio.open_connection(*address)
+
+
+async def start_stream_server(callback, address):
+    if isinstance(address, str):
+        return await asyncio.start_unix_server(callback, address)
+    return await asyncio.start_server(callback, *address)
+
+
+class RemoteUser:
+    __slots__ = ("username", "node", "status")
+
+    def __init__(self, username, node, status="ACTIVE"):
+        self.username = username
+        self.node = node
+        self.status = status
+
+
+class Link(BaseChat):
+    """Connection to another node of the chat."""
+
+    def __init__(self, reader, writer):
+        self.attach(reader, writer)
+        self.node = None
+        self.outbox = Outbox(writer, SlowConsumerPolicy(
+            SlowConsumerPolicy.BLOCK, LINK_HIGH_WATER, LINK_LOW_WATER))
+        self.outbox.start()
+
+    async def send(self, message):
+        await self.outbox.put(message.encoded)
+
+    def post(self, message):
+        self.outbox.offer(message.encoded)
+
+    async def close(self):
+        await self.outbox.close()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+class Cluster:
+    """Replicates the user and room directory between the nodes of a chat.
+
+    Every node keeps a full ChatState replica. A node is authoritative for
+    the users connected to it: it publishes their logins, status changes,
+    room memberships and disconnections, and frames for remote users travel
+    once per node. Usernames and room names are claimed from an arbiter
+    node chosen by rendezvous hashing among the reachable nodes, so two
+    nodes never hand out the same name at once. If a partition let two
+    nodes log in the same username anyway, every node keeps the user of
+    the node that ranks first for that name once the partition heals.
+
+    nodes maps every node id, including this one, to the address its links
+    listen on: a Unix socket path or a (host, port) pair.
+    """
+
+    events = Dispatcher()
+
+    def __init__(self, node, nodes):
+        self.node = node
+        self.nodes = dict(nodes)
+        self.server = None
+        self.links = {}
+        self.reserved = {}
+        self.claims = {}
+        self.listener = None
+        self._ids = itertools.count()
+        self._tasks = []
+
+    async def start(self, server):
+        self.server = server
+        self.listener = await start_stream_server(self.accept,
+                                                  self.nodes[self.node])
+        # the node with the greater id dials, so each pair gets one link
+        for node in self.nodes:
+            if node < self.node:
+                self._tasks.append(asyncio.create_task(self.connect(node)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        if self.listener is not None:
+            self.listener.close()
+        for link in list(self.links.values()):
+            await link.close()
+
+    async def connect(self, node):
+        delay = RETRY_MIN
+        while True:
+            try:
+                reader, writer = await open_stream(self.nodes[node])
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RETRY_MAX)
+                continue
+            delay = RETRY_MIN
+            link = Link(reader, writer)
+            await link.send(Message({"type": "NODE", "node": self.node}))
+            await self.run_link(link)
+
+    async def accept(self, reader, writer):
+        await self.run_link(Link(reader, writer), reply=True)
+
+    async def run_link(self, link, reply=False):
+        try:
+            match await link.recv():
+                case {"type": "NODE", "node": str(node)} if (
+                        node in self.nodes and node != self.node):
+                    pass
+                case message:
+                    raise MessageException("Expected message of type: "
+                                           "'NODE', got " + message.__repr__())
+            if reply:
+                link.post(Message({"type": "NODE", "node": self.node}))
+            self.register(link, node)
+            async for event in link.messages():
+                try:
+                    await Cluster.events.dispatch(self, link, event)
+                except Exception:
+                    # one bad event must not end the link, nor the redialing
+                    logging.exception("Event from node %s failed: %r",
+                                      link.node, event)
+        except (MessageException, ValueError, asyncio.IncompleteReadError,
+                ConnectionError) as e:
+            logging.warning("Link to %s failed: %s", link.node, e)
+        finally:
+            await self.unregister(link)
+
+    def register(self, link, node):
+        # nothing may be awaited between queueing the snapshot and adding
+        # the link, or events published in between would be lost
+        link.node = node
+        previous = self.links.get(node)
+        if previous is not None:
+            previous.writer.transport.abort()
+        link.post(self.snapshot())
+        self.links[node] = link
+        logging.info("Linked to node %s", node)
+
+    async def unregister(self, link):
+        if link.node is not None and self.links.get(link.node) is link:
+            del self.links[link.node]
+            for (node, future) in self.claims.values():
+                if node == link.node and not future.done():
+                    future.set_result(False)
+            await self.server.node_down(link.node)
+        await link.close()
+
+    def snapshot(self):
+        state = self.server.state
+        rooms = {}
+        for username in state.local:
+            for roomname in state.memberships[username]:
+                rooms.setdefault(roomname, ([], []))[0].append(username)
+            for roomname in state.invitations[username]:
+                rooms.setdefault(roomname, ([], []))[1].append(username)
+        users = [[username, user.status]
+                 for username, user in state.local.items()]
+        rooms = [[roomname, users, invites]
+                 for roomname, (users, invites) in rooms.items()]
+        return Message({"type": "SYNC", "users": users, "rooms": rooms})
+
+    def arbiters(self, name):
+        return sorted(self.nodes, key=lambda node: zlib.crc32(
+            f"{node}\x00{name}".encode("utf8")), reverse=True)
+
+    def prevails(self, name, node, other):
+        for arbiter in self.arbiters(name):
+            if arbiter in (node, other):
+                return arbiter == node
+
+    async def claim(self, kind, name):
+        for node in self.arbiters(name):
+            if node == self.node:
+                return self.reserve(kind, name, self.node)
+            if node in self.links:
+                break
+        claim = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self.claims[claim] = (node, future)
+        try:
+            await self.links[node].send(Message({"type": "CLAIM",
+                                                 "kind": kind,
+                                                 "name": name,
+                                                 "id": claim}))
+            return await asyncio.wait_for(future, CLAIM_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning("Claim of %s %s timed out", kind, name)
+            return False
+        finally:
+            del self.claims[claim]
+
+    def reserve(self, kind, name, node):
+        state = self.server.state
+        taken = state.users if kind == "user" else state.rooms
+        if name in taken or (kind, name) in self.reserved:
+            return False
+        self.reserved[(kind, name)] = node
+        asyncio.get_running_loop().call_later(
+            CLAIM_TTL, self.reserved.pop, (kind, name), None)
+        return True
+
+    async def publish(self, event):
+        if event["type"] == "USER_UP":
+            self.reserved.pop(("user", event["username"]), None)
+        elif event["type"] == "ROOM_JOIN":
+            self.reserved.pop(("room", event["roomname"]), None)
+        for link in list(self.links.values()):
+            await link.send(event)
+
+    async def broadcast(self, message, exclude):
+        await self.publish(Message({"type": "BROADCAST",
+                                    "frame": dict(message),
+                                    "exclude": exclude}))
+
+    async def forward(self, node, usernames, message):
+        link = self.links.get(node)
+        if link is not None:
+            await link.send(Message({"type": "DELIVER",
+                                     "frame": dict(message),
+                                     "to": usernames}))
+
+    @events.handler("CLAIM", kind=("user", "room"), name=str, id=int)
+    async def on_claim(self, link, kind, name, id):
+        await link.send(Message({"type": "CLAIMED", "id": id,
+                                 "granted": self.reserve(kind, name,
+                                                         link.node)}))
+
+    @events.handler("CLAIMED", id=int, granted=bool)
+    async def on_claimed(self, link, id, granted):
+        node, future = self.claims.get(id, (None, None))
+        if future is not None and not future.done():
+            future.set_result(granted)
+
+    @events.handler("SYNC", users=list, rooms=list)
+    async def on_sync(self, link, users, rooms):
+        state = self.server.state
+        for username, status in users:
+            # unlike USER_UP no NEW_USER follows, the node may have been
+            # unreachable when the user logged in
+            if await self.add_user(link, username, status):
+                await self.server.deliver(
+                    (user for name, user in state.local.items()),
+                    Message({"type": "NEW_USER", "username": username}))
+        for roomname, members, invitees in rooms:
+            room = state.ensure_room(roomname)
+            for username in members:
+                if username in state.users:
+                    state.join(room, username)
+            for username in invitees:
+                if username in state.users:
+                    state.invite(room, username)
+
+    @events.handler("USER_UP", username=str, status=str)
+    async def on_user_up(self, link, username, status):
+        await self.add_user(link, username, status)
+
+    async def add_user(self, link, username, status):
+        state = self.server.state
+        self.reserved.pop(("user", username), None)
+        user = state.users.get(username)
+        if user is not None:
+            node = user.node or self.node
+            if node == link.node or self.prevails(username, node, link.node):
+                return False
+            logging.warning("User %s of node %s loses the name to node %s",
+                            username, node, link.node)
+            await self.server.evict(username)
+        user = RemoteUser(username, link.node, status)
+        state.add_user(username, user, local=False)
+        self.server.remote_login(user)
+        return True
+
+    @events.handler("USER_STATUS", username=str, status=str)
+    async def on_user_status(self, link, username, status):
+        user = self.server.state.users.get(username)
+        if user is not None and user.node == link.node:
+            user.status = status
+
+    @events.handler("USER_DOWN", username=str)
+    async def on_user_down(self, link, username):
+        state = self.server.state
+        user = state.users.get(username)
+        if user is not None and user.node == link.node:
+            state.remove_user(username)
+
+    @events.handler("ROOM_JOIN", roomname=str, username=str)
+    async def on_room_join(self, link, roomname, username):
+        state = self.server.state
+        self.reserved.pop(("room", roomname), None)
+        if username in state.users:
+            state.join(state.ensure_room(roomname), username)
+
+    @events.handler("ROOM_INVITE", roomname=str, username=str)
+    async def on_room_invite(self, link, roomname, username):
+        state = self.server.state
+        if roomname in state.rooms and username in state.users:
+            state.invite(state.rooms[roomname], username)
+
+    @events.handler("ROOM_LEAVE", roomname=str, username=str)
+    async def on_room_leave(self, link, roomname, username):
+        state = self.server.state
+        room = state.rooms.get(roomname)
+        if room is not None and username in room.users:
+            state.leave(room, username)
+
+    @events.handler("BROADCAST", frame=dict, exclude=None)
+    async def on_broadcast(self, link, frame, exclude):
+        state = self.server.state
+        message = Message(frame)
+        if frame.get("type") == "PUBLIC_MESSAGE_FROM":
+            self.server.record(PUBLIC, message)
+        await self.server.deliver((user for name, user in state.local.items()
+                                   if name != exclude), message)
+
+    @events.handler("DELIVER", frame=dict, to=list)
+    async def on_deliver(self, link, frame, to):
+        local = self.server.state.local
+        message = Message(frame)
+        # room messages reach every node once, with or without members,
+        # keep them so HISTORY works on every node
+        if (frame.get("type") == "ROOM_MESSAGE_FROM"
+                and isinstance(frame.get("roomname"), str)):
+            self.server.record(frame["roomname"], message)
+        await self.server.deliver((local[name] for name in to
+                                   if name in local), message)
+
+
+def run_workers(workers, target, *args):
+    """Run target(index, *args) in each of workers processes until they end.
+
+    The workers are forked so they inherit the logging setup; each one is
+    expected to bind its listener with SO_REUSEPORT. SIGTERM is turned into
+    KeyboardInterrupt so every process shuts down the way Ctrl-C does.
+    """
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=target, args=(index, *args),
+                                 name=f"worker-{index}")
+                 for index in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
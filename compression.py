@@ -0,0 +1,82 @@
+from framing import HEADER
+from message import Message
+import framing
+import zlib
+
+# a small window fits the dictionary and any frame, and keeps each
+# compressor cheap to set up
+WBITS = 12
+MEM_LEVEL = 5
+LEVEL = 6
+
+# pumachat's vocabulary as json.dumps writes it, the most common last since
+# deflate reaches the end of the dictionary with the shortest distances
+DICTIONARY = b"".join([
+    b'{"type": "ERROR", "message": "',
+    b'{"type": "STATS_REPORT", "metrics": {',
+    b'{"type": "HISTORY_LIST", "cursor": null, "messages": [',
+    b'{"type": "USER_LIST_DELTA", "version": ", "since": ',
+    b', "added": [], "removed": []}',
+    b'{"type": "ROOM_USER_LIST", "usernames": [], "version": ',
+    b'{"type": "INVITATION", "message": " te invita al cuarto ',
+    b'{"type": "PRESENCE_UPDATE", "users": {": null, ',
+    b'{"type": "PING"}{"type": "PONG"}',
+    b'{"type": "WARNING", "message": "El usuario no se ha unido al cuarto',
+    b'", "operation": "JOIN_ROOM", "retry_after": ',
+    b'{"type": "INFO", "message": "success", "operation": "STATUS"}',
+    b'{"type": "USER_LIST", "usernames": ["',
+    b'{"type": "LEFT_ROOM", "roomname": "',
+    b'{"type": "JOINED_ROOM", "roomname": "',
+    b'{"type": "DISCONNECTED", "username": "',
+    b'{"type": "NEW_USER", "username": "',
+    b'{"type": "NEW_STATUS", "username": "", "status": "ACTIVE"}',
+    b'"AWAY"}"BUSY"}',
+    b'{"type": "MESSAGE_FROM", "username": "',
+    b'{"type": "PUBLIC_MESSAGE_FROM", "username": "',
+    b'{"type": "ROOM_MESSAGE_FROM", "roomname": "", "username": "',
+    b'", "message": "',
+])
+
+
+def compress(frame):
+    """A frame as it goes on the wire: its length and its deflated bytes,
+    which inflate on their own with the dictionary."""
+    compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, -WBITS, MEM_LEVEL,
+                                  zdict=DICTIONARY)
+    payload = compressor.compress(frame) + compressor.flush()
+    return HEADER.pack(len(payload)) + payload
+
+
+class DeflateDecoder(framing.LengthDecoder):
+    """Inflates each frame of a stream of compressed frames."""
+
+    def payload(self, payload):
+        decompressor = zlib.decompressobj(-WBITS, zdict=DICTIONARY)
+        try:
+            frame = decompressor.decompress(payload, self.max_frame_size)
+        except zlib.error:
+            self._fail("Mensaje comprimido inválido")
+        if decompressor.unconsumed_tail:
+            self._fail("Mensaje demasiado grande")
+        if not decompressor.eof:
+            self._fail("Mensaje comprimido inválido")
+        return frame
+
+
+class Deflate:
+    """The DEFLATE capability: every frame compressed on its own with a
+    shared dictionary, so a broadcast is compressed once for everyone."""
+
+    name = "DEFLATE"
+
+    def encode(self, message):
+        return compress(message.encoded)
+
+    def decode(self, frame):
+        return Message.from_encoded(frame)
+
+    def decoder(self, **options):
+        return DeflateDecoder(**options)
+
+
+DEFLATE = Deflate()
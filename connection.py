@@ -0,0 +1,298 @@
+from utils import BaseChat
+from message import Message, shared
+from collections import deque
+import asyncio
+
+RECONNECT_ATTEMPTS = 5
+RECONNECT_DELAY = 0.5
+
+# the frames besides INFO and WARNING that answer a request
+REPLIES = {"USERS": ("USER_LIST", "USER_LIST_DELTA"),
+           "ROOM_USERS": ("ROOM_USER_LIST", "ROOM_USER_LIST_DELTA"),
+           "HISTORY": ("HISTORY_LIST",),
+           "STATS": ("STATS_REPORT",),
+           "PING": ("PONG",)}
+REPLY_TYPES = frozenset({"INFO", "WARNING"}.union(*REPLIES.values()))
+# requests the server only answers when they fail, or for a MESSAGE to an
+# offline user it keeps a mailbox for, with an INFO that it was kept
+QUIET = frozenset({"MESSAGE", "PUBLIC_MESSAGE", "ROOM_MESSAGE", "PONG"})
+# quiet requests in a row before a PING, so their places are freed
+QUIET_RUN = 256
+
+PING = shared(type="PING")
+PONG = shared(type="PONG")
+DISCONNECT = shared(type="DISCONNECT")
+
+
+def answers(kind, message):
+    """Whether message is the server's reply to a request of type kind."""
+    if message["type"] in ("INFO", "WARNING"):
+        return message.get("operation") == kind
+    return message["type"] in REPLIES.get(kind, ())
+
+
+class Connection(BaseChat):
+    """A chat client without a user interface.
+
+    Requests can be pipelined: request() sends one and returns a future of
+    its reply. The server answers the requests of a connection in order, so
+    a reply resolves the oldest request waiting for it, and the quiet
+    requests sent before that one resolve to None. Every request keeps its
+    place in pending, quiet ones without a future unless asked for; the
+    replies to those are events like every other frame, read with
+    events(). A quiet request that could take the reply of an earlier one
+    of its type is sent after a PING, whose answer settles the earlier one.
+    PINGs are answered and a dropped session is resumed while it's read.
+    """
+
+    def __init__(self, host, port, codecs=(), path=None):
+        self.host = host
+        self.port = port
+        # a Unix socket of the server to connect to instead
+        self.path = path
+        # the codecs to ask for, the server picks the first it has
+        self.codecs = {codec.name: codec for codec in codecs}
+        self.reader = None
+        self.writer = None
+        self.username = None
+        self.token = None
+        # bytes of the frames received since IDENTIFY, to resume the session
+        self.offset = 0
+        self.connected = asyncio.Event()
+        # (type, future) of each request sent, the future None for the
+        # quiet ones not asked for and the PINGs sent between them
+        self.pending = deque()
+        # the types in the run of quiet requests at the end of pending,
+        # whether any of them has a future, and the length of the run
+        self.quiet = {}
+        self.run = 0
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    async def open(self):
+        if self.path is not None:
+            return await asyncio.open_unix_connection(self.path)
+        return await asyncio.open_connection(self.host, self.port)
+
+    async def connect(self):
+        self.attach(*await self.open())
+        self.connected.set()
+
+    async def recv_frame(self):
+        frame = await super().recv_frame()
+        if self.codec is None:
+            self.offset += len(frame)
+        else:
+            self.offset += self.decoder.sizes.popleft()
+        return frame
+
+    async def recv_line(self):
+        """A reply the server ends in a newline, so the frames after it can
+        go to the codec it switches to."""
+        line = await self.reader.readline()
+        if not line:
+            raise asyncio.IncompleteReadError(b"", None)
+        return line
+
+    def use(self, codec):
+        super().use(codec)
+        self.decoder = codec.decoder(track_sizes=True)
+
+    async def send(self, message):
+        if self.task is None:
+            await self.connected.wait()
+        elif not self.connected.is_set():
+            # resuming, unless the connection ends first
+            resumed = asyncio.ensure_future(self.connected.wait())
+            await asyncio.wait([resumed, self.task],
+                               return_when=asyncio.FIRST_COMPLETED)
+            resumed.cancel()
+            if not self.connected.is_set():
+                raise ConnectionResetError("Conexión cerrada")
+        await super().send(message)
+
+    async def login(self, username,
+                    capabilities=("PRESENCE_UPDATE", "RESUME", "PING")):
+        """Identify as username and return the server's reply. Once logged
+        in, the connection reads its replies and events in the
+        background."""
+        await self.send(Message({"type": "IDENTIFY",
+                                 "username": username,
+                                 "capabilities": [*capabilities,
+                                                  *self.codecs]}))
+        self.offset = 0
+        if self.codecs:
+            line = await self.recv_line()
+            self.offset += len(line)
+            response = Message.from_encoded(line)
+        else:
+            response = await self.recv()
+        match response:
+            case {"type": "INFO", "message": "success"}:
+                self.username = username
+                self.token = response.get("token")
+                for capability in response.get("capabilities", ()):
+                    if capability in self.codecs:
+                        self.use(self.codecs[capability])
+                self.task = asyncio.create_task(self.read())
+        return response
+
+    async def request(self, confirm=False, **fields):
+        """Send a request and return the future of its reply. A quiet request
+        returns None, or with confirm a future that resolves to None if it
+        succeeded, sending a barrier first when its reply could be taken
+        for that of another one."""
+        kind = fields["type"]
+        if kind in QUIET:
+            if (self.run >= QUIET_RUN or kind in self.quiet
+                    and (confirm or self.quiet[kind])):
+                await self.barrier()
+            self.quiet[kind] = self.quiet.get(kind, False) or confirm
+            self.run += 1
+        else:
+            self.quiet.clear()
+            self.run = 0
+        future = None
+        if kind not in QUIET or confirm:
+            future = asyncio.get_running_loop().create_future()
+        self.pending.append((kind, future))
+        try:
+            await self.send(Message(fields))
+        except ConnectionError:
+            if future is not None:
+                future.cancel()
+            raise
+        return future
+
+    async def barrier(self):
+        """A PING no one waits for, after which the replies to the quiet
+        requests before it can't be taken for those of later ones."""
+        self.quiet.clear()
+        self.run = 0
+        self.pending.append(("PING", None))
+        await self.send(PING)
+
+    async def ask(self, **fields):
+        """Send a request and wait for its reply."""
+        return await (await self.request(confirm=True, **fields))
+
+    async def sync(self):
+        """Wait until every request sent before has been answered."""
+        await self.ask(type="PING")
+
+    async def events(self):
+        """The frames that aren't replies, until the connection ends."""
+        while (message := await self.queue.get()) is not None:
+            yield message
+        if (self.task is not None and not self.task.cancelled()
+                and self.task.exception() is not None):
+            raise self.task.exception()
+
+    async def read(self):
+        try:
+            while True:
+                try:
+                    async for message in self.messages():
+                        if message["type"] == "PING":
+                            await self.send(PONG)
+                        elif not self.reply(message):
+                            self.queue.put_nowait(message)
+                except ConnectionError:
+                    pass
+                self.fail()
+                if not await self.reconnect():
+                    break
+        finally:
+            self.fail()
+            self.queue.put_nowait(None)
+
+    def reply(self, message):
+        """Resolve the request message answers, False if it's an event."""
+        if message["type"] not in REPLY_TYPES:
+            return False
+        for index, (kind, _) in enumerate(self.pending):
+            if answers(kind, message):
+                break
+            if kind not in QUIET:
+                return False
+        else:
+            return False
+        for _ in range(index):
+            _, future = self.pending.popleft()
+            if future is not None and not future.done():
+                future.set_result(None)
+        kind, future = self.pending.popleft()
+        if not self.pending:
+            self.quiet.clear()
+            self.run = 0
+        if future is None:
+            # the reply to a quiet request no one waits for is an event
+            return kind not in QUIET
+        if not future.done():
+            future.set_result(message)
+        return True
+
+    def fail(self):
+        # the replies to these may never come
+        self.quiet.clear()
+        self.run = 0
+        while self.pending:
+            _, future = self.pending.popleft()
+            if future is not None and not future.done():
+                future.set_exception(
+                    ConnectionResetError("Conexión perdida"))
+
+    async def reconnect(self):
+        """Resume the session on a new connection, False if there's no
+        session or the server no longer keeps it."""
+        self.connected.clear()
+        self.writer.close()
+        if self.token is None:
+            return False
+        codec = self.codec
+        for attempt in range(RECONNECT_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(RECONNECT_DELAY * 2 ** attempt)
+            offset = self.offset
+            try:
+                self.attach(*await self.open())
+                await super().send(Message({"type": "RESUME",
+                                            "username": self.username,
+                                            "token": self.token,
+                                            "offset": offset}))
+                response = Message.from_encoded(await self.recv_line())
+            except (OSError, asyncio.IncompleteReadError):
+                continue
+            # the reply isn't part of the session's stream
+            self.offset = offset
+            match response:
+                case {"type": "INFO", "operation": "RESUME",
+                      "message": "success"}:
+                    if codec is not None:
+                        self.use(codec)
+                    self.connected.set()
+                    return True
+                case _:
+                    self.queue.put_nowait(response)
+                    return False
+        return False
+
+    async def close(self):
+        """Log out, so the server doesn't keep the session, and close."""
+        self.token = None
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        if self.writer is None:
+            return
+        if self.connected.is_set():
+            try:
+                await super().send(DISCONNECT)
+            except ConnectionError:
+                pass
+        self.connected.clear()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
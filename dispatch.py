@@ -0,0 +1,69 @@
+from utils import MessageException
+
+MISSING = object()
+
+
+class optional:
+    """Schema entry for a field that may be left out, in favour of default."""
+
+    def __init__(self, expected, default=None):
+        self.expected = expected
+        self.default = default
+
+
+def _checker(expected):
+    if isinstance(expected, type):
+        return lambda value: isinstance(value, expected)
+    if expected is None:
+        return lambda value: value is not MISSING
+    choices = tuple(expected)
+    return lambda value: value in choices
+
+
+class Dispatcher:
+    """Registry mapping a message type to its handler coroutine.
+
+    Each handler declares the fields it needs, with either a type, a
+    collection of accepted values or None for any value, wrapped in optional
+    when the field may be left out. A frame is looked up
+    by type once and its fields are checked once before the handler runs with
+    them as keyword arguments.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+
+    def handler(self, type, **schema):
+        checks = []
+        for field, expected in schema.items():
+            if isinstance(expected, optional):
+                checks.append((field, _checker(expected.expected),
+                               expected.default))
+            else:
+                checks.append((field, _checker(expected), MISSING))
+        checks = tuple(checks)
+
+        def register(method):
+            self.handlers[type] = (method, checks)
+            return method
+        return register
+
+    def resolve(self, message):
+        try:
+            method, checks = self.handlers[message.get("type")]
+        except (KeyError, TypeError):
+            raise MessageException("Bad format: "
+                                   + message.__repr__()) from None
+        fields = {}
+        for field, check, default in checks:
+            value = message.get(field, MISSING)
+            if value is MISSING and default is not MISSING:
+                value = default
+            elif not check(value):
+                raise MessageException("Bad format: " + message.__repr__())
+            fields[field] = value
+        return method, fields
+
+    async def dispatch(self, instance, handler, message):
+        method, fields = self.resolve(message)
+        await method(instance, handler, **fields)
@@ -0,0 +1,196 @@
+from collections import deque
+import struct
+import utils
+import re
+
+MAX_FRAME_SIZE = 2 ** 16
+READ_SIZE = 2 ** 16
+
+SEPARATORS = b" \t\r\n\x00"
+
+# payload length of each frame of the binary codecs
+HEADER = struct.Struct(">I")
+
+_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+# Between frames: a whole frame without nested objects, which is what almost
+# all traffic looks like, or the opening brace of any other frame.
+_FRAME = re.compile(rb'[ \t\r\n\x00]*(?:(\{[^{}"]*(?:' + _STRING
+                    + rb'[^{}"]*)*\})|(\{)|([^ \t\r\n\x00]))', re.S)
+# Inside a frame: a complete string literal or a single structural byte. When
+# a string is cut by the end of the buffer only its opening quote matches.
+_TOKEN = re.compile(_STRING + rb'|[{}"]', re.S)
+_STRING_TAIL = re.compile(_STRING[1:], re.S)
+
+_OPEN_BRACE = ord("{")
+_QUOTE = ord('"')
+
+
+class FrameDecoder:
+    """Splits a byte stream into complete JSON objects.
+
+    Parser state (nesting depth and unterminated strings) survives between
+    calls to feed, so a frame may arrive in any number of pieces and a single
+    read may carry any number of frames.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+
+    @property
+    def pending(self):
+        return bytes(self._buffer) if self._depth else b""
+
+    def feed(self, data):
+        # scan immutable bytes, so each frame is a single slice of them
+        if self._buffer:
+            self._buffer += data
+            buffer = bytes(self._buffer)
+            self._buffer.clear()
+        else:
+            buffer = bytes(data)
+        frames = []
+        pos = self._pos
+        depth = self._depth
+        last = 0
+        if self._in_string:
+            match = _STRING_TAIL.match(buffer, pos)
+            if match is None:
+                return self._suspend(buffer, frames, 0, pos, depth, True)
+            pos = match.end()
+
+        error = None
+        in_string = False
+        size = len(buffer)
+        while True:
+            if not depth:
+                while pos < size and buffer[pos] in SEPARATORS:
+                    pos += 1
+                # a flat frame without escapes ends at the first brace with
+                # an even number of quotes before it, found without the regex
+                if pos < size and buffer[pos] == _OPEN_BRACE:
+                    end = buffer.find(b"}", pos) + 1
+                    if (end and buffer.find(b"{", pos + 1, end) < 0
+                            and buffer.find(b"\\", pos, end) < 0
+                            and not buffer.count(b'"', pos, end) % 2):
+                        if end - pos > self.max_frame_size:
+                            error = self._too_large
+                            break
+                        frames.append(buffer[pos:end])
+                        last = pos = end
+                        continue
+                match = _FRAME.match(buffer, pos)
+                if match is None:
+                    pos = size
+                    break
+                if match.lastindex == 1:
+                    last, pos = match.span(1)
+                    if pos - last > self.max_frame_size:
+                        error = self._too_large
+                        break
+                    frames.append(buffer[last:pos])
+                    last = pos
+                elif match.lastindex == 2:
+                    last, pos = match.span(2)
+                    depth = 1
+                else:
+                    error = self._invalid
+                    break
+                continue
+
+            match = _TOKEN.search(buffer, pos)
+            if match is None:
+                pos = size
+                break
+            start, pos = match.span()
+            char = buffer[start]
+            if char == _QUOTE:
+                if pos - start == 1:
+                    in_string = True
+                    break
+            elif char == _OPEN_BRACE:
+                depth += 1
+            else:
+                depth -= 1
+                if not depth:
+                    if pos - last > self.max_frame_size:
+                        error = self._too_large
+                        break
+                    frames.append(buffer[last:pos])
+                    last = pos
+        if error is not None:
+            error()
+        return self._suspend(buffer, frames, last, pos, depth, in_string)
+
+    def _suspend(self, buffer, frames, last, pos, depth, in_string):
+        # keep only the frame in progress
+        if depth:
+            if len(buffer) - last > self.max_frame_size:
+                return self._too_large()
+            self._buffer += memoryview(buffer)[last:]
+            self._pos = pos - last
+        else:
+            self._pos = 0
+        self._depth = depth
+        self._in_string = in_string
+        return frames
+
+    def _reset(self):
+        self._buffer.clear()
+        self._pos = self._depth = 0
+        self._in_string = False
+
+    def _invalid(self):
+        self._reset()
+        raise utils.MessageException("JSON inválido")
+
+    def _too_large(self):
+        self._reset()
+        raise utils.MessageException("Mensaje demasiado grande")
+
+
+class LengthDecoder:
+    """Splits a stream of frames each preceded by its length in HEADER.
+
+    With track_sizes, sizes holds the wire size of each frame returned, for
+    clients that count the bytes they got to resume their session.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE, track_sizes=False):
+        self.max_frame_size = max_frame_size
+        self.sizes = deque() if track_sizes else None
+        self._buffer = bytearray()
+
+    @property
+    def pending(self):
+        return bytes(self._buffer)
+
+    def feed(self, data):
+        buffer = self._buffer
+        buffer += data
+        frames = []
+        pos = 0
+        while len(buffer) - pos >= HEADER.size:
+            size, = HEADER.unpack_from(buffer, pos)
+            if size > self.max_frame_size:
+                self._fail("Mensaje demasiado grande")
+            end = pos + HEADER.size + size
+            if end > len(buffer):
+                break
+            frames.append(self.payload(bytes(buffer[pos + HEADER.size:end])))
+            if self.sizes is not None:
+                self.sizes.append(end - pos)
+            pos = end
+        del buffer[:pos]
+        return frames
+
+    def payload(self, payload):
+        """The frame a payload stands for."""
+        return payload
+
+    def _fail(self, reason):
+        self._buffer.clear()
+        raise utils.MessageException(reason)
@@ -0,0 +1,261 @@
+from framing import MAX_FRAME_SIZE
+from message import Message
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import shutil
+import struct
+import mmap
+import os
+
+SEGMENT_BYTES = 2 ** 20
+SEGMENT_RECORDS = 2 ** 12
+SEGMENTS = 8
+OPEN_SEGMENTS = 256
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# the records of a page, so the frame around them stays under the limit
+PAGE_BYTES = MAX_FRAME_SIZE - 1024
+
+# end offset of each record in the log, 0 marks an unused entry
+ENTRY = struct.Struct("<Q")
+
+PUBLIC = None
+
+
+class Segment:
+    """A log file of records and a fixed size index with their end offsets.
+
+    Both files are preallocated and mapped, so appending a record is two
+    memory copies and reading one is a slice. Records become visible once
+    their index entry is written, after the bytes, so a record torn by a
+    crash is never read. A sealed segment's log is cut to the bytes used.
+    """
+
+    def __init__(self, path, first, size, records, writable):
+        self.path = path
+        self.first = first
+        self.writable = writable
+        self.index = self._map(path + ".idx", records * ENTRY.size)
+        log_size = size if writable else os.path.getsize(path + ".log")
+        self.log = self._map(path + ".log", log_size)
+        self.count = self._count()
+        self.end = self.entry(self.count - 1) if self.count else 0
+
+    def _map(self, path, size):
+        mode = "r+b" if os.path.exists(path) else "w+b"
+        with open(path, mode) as file:
+            if self.writable and os.path.getsize(path) < size:
+                file.truncate(size)
+            return mmap.mmap(file.fileno(), 0, access=(
+                mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ))
+
+    def entry(self, index):
+        return ENTRY.unpack_from(self.index, index * ENTRY.size)[0]
+
+    def _count(self):
+        # entries are increasing and the unused ones 0, so bisect the first
+        # unused one; entries past the end of the log weren't finished
+        low, high = 0, len(self.index) // ENTRY.size
+        while low < high:
+            middle = (low + high) // 2
+            end = self.entry(middle)
+            if end and end <= len(self.log):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    @property
+    def next(self):
+        return self.first + self.count
+
+    def fits(self, record):
+        return (self.count < len(self.index) // ENTRY.size
+                and self.end + len(record) <= len(self.log))
+
+    def append(self, record):
+        start, self.end = self.end, self.end + len(record)
+        self.log[start:self.end] = record
+        ENTRY.pack_into(self.index, self.count * ENTRY.size, self.end)
+        self.count += 1
+
+    def read(self, start, stop):
+        """Records start to stop, as sequence numbers, in order."""
+        records = []
+        begin = self.entry(start - self.first - 1) if start > self.first \
+            else 0
+        for index in range(start - self.first, stop - self.first):
+            end = self.entry(index)
+            records.append(self.log[begin:end])
+            begin = end
+        return records
+
+    def close(self):
+        self.index.close()
+        self.log.close()
+
+    def seal(self):
+        self.close()
+        os.truncate(self.path + ".log", self.end)
+        self.writable = False
+
+
+class Channel:
+    """The segments of one room, or of the public chat, oldest first."""
+
+    def __init__(self, history, directory):
+        self.history = history
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.firsts = sorted(int(name[:-4]) for name in os.listdir(directory)
+                             if name.endswith(".idx"))
+        self.next = 0
+        if self.firsts:
+            self.next = self.segment(self.firsts[-1]).next
+
+    @property
+    def oldest(self):
+        return self.firsts[0] if self.firsts else self.next
+
+    def segment(self, first):
+        return self.history.segment(self, first,
+                                    first == self.firsts[-1])
+
+    def append(self, record):
+        if len(record) > self.history.segment_bytes:
+            logging.warning("History record of %d bytes dropped", len(record))
+            return
+        segment = self.segment(self.firsts[-1]) if self.firsts else None
+        if segment is None or not segment.fits(record):
+            if segment is not None:
+                self.history.seal(segment)
+            self.firsts.append(self.next)
+            segment = self.segment(self.next)
+            while len(self.firsts) > self.history.segments:
+                self.history.delete(self, self.firsts.pop(0))
+        segment.append(record)
+        self.next += 1
+
+    def read(self, before, limit, max_bytes=PAGE_BYTES):
+        """Up to limit records before the sequence number before, no more
+        than max_bytes of them but at least one, and the cursor to read the
+        ones before them, None if there are none."""
+        stop = self.next if before is None else max(min(before, self.next),
+                                                    self.oldest)
+        start = max(stop - limit, self.oldest)
+        records = []
+        for first, following in zip(self.firsts,
+                                    self.firsts[1:] + [self.next]):
+            if first < stop and following > start:
+                records.extend(self.segment(first).read(
+                    max(start, first), min(stop, following)))
+        size = sum(len(record) + 2 for record in records)
+        dropped = 0
+        while size > max_bytes and dropped < len(records) - 1:
+            size -= len(records[dropped]) + 2
+            dropped += 1
+        start += dropped
+        return records[dropped:], start if start > self.oldest else None
+
+
+class History:
+    """Durable message log of every room and the public chat.
+
+    Each channel is a directory of segments named after the sequence
+    number of their first record. Once a segment is full it's sealed and a
+    new one started, and channels keep at most segments of them. Only the
+    most recently used segments stay mapped.
+    """
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES,
+                 segment_records=SEGMENT_RECORDS, segments=SEGMENTS,
+                 open_segments=OPEN_SEGMENTS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_records = segment_records
+        self.segments = segments
+        self.open_segments = open_segments
+        self.channels = {}
+        self.mapped = OrderedDict()
+
+    def path(self, roomname):
+        key = "public" if roomname is PUBLIC else "room-" + \
+            hashlib.sha1(roomname.encode("utf8")).hexdigest()
+        return os.path.join(self.directory, key)
+
+    def channel(self, roomname):
+        channel = self.channels.get(roomname)
+        if channel is None:
+            channel = self.channels[roomname] = Channel(
+                self, self.path(roomname))
+        return channel
+
+    def drop(self, roomname):
+        """Delete the records of a room that no longer exists, so a new
+        room with its name starts empty."""
+        self.channels.pop(roomname, None)
+        self.remove(self.path(roomname))
+
+    def drop_rooms(self):
+        """Delete the records of every room, as rooms don't outlive the
+        server."""
+        for roomname in [name for name in self.channels
+                         if name is not PUBLIC]:
+            del self.channels[roomname]
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.startswith("room-"):
+                    self.remove(os.path.join(self.directory, name))
+
+    def remove(self, directory):
+        prefix = directory + os.sep
+        for path in [path for path in self.mapped if path.startswith(prefix)]:
+            self.mapped.pop(path).close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def segment(self, channel, first, active):
+        path = os.path.join(channel.directory, f"{first:020d}")
+        segment = self.mapped.get(path)
+        if segment is not None:
+            self.mapped.move_to_end(path)
+            return segment
+        segment = Segment(path, first, self.segment_bytes,
+                          self.segment_records, active)
+        self.mapped[path] = segment
+        if len(self.mapped) > self.open_segments:
+            self.mapped.popitem(last=False)[1].close()
+        return segment
+
+    def seal(self, segment):
+        self.mapped.pop(segment.path, None)
+        segment.seal()
+
+    def delete(self, channel, first):
+        path = os.path.join(channel.directory, f"{first:020d}")
+        segment = self.mapped.pop(path, None)
+        if segment is not None:
+            segment.close()
+        for suffix in (".idx", ".log"):
+            os.unlink(path + suffix)
+
+    def append(self, roomname, record):
+        self.channel(roomname).append(record)
+
+    def read(self, roomname, before=None, limit=PAGE_SIZE,
+             max_bytes=PAGE_BYTES):
+        return self.channel(roomname).read(before, limit, max_bytes)
+
+    def close(self):
+        for segment in self.mapped.values():
+            segment.close()
+        self.mapped.clear()
+
+
+def history_frame(fields, records):
+    """A frame with fields and the records, as they are stored, in its
+    "messages" list."""
+    head = json.dumps(fields, ensure_ascii=False).encode("utf8")
+    return Message.from_trusted(head[:-1] + b', "messages": ['
+                                + b", ".join(records) + b"]}")
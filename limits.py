@@ -0,0 +1,88 @@
+# messages per second and burst of each client, "*" counts every message
+LIMITS = {"*": (20, 40), "PUBLIC_MESSAGE": (5, 10)}
+
+# messages that are never throttled
+EXEMPT = frozenset({"DISCONNECT", "PONG"})
+
+
+def parse_rate(text):
+    """Parse RATE[/BURST] into (rate, burst), the burst defaults to one
+    second worth of the rate."""
+    rate, _, burst = text.partition("/")
+    try:
+        rate = float(rate)
+        burst = float(burst) if burst else max(rate, 1)
+    except ValueError:
+        raise ValueError(f"Expected RATE[/BURST], got {text!r}") from None
+    if rate < 0 or burst < 1:
+        raise ValueError(f"Expected RATE[/BURST], got {text!r}")
+    return rate, burst
+
+
+def parse_limit(text):
+    """Parse TYPE=RATE[/BURST] into (TYPE, (rate, burst))."""
+    kind, _, rate = text.partition("=")
+    if not kind or not rate:
+        raise ValueError(f"Expected TYPE=RATE[/BURST], got {text!r}")
+    return kind, parse_rate(rate)
+
+
+class TokenBucket:
+    """Fills with rate tokens per second up to burst, each event takes
+    one."""
+
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def wait(self, now):
+        """0 if there is a token, else the seconds until there is one."""
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        """0 if a token was taken, else the seconds until there is one."""
+        wait = self.wait(now)
+        if not wait:
+            self.tokens -= 1
+        return wait
+
+
+class RateLimiter:
+    """The token buckets of one client, created as its messages use them.
+
+    A message takes a token from the "*" bucket and from the bucket of its
+    type, if there are limits for them, and only if both have one, so a
+    throttled message costs nothing. A rate of 0 means no limit.
+    """
+
+    __slots__ = ("limits", "buckets")
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.buckets = {}
+
+    def take(self, kind, now):
+        """0 if the message is allowed, else the seconds to wait."""
+        buckets = []
+        for key in ("*", kind):
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                rate, burst = self.limits.get(key, (0, 0))
+                if not rate:
+                    continue
+                bucket = self.buckets[key] = TokenBucket(rate, burst, now)
+            buckets.append(bucket)
+        wait = max((bucket.wait(now) for bucket in buckets), default=0)
+        if not wait:
+            for bucket in buckets:
+                bucket.tokens -= 1
+        return wait
@@ -0,0 +1,73 @@
+from cluster import parse_address
+import asyncio
+import socket
+
+# asyncio's default listen backlog
+BACKLOG = 100
+# event loops the server can run on, asyncio's own or one imported on demand
+LOOPS = ("asyncio", "uvloop")
+
+
+def parse_bind(text):
+    """A Unix socket path from unix:PATH, a (host, port) pair otherwise."""
+    if text.startswith("unix:"):
+        path = text[len("unix:"):]
+        if not path:
+            raise ValueError("Expected unix:PATH")
+        return path
+    return parse_address(text)
+
+
+class SocketOptions:
+    """Options of the listening sockets and of the connections they accept.
+
+    Buffer sizes of 0 leave the system's own. They are set on the listener,
+    and every connection it accepts inherits them from it.
+    """
+
+    __slots__ = ("backlog", "nodelay", "sndbuf", "rcvbuf")
+
+    def __init__(self, backlog=BACKLOG, nodelay=True, sndbuf=0, rcvbuf=0):
+        self.backlog = backlog
+        self.nodelay = nodelay
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
+
+    def listen(self, sock):
+        for option, size in ((socket.SO_SNDBUF, self.sndbuf),
+                             (socket.SO_RCVBUF, self.rcvbuf)):
+            if size:
+                sock.setsockopt(socket.SOL_SOCKET, option, size)
+
+    def accept(self, writer):
+        # asyncio turns Nagle's algorithm off on every TCP connection
+        if self.nodelay:
+            return
+        sock = writer.get_extra_info("socket")
+        if sock is not None and sock.family in (socket.AF_INET,
+                                                socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 0)
+
+
+async def listen(callback, address, options, limit, reuse_port=False):
+    """Serve callback on address, a Unix socket path or a (host, port)
+    pair."""
+    if isinstance(address, str):
+        listener = await asyncio.start_unix_server(
+            callback, address, limit=limit, backlog=options.backlog)
+    else:
+        listener = await asyncio.start_server(
+            callback, *address, limit=limit, backlog=options.backlog,
+            reuse_port=reuse_port)
+    for sock in listener.sockets:
+        options.listen(sock)
+    return listener
+
+
+def use_loop(name):
+    """Make asyncio.run create the event loop called name."""
+    if name == "uvloop":
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    else:
+        asyncio.set_event_loop_policy(None)
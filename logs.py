@@ -0,0 +1,166 @@
+from logging.handlers import QueueHandler, QueueListener
+from message import Message
+from collections import Counter
+import logging
+import queue
+import json
+import sys
+import os
+
+FORMAT = "%(levelname)s [%(name)s: %(lineno)d] %(message)s"
+FORMATS = ("text", "json")
+
+# attributes every LogRecord has, anything else was passed through extra
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None)))
+_RECORD_FIELDS.update(("message", "asctime"))
+
+
+def message_type(record):
+    """Type of the chat message a record is about, if any."""
+    kind = getattr(record, "type", None)
+    if kind is None and isinstance(record.args, tuple):
+        for arg in record.args:
+            if isinstance(arg, Message):
+                return arg.get("type")
+    return kind
+
+
+def parse_sample(text):
+    """Parse TYPE=N into (TYPE, N), meaning keep one in N records."""
+    kind, _, every = text.partition("=")
+    if not kind or not every.isdigit() or int(every) < 1:
+        raise ValueError(f"Expected TYPE=N, got {text!r}")
+    return kind, int(every)
+
+
+class SamplingFilter(logging.Filter):
+    """Let through one in every N records about a given message type.
+
+    Records at WARNING or above always pass.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+        self.seen = Counter()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        kind = message_type(record)
+        every = self.rates.get(kind)
+        if every is None:
+            return True
+        self.seen[kind] += 1
+        return (self.seen[kind] - 1) % every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, chat messages among its arguments are
+    included as objects rather than as their repr."""
+
+    def format(self, record):
+        entry = {"time": record.created, "level": record.levelname,
+                 "name": record.name, "line": record.lineno,
+                 "message": record.getMessage()}
+        if isinstance(record.args, tuple):
+            frames = [dict(arg) for arg in record.args
+                      if isinstance(arg, Message)]
+            if frames:
+                entry["frames"] = frames
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=repr)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Queue records as they are, so the listener thread formats them.
+
+    Arguments are formatted after the call returns, so they must not be
+    mutated once logged; chat messages aren't.
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            # tracebacks reference live frames, render them now
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class Pipeline:
+    """Root logging through a queue to a thread that formats and writes."""
+
+    def __init__(self, level, format="text", sample=(), stream=None):
+        formatter = (JsonFormatter() if format == "json"
+                     else logging.Formatter(FORMAT))
+        self.output = logging.StreamHandler(stream or sys.stderr)
+        self.output.setFormatter(formatter)
+        self.handler = DeferredQueueHandler(queue.SimpleQueue())
+        if sample:
+            self.handler.addFilter(SamplingFilter(sample))
+        self.level = level
+        self.listener = None
+
+    def install(self):
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+
+    def start(self):
+        self.listener = QueueListener(self.handler.queue, self.output,
+                                      respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        self.output.flush()
+
+    def forked(self):
+        # the listener thread doesn't survive a fork, start a fresh one on
+        # a fresh queue
+        self.handler.queue = queue.SimpleQueue()
+        if self.listener is not None:
+            self.start()
+
+
+_pipeline = None
+
+
+def setup(level=logging.DEBUG, format="text", sample=(), stream=None):
+    """Route the root logger through a background thread until shutdown().
+
+    Forked processes get their own thread and must call shutdown() before
+    they exit too.
+    """
+    global _pipeline
+    shutdown()
+    _pipeline = Pipeline(level, format, sample, stream)
+    _pipeline.install()
+    _pipeline.start()
+    return _pipeline
+
+
+def _forked():
+    if _pipeline is not None:
+        _pipeline.forked()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forked)
+
+
+def shutdown():
+    """Write every queued record and stop the background thread."""
+    if _pipeline is not None:
+        _pipeline.stop()
@@ -0,0 +1,139 @@
+import hashlib
+import struct
+import json
+import time
+import os
+
+MAX_BYTES = 2 ** 18
+TTL = 7 * 24 * 3600
+BATCH_BYTES = 2 ** 16
+DETACHED = ".delivering"
+
+# expiry as a unix time and length of the frame that follows
+RECORD = struct.Struct("<dI")
+
+
+class Mailboxes:
+    """Private messages kept on disk for users that are offline.
+
+    Every user that ever logged in is known and has a mailbox, a file of
+    RECORD headers each followed by an encoded frame. Appending happens on
+    the event loop and is cheap; delivering a mailbox first moves its file
+    aside, so later messages start a new one, and then reading it can
+    happen in another thread. Expired records are dropped when a mailbox
+    is read or runs out of room.
+    """
+
+    def __init__(self, directory, max_bytes=MAX_BYTES, ttl=TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizes = {}
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.endswith(DETACHED):
+                self.recover(os.path.join(directory, name))
+        self.users_path = os.path.join(directory, "users")
+        self.known = set()
+        if os.path.exists(self.users_path):
+            with open(self.users_path, encoding="utf8") as users:
+                self.known.update(json.loads(line) for line in users)
+
+    def recover(self, detached):
+        # a delivery was interrupted, put its messages back in front
+        path = detached[:-len(DETACHED)]
+        if os.path.exists(path):
+            with open(detached, "ab") as mailbox, open(path, "rb") as newer:
+                mailbox.write(newer.read())
+        os.replace(detached, path)
+
+    def path(self, username):
+        return os.path.join(self.directory, hashlib.sha1(
+            username.encode("utf8")).hexdigest())
+
+    def register(self, username):
+        if username not in self.known:
+            self.known.add(username)
+            with open(self.users_path, "a", encoding="utf8") as users:
+                users.write(json.dumps(username, ensure_ascii=False) + "\n")
+
+    def size(self, username):
+        size = self.sizes.get(username)
+        if size is None:
+            try:
+                size = os.path.getsize(self.path(username))
+            except FileNotFoundError:
+                size = 0
+            self.sizes[username] = size
+        return size
+
+    def put(self, username, frame):
+        """Append a frame, returns False when the mailbox is full."""
+        record = RECORD.pack(time.time() + self.ttl, len(frame)) + frame
+        if self.size(username) + len(record) > self.max_bytes:
+            self.compact(username)
+            if self.size(username) + len(record) > self.max_bytes:
+                return False
+        with open(self.path(username), "ab") as mailbox:
+            mailbox.write(record)
+        self.sizes[username] += len(record)
+        return True
+
+    def compact(self, username):
+        path = self.path(username)
+        if not os.path.exists(path):
+            return
+        frames = read_records(path)
+        with open(path, "wb") as mailbox:
+            for expires, frame in frames:
+                mailbox.write(RECORD.pack(expires, len(frame)) + frame)
+        self.sizes[username] = os.path.getsize(path)
+
+    def detach(self, username):
+        """Move a mailbox aside to be read(), None if it's empty."""
+        if not self.size(username):
+            return None
+        path = self.path(username)
+        detached = path + DETACHED
+        os.replace(path, detached)
+        self.sizes[username] = 0
+        return detached
+
+    def read(self, path):
+        """The unexpired frames of a detached mailbox, which is deleted."""
+        frames = [frame for _, frame in read_records(path)]
+        os.unlink(path)
+        return frames
+
+
+def read_records(path):
+    now = time.time()
+    with open(path, "rb") as mailbox:
+        data = mailbox.read()
+    records = []
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        expires, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        frame = data[offset:offset + length]
+        offset += length
+        if len(frame) < length:
+            break
+        if expires > now:
+            records.append((expires, frame))
+    return records
+
+
+def batches(frames, size=BATCH_BYTES):
+    """Join frames in chunks of about size bytes, yields each chunk with
+    the index of its first frame."""
+    start = 0
+    length = 0
+    for index, frame in enumerate(frames):
+        length += len(frame)
+        if length >= size:
+            yield start, b"".join(frames[start:index + 1])
+            start = index + 1
+            length = 0
+    if start < len(frames):
+        yield start, b"".join(frames[start:])
@@ -1,12 +1,17 @@
 from collections.abc import MutableMapping
+import functools
 import utils
 import json
 
+# distinct replies shared() keeps
+FRAME_CACHE = 1024
+
 
 class Message(MutableMapping):
     def __init__(self, message):
         self._store = dict(message)
         self._encoded = None
+        self._wire = None
 
     @staticmethod
     def from_encoded(encoded):
@@ -20,6 +25,31 @@ class Message(MutableMapping):
         except json.JSONDecodeError:
             raise utils.MessageException("JSON inválido")
 
+    @staticmethod
+    def from_trusted(encoded):
+        """Wrap a frame the server encoded itself, decoding it only if
+        its fields are read."""
+        message = Message.__new__(Message)
+        message._store = None
+        message._encoded = encoded
+        message._wire = None
+        return message
+
+    @staticmethod
+    def from_store(store):
+        """Wrap a dict a codec decoded, without copying it."""
+        message = Message.__new__(Message)
+        message._store = store
+        message._encoded = None
+        message._wire = None
+        return message
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = json.loads(self._encoded)
+        return self._store
+
     @property
     def encoded(self):
         if self._encoded is None:
@@ -27,23 +57,55 @@ class Message(MutableMapping):
                                        ensure_ascii=False).encode("utf8")
         return self._encoded
 
+    def wire(self, codec):
+        """The frame as codec puts it on the wire, encoded once for every
+        connection using it; JSON when codec is None."""
+        if codec is None:
+            return self.encoded
+        if self._wire is None:
+            self._wire = {}
+        frame = self._wire.get(codec)
+        if frame is None:
+            frame = self._wire[codec] = codec.encode(self)
+        return frame
+
     def __str__(self):
-        return json.dumps(self._store, indent=4, ensure_ascii=False)
+        return json.dumps(self.store, indent=4, ensure_ascii=False)
 
     def __repr__(self):
-        return str(self._store)
+        return str(self.store)
 
     def __getitem__(self, key):
-        return self._store[key]
+        return self.store[key]
 
     def __setitem__(self, key, value):
-        self._store[key] = value
+        self.store[key] = value
+        self._encoded = self._wire = None
 
     def __delitem__(self, key):
-        del self._store[key]
+        del self.store[key]
+        self._encoded = self._wire = None
 
     def __iter__(self):
-        return iter(self._store)
+        return iter(self.store)
 
     def __len__(self):
-        return len(self._store)
+        return len(self.store)
+
+
+class Frame(Message):
+    """A Message that can't change, so the same one can be sent as every
+    reply with its fields and be encoded only once."""
+
+    def __setitem__(self, key, value):
+        raise TypeError("Frames can't change")
+
+    def __delitem__(self, key):
+        raise TypeError("Frames can't change")
+
+
+@functools.lru_cache(maxsize=FRAME_CACHE)
+def shared(**fields):
+    """The shared Frame with fields, which must be hashable. Only for
+    replies from a fixed set, one naming a user or room is a Message."""
+    return Frame(fields)
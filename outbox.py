@@ -0,0 +1,277 @@
+from message import Message
+from collections import Counter, deque
+import asyncio
+import logging
+import time
+
+HIGH_WATER = 2 ** 20
+LOW_WATER = 2 ** 18
+CLOSE_TIMEOUT = 5
+RING_BYTES = 2 ** 18
+
+# presence events a lagging client can miss without losing chat messages
+DROPPABLE = frozenset({"NEW_STATUS", "NEW_USER"})
+
+
+class SlowConsumerPolicy:
+    """What to do when an outbox grows past its high-water mark.
+
+    block: producers wait until the outbox drains below the low-water mark.
+    drop: the oldest presence events are discarded down to the low-water
+    mark; if chat messages alone exceed the high-water mark the client is
+    disconnected.
+    disconnect: the client gets an ERROR frame and is disconnected.
+    """
+
+    BLOCK = "block"
+    DROP = "drop"
+    DISCONNECT = "disconnect"
+    ACTIONS = (BLOCK, DROP, DISCONNECT)
+
+    def __init__(self, action=DISCONNECT, high_water=HIGH_WATER,
+                 low_water=LOW_WATER):
+        if action not in SlowConsumerPolicy.ACTIONS:
+            raise ValueError(f"Unknown slow consumer action: {action}")
+        if not 0 <= low_water <= high_water:
+            raise ValueError("low_water must be between 0 and high_water")
+        self.action = action
+        self.high_water = high_water
+        self.low_water = low_water
+        self.counters = Counter()
+
+
+class Ring:
+    """The last limit bytes written to a session, by stream offset.
+
+    Offsets count the bytes of every frame the session was sent, so a
+    client that counts the bytes of the frames it got can ask for exactly
+    the ones it missed.
+    """
+
+    __slots__ = ("limit", "chunks", "start", "end")
+
+    def __init__(self, limit=RING_BYTES):
+        self.limit = limit
+        self.chunks = deque()
+        self.start = 0
+        self.end = 0
+
+    def append(self, frame):
+        self.chunks.append(frame)
+        self.end += len(frame)
+        while self.end - self.start > self.limit:
+            self.start += len(self.chunks.popleft())
+
+    def since(self, offset):
+        """The bytes after offset, None if they aren't all kept."""
+        if not self.start <= offset <= self.end:
+            return None
+        missed = []
+        position = self.end
+        for chunk in reversed(self.chunks):
+            if position <= offset:
+                break
+            position -= len(chunk)
+            missed.append(chunk[max(offset - position, 0):])
+        return b"".join(reversed(missed))
+
+
+class Outbox:
+    """Queue of encoded frames flushed to a writer by its own task, all the
+    frames queued since the last flush with one writelines().
+
+    Producers never touch the socket: offer only appends the shared encoded
+    bytes, so fanning out a frame doesn't wait on any reader. How far the
+    queue may grow is up to the SlowConsumerPolicy.
+
+    With a ring, written frames are also kept there, and while suspended
+    (without a writer) frames go straight to the ring until resume().
+    """
+
+    __slots__ = ("writer", "policy", "frames", "droppable", "size", "closed",
+                 "task", "ring", "codec", "blocked", "_ready", "_drained")
+
+    error = Message({"type": "ERROR",
+                     "message": "Cliente demasiado lento, desconectado"})
+
+    def __init__(self, writer, policy=None):
+        self.writer = writer
+        self.policy = policy or SlowConsumerPolicy()
+        # whether each frame may be dropped, apart so queueing a frame
+        # allocates nothing per client
+        self.frames = deque()
+        self.droppable = deque()
+        self.size = 0
+        self.closed = False
+        self.task = None
+        self.ring = None
+        self.codec = None
+        # when the writer started waiting for the client to read
+        self.blocked = None
+        self._ready = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._drained.set()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def start(self):
+        self.task = asyncio.create_task(self.flush_forever())
+
+    @property
+    def over_high_water(self):
+        return self.size > self.policy.high_water
+
+    def offer(self, frame, droppable=False):
+        """Queue a frame, returns True when the producer should wait()."""
+        if self.closed or self.writer is None:
+            # a session keeps what its connection will never write
+            if self.ring is not None:
+                self.ring.append(frame)
+            return False
+        self.frames.append(frame)
+        self.droppable.append(droppable)
+        self.size += len(frame)
+        self._ready.set()
+        if not self.over_high_water:
+            return False
+        action = self.policy.action
+        if action == SlowConsumerPolicy.BLOCK:
+            self._drained.clear()
+            return True
+        if action == SlowConsumerPolicy.DROP:
+            self.drop_presence()
+            if not self.over_high_water:
+                return False
+        self.disconnect()
+        return False
+
+    async def wait(self):
+        if not self._drained.is_set():
+            self.policy.counters["blocked"] += 1
+            await self._drained.wait()
+
+    async def put(self, frame, droppable=False):
+        if self.offer(frame, droppable):
+            await self.wait()
+
+    async def drain(self):
+        """Wait until the queue is down to the low-water mark."""
+        while self.size > self.policy.low_water and not self.closed:
+            self._drained.clear()
+            await self._drained.wait()
+
+    def drop_presence(self):
+        frames = deque()
+        flags = deque()
+        dropped = 0
+        for frame, droppable in zip(self.frames, self.droppable):
+            if droppable and self.size > self.policy.low_water:
+                self.size -= len(frame)
+                dropped += 1
+            else:
+                frames.append(frame)
+                flags.append(droppable)
+        self.frames = frames
+        self.droppable = flags
+        self.policy.counters["dropped"] += dropped
+        logging.debug("Dropped %d presence events", dropped)
+
+    def disconnect(self):
+        self.policy.counters["disconnected"] += 1
+        logging.warning("Outbox over high-water mark, disconnecting client")
+        self.closed = True
+        error = Outbox.error.wire(self.codec)
+        # the ring follows what the client got, the error and then the
+        # frames it never will
+        if self.ring is not None:
+            self.ring.append(error)
+        self.discard()
+        transport = self.writer.transport
+        transport.write(error)
+        transport.close()
+        # a peer that stopped reading never lets close() flush
+        asyncio.get_running_loop().call_later(CLOSE_TIMEOUT, transport.abort)
+
+    async def flush_forever(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                # everything queued goes out in one call, the frames are
+                # shared with every other outbox and never copied here
+                batch = []
+                closing = False
+                while self.frames:
+                    frame = self.frames.popleft()
+                    self.droppable.popleft()
+                    if frame is None:
+                        closing = True
+                        break
+                    self.size -= len(frame)
+                    batch.append(frame)
+                    if self.ring is not None:
+                        self.ring.append(frame)
+                if self.size <= self.policy.low_water:
+                    self._drained.set()
+                self.writer.writelines(batch)
+                if closing:
+                    self.closed = True
+                    self._drained.set()
+                    return
+                self.blocked = time.monotonic()
+                await self.writer.drain()
+                self.blocked = None
+        except ConnectionError as e:
+            logging.debug("Outbox flush failed: %s", e)
+            # nothing queued from now on will be written, don't wait for it
+            self.closed = True
+            self.discard()
+
+    def stalled(self, now):
+        """Seconds the writer has been waiting for the client to read."""
+        return 0 if self.blocked is None else now - self.blocked
+
+    def discard(self):
+        # frames that will never be written are still missed by the client
+        if self.ring is not None:
+            for frame in self.frames:
+                if frame is not None:
+                    self.ring.append(frame)
+        self.frames.clear()
+        self.droppable.clear()
+        self.size = 0
+        self._drained.set()
+
+    def suspend(self):
+        """Stop writing, frames from now on only go to the ring."""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.discard()
+        self.writer = None
+        self.blocked = None
+
+    def resume(self, writer, offset, greeting):
+        """Write greeting and then the frames the client missed after
+        offset, returns False if the ring no longer has all of them."""
+        missed = self.ring.since(offset)
+        if missed is None:
+            return False
+        self.writer = writer
+        self.closed = False
+        writer.write(greeting)
+        writer.write(missed)
+        self.start()
+        return True
+
+    async def close(self, timeout=CLOSE_TIMEOUT):
+        if self.task is None:
+            return
+        self.frames.append(None)
+        self.droppable.append(False)
+        self._ready.set()
+        try:
+            await asyncio.wait_for(self.task, timeout)
+        except asyncio.TimeoutError:
+            logging.debug("Outbox flush timed out")
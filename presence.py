@@ -0,0 +1,56 @@
+from message import Message
+import asyncio
+
+WINDOW = 0.5
+
+# the messages a PRESENCE_UPDATE stands for
+PRESENCE = frozenset({"NEW_USER", "NEW_STATUS", "DISCONNECTED"})
+
+
+class Presence:
+    """Merges the presence changes of a window into one PRESENCE_UPDATE.
+
+    Only the last status of each user within the window is sent, and not
+    at all if it's the one the previous update had, so a flapping status or
+    a quick reconnect costs nothing. Disconnected users have a null status.
+    The same frame goes to every client, their own changes included.
+    """
+
+    def __init__(self, send, window=WINDOW):
+        self.send = send
+        self.window = window
+        self.sent = {}
+        self.pending = {}
+        self.handle = None
+
+    def add(self, message):
+        match message:
+            case {"type": "DISCONNECTED", "username": username}:
+                self.pending[username] = None
+            case {"type": "NEW_STATUS", "username": username,
+                  "status": status}:
+                self.pending[username] = status
+            case {"type": "NEW_USER", "username": username}:
+                self.pending[username] = "ACTIVE"
+        if self.handle is None:
+            self.handle = asyncio.get_running_loop().call_later(
+                self.window, self.flush)
+
+    def flush(self):
+        self.handle = None
+        users = {}
+        for username, status in self.pending.items():
+            if self.sent.get(username) != status:
+                users[username] = status
+            if status is None:
+                self.sent.pop(username, None)
+            else:
+                self.sent[username] = status
+        self.pending.clear()
+        if users:
+            self.send(Message({"type": "PRESENCE_UPDATE", "users": users}))
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
@@ -1,67 +1,293 @@
 #!/usr/bin/env python
 from utils import BaseChat, MessageException
-from message import Message
-from collections import namedtuple
+from message import Message, shared
+from dispatch import Dispatcher, optional
+from state import ChatState
+from cluster import Cluster, run_workers, parse_address
+from capture import CaptureWriter
+from metrics import Registry, serve_metrics
+from mailboxes import Mailboxes, batches, MAX_BYTES, TTL
+from history import (History, history_frame, PUBLIC, PAGE_SIZE,
+                     MAX_PAGE_SIZE, SEGMENT_BYTES, SEGMENTS)
+from timers import TimingWheel
+from framing import MAX_FRAME_SIZE
+from presence import Presence, PRESENCE, WINDOW
+from compression import DEFLATE
+from binary import BINARY
+from subscriptions import ALL, CLASSES, mask, names
+from listeners import (SocketOptions, BACKLOG, LOOPS, listen, parse_bind,
+                       use_loop)
+from limits import (RateLimiter, TokenBucket, LIMITS, EXEMPT, parse_limit,
+                    parse_rate)
+from outbox import (Outbox, Ring, SlowConsumerPolicy, DROPPABLE, HIGH_WATER,
+                    LOW_WATER, RING_BYTES)
+import logs
+import tempfile
 import asyncio
+import secrets
+import bisect
+import hmac
+import time
 import socket
 import logging
 import argparse
+import signal
+import sys
+import os
+
+RESUME_GRACE = 30
+LOGIN_TIMEOUT = 10
+PING_INTERVAL = 30
+IDLE_TIMEOUT = 90
+WRITE_TIMEOUT = 30
+# seconds between flushes of the capture, what a killed server may lose
+CAPTURE_FLUSH = 1
+# bytes a connection's stream buffers hold before reading from or writing to
+# the socket pauses, asyncio's defaults
+READ_LIMIT = 2 ** 16
+WRITE_LIMIT = 2 ** 16
+# retry hint for connections refused because the server is full
+FULL_RETRY = 5
+USERS_PAGE_SIZE = 1000
+MAX_USERS_PAGE_SIZE = 10000
+# the names of a list, so the frame around them stays under the limit
+USERS_PAGE_BYTES = MAX_FRAME_SIZE - 1024
+
+# the codecs a client can ask for in IDENTIFY instead of JSON
+CODECS = {codec.name: codec for codec in (BINARY, DEFLATE)}
+
+PING = shared(type="PING")
+PONG = shared(type="PONG")
 
 
 class Server:
 
-    Room = namedtuple("Room", ["name", "users", "invites"])
+    commands = Dispatcher()
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, policy=None, cluster=None,
+                 reuse_port=False, capture=None, metrics=None,
+                 stats_token=None, history=None, mailboxes=None,
+                 resume_grace=RESUME_GRACE, resume_bytes=RING_BYTES,
+                 login_timeout=LOGIN_TIMEOUT, ping_interval=PING_INTERVAL,
+                 idle_timeout=IDLE_TIMEOUT, write_timeout=WRITE_TIMEOUT,
+                 wheel=None, limits=LIMITS, max_connections=0,
+                 login_rate=None, presence_window=WINDOW,
+                 codecs=tuple(CODECS.values()), read_limit=READ_LIMIT,
+                 write_limit=WRITE_LIMIT, sockets=None, binds=()):
         self.host = host
         self.port = port
-        self.users = {}
-        self.rooms = {}
+        self.policy = policy or SlowConsumerPolicy()
+        self.cluster = cluster
+        self.reuse_port = reuse_port
+        self.capture = capture
+        self.metrics_address = metrics
+        self.stats_token = stats_token
+        self.history = history
+        self.mailboxes = mailboxes
+        self.resume_grace = resume_grace
+        self.resume_bytes = resume_bytes
+        self.login_timeout = login_timeout
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.write_timeout = write_timeout
+        self.wheel = wheel or TimingWheel()
+        self.limits = limits
+        self.max_connections = max_connections
+        self.logins = None
+        if login_rate is not None and login_rate[0]:
+            self.logins = TokenBucket(*login_rate, time.monotonic())
+        self.connections = 0
+        self.presence = None
+        self.capabilities = set()
+        if presence_window:
+            self.presence = Presence(self.send_presence, presence_window)
+            self.capabilities.add("PRESENCE_UPDATE")
+        # only the clients that answer pings can be dropped for going quiet
+        if ping_interval or idle_timeout:
+            self.capabilities.add("PING")
+        # sessions live in one process, a RESUME may reach another node
+        if resume_grace and cluster is None:
+            self.capabilities.add("RESUME")
+        self.codecs = {codec.name: codec for codec in codecs}
+        self.capabilities.update(self.codecs)
+        self.read_limit = read_limit
+        self.write_limit = write_limit
+        self.sockets = sockets or SocketOptions()
+        self.binds = binds
+        self.listeners = []
+        self.sessions = {}
+        self.tasks = set()
+        self.state = ChatState(on_remove_room=self.forget_room)
+        self.listener = None
+        self.scraper = None
+        self.metrics = Registry()
+        self.handled = self.metrics.counter("messages_total", "type")
+        self.handling = self.metrics.histogram("handle_microseconds", "type")
+        self.fanout = self.metrics.histogram("fanout_microseconds", "target")
+        self.throttled = self.metrics.counter("throttled_total", "type")
+        self.rejected = self.metrics.counter("rejected_connections_total",
+                                             "reason")
+        self.metrics.counter("slow_consumers_total", "outcome",
+                             self.policy.counters)
+        self.metrics.gauge("connections", lambda: self.connections)
+        self.metrics.gauge("users", lambda: len(self.state.users))
+        self.metrics.gauge("local_users", lambda: len(self.state.local))
+        self.metrics.gauge("rooms", lambda: len(self.state.rooms))
+        self.metrics.gauge("outbox_bytes", self.outbox_bytes, "user")
 
-    async def run(self):
-        server = await asyncio.start_server(self.handle, self.host, self.port)
+    async def start(self):
+        if self.history is not None:
+            # the rooms of a previous run are gone, so is their history;
+            # in a cluster those still alive come back empty with the SYNC
+            self.history.drop_rooms()
+        if self.cluster is not None:
+            await self.cluster.start(self)
+        self.listener = await listen(self.handle, (self.host, self.port),
+                                     self.sockets, self.read_limit,
+                                     self.reuse_port)
+        for address in self.binds:
+            self.listeners.append(await listen(
+                self.handle, address, self.sockets, self.read_limit,
+                self.reuse_port))
         logging.info("Serving on:")
-        for sock in server.sockets:
-            logging.info(sock.getsockname())
-        async with server:
-            await server.serve_forever()
+        for listener in [self.listener, *self.listeners]:
+            for sock in listener.sockets:
+                logging.info(sock.getsockname())
+        if self.metrics_address is not None:
+            self.scraper = await serve_metrics(self.metrics,
+                                               *self.metrics_address)
+        if self.capture is not None:
+            self.wheel.schedule(CAPTURE_FLUSH, self.flush_capture)
+
+    def flush_capture(self):
+        self.capture.flush()
+        self.wheel.schedule(CAPTURE_FLUSH, self.flush_capture)
+
+    async def run(self):
+        await self.start()
+        try:
+            async with self.listener:
+                await self.listener.serve_forever()
+        finally:
+            for listener in self.listeners:
+                listener.close()
+            if self.cluster is not None:
+                await self.cluster.stop()
+            if self.capture is not None:
+                self.capture.shutdown()
+            if self.scraper is not None:
+                self.scraper.close()
+            if self.history is not None:
+                self.history.close()
+            self.wheel.close()
+            if self.presence is not None:
+                self.presence.close()
 
     async def handle(self, reader, writer):
-        handler = ClientHandler(reader, writer)
+        if not self.admit(writer):
+            return
+        self.connections += 1
+        if self.write_limit != WRITE_LIMIT:
+            writer.transport.set_write_buffer_limits(self.write_limit)
+        self.sockets.accept(writer)
+        handler = ClientHandler(reader, writer, self.policy, self.capture,
+                                self.limits)
+        handler.outbox.start()
+        if self.login_timeout:
+            self.watch(handler, self.login_timeout)
+        dropped = False
         try:
-            await self.login_user(handler)
+            handler = await self.login_user(handler)
+            self.watch(handler)
             await self.recv_messages(handler)
+            dropped = True
         except MessageException as e:
             logging.exception(e)
             await handler.send(Message({"type": "ERROR",
                                         "message": str(e)}))
         except asyncio.CancelledError as e:
-            logging.debug(f"Handler cancelado {str(e)}")
-        except asyncio.exceptions.IncompleteReadError:
+            logging.debug("Handler cancelado %s", e)
+        except (asyncio.exceptions.IncompleteReadError, ConnectionError):
             logging.debug("Client disconnected")
+            dropped = True
         finally:
-            await self.cleanup(handler)
+            self.connections -= 1
+            # a session resumed on another connection isn't ours anymore,
+            # and one that dropped without DISCONNECT may come back
+            if handler.writer is writer and not (dropped
+                                                 and self.suspend(handler)):
+                await self.cleanup(handler)
+
+    def admit(self, writer):
+        """Refuse the connection with a retry hint if the server is full or
+        there are too many logins per second."""
+        if self.max_connections and self.connections >= self.max_connections:
+            reason, retry = "full", FULL_RETRY
+        elif self.logins is not None:
+            reason, retry = "logins", self.logins.take(time.monotonic())
+        else:
+            return True
+        if not retry:
+            return True
+        self.rejected[reason] += 1
+        logging.debug("Connection refused: %s", reason)
+        writer.write(Message({"type": "WARNING",
+                              "message": "El servidor está ocupado, intenta "
+                              "de nuevo más tarde",
+                              "operation": "IDENTIFY",
+                              "retry_after": round(retry, 3)}).encoded)
+        writer.close()
+        return False
 
     async def login_user(self, handler):
         msg = await handler.recv()
-        logging.debug(f"Received on login: {msg.__repr__()}")
+        logging.debug("Received on login: %r", msg)
         match msg:
+            case {"type": "RESUME", "username": str(username),
+                  "token": str(token), "offset": int(offset)}:
+                return await self.resume(handler, username, token, offset)
             case {"type": "IDENTIFY", "username": str(username)}:
+                username = sys.intern(username)
+                # before the user exists, so a bad list leaves nothing behind
+                capabilities = (self.negotiate(msg["capabilities"])
+                                if "capabilities" in msg else None)
                 if not username:
                     raise asyncio.CancelledError("Login fallido, "
                                                  "usuario inválido")
-                elif username not in self.users:
+                elif (username not in self.state.users
+                      and await self.claim("user", username)):
                     handler.username = username
-                    self.users[username] = handler
-                    await handler.send(
-                        Message({"type": "INFO", "message": "success",
-                                 "operation": "IDENTIFY"})
-                    )
+                    if capabilities is not None:
+                        handler.capabilities = capabilities
+                    self.state.add_user(username, handler)
+                    await self.publish(Message({"type": "USER_UP",
+                                                "username": username,
+                                                "status": handler.status}))
+                    info = Message({"type": "INFO", "message": "success",
+                                    "operation": "IDENTIFY"})
+                    if capabilities is not None:
+                        info["capabilities"] = sorted(capabilities)
+                    if "RESUME" in handler.capabilities:
+                        info["token"] = self.open_session(handler)
+                    codec = next((self.codecs[capability]
+                                  for capability in handler.capabilities
+                                  if capability in self.codecs), None)
+                    if codec is not None:
+                        # a line of its own, the frames after it are in the
+                        # codec and so are the client's once it reads it
+                        await handler.outbox.put(info.encoded + b"\n")
+                        handler.use(codec)
+                    else:
+                        await handler.send(info)
                     await self.send_to_all(
                         handler.username,
                         Message({"type": "NEW_USER",
                                  "username": handler.username})
                     )
+                    if self.mailboxes is not None:
+                        self.mailboxes.register(username)
+                        await self.flush_mailbox(handler)
+                    return handler
                 else:
                     await handler.send(Message({"type": "WARNING",
                                                 "message": "El usuario "
@@ -72,355 +298,1074 @@ class Server:
                 raise MessageException("Expected message of type: "
                                        "'IDENTIFY'")
 
+    def negotiate(self, capabilities):
+        """The capabilities asked for in IDENTIFY that this server has, with
+        only the first codec asked for."""
+        if not isinstance(capabilities, list):
+            raise MessageException("Expected a list of capabilities")
+        accepted = [capability for capability in capabilities
+                    if isinstance(capability, str)
+                    and capability in self.capabilities]
+        codecs = [capability for capability in accepted
+                  if capability in self.codecs]
+        return frozenset(accepted).difference(codecs[1:])
+
+    def open_session(self, handler):
+        handler.token = secrets.token_urlsafe(16)
+        handler.outbox.ring = Ring(self.resume_bytes)
+        self.sessions[handler.token] = handler
+        return handler.token
+
+    def suspend(self, handler):
+        """Keep the session of a dropped connection for the grace period,
+        returns False if it can't be resumed."""
+        if handler.token is None or handler.username is None:
+            return False
+        handler.detach()
+        handler.expiry = self.wheel.schedule(self.resume_grace, self.expire,
+                                             handler)
+        logging.debug("Session of %s suspended", handler.username)
+        return True
+
+    def watch(self, handler, delay=None):
+        """Check on the connection of handler after delay seconds, or after
+        the shortest of the heartbeat intervals."""
+        handler.unwatch()
+        if delay is None:
+            delay = min((t for t in (self.ping_interval, self.idle_timeout,
+                                     self.write_timeout) if t), default=0)
+        if delay:
+            handler.timer = self.wheel.schedule(delay, self.heartbeat,
+                                                handler)
+
+    def heartbeat(self, handler):
+        """Close connections that didn't log in in time or stopped reading,
+        and, of the clients that asked for PING, ping the ones that are quiet
+        for a while and close those that went quiet."""
+        handler.timer = None
+        now = time.monotonic()
+        pings = "PING" in handler.capabilities
+        if handler.username is None:
+            reason = "login"
+        elif (self.write_timeout
+              and handler.outbox.stalled(now) > self.write_timeout):
+            reason = "write"
+        elif (pings and self.idle_timeout
+              and now - handler.seen > self.idle_timeout):
+            reason = "idle"
+        else:
+            if pings and self.ping_interval and now - handler.seen >= \
+                    self.ping_interval:
+                handler.post(PING)
+            self.watch(handler)
+            return
+        logging.debug("Closing connection of %s, %s timeout",
+                      handler.username, reason)
+        handler.writer.transport.abort()
+
+    def expire(self, handler):
+        task = asyncio.create_task(self.cleanup(handler))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def resume(self, handler, username, token, offset):
+        # nobody else sees the user leave and come back
+        session = self.sessions.get(token)
+        if (session is None or session.username != username
+                or not hmac.compare_digest(token, session.token)):
+            await handler.send(shared(type="WARNING",
+                                      message="No se pudo reanudar "
+                                      "la sesión",
+                                      operation="RESUME"))
+            raise asyncio.CancelledError("Reanudación fallida")
+        if session.expiry is None:
+            # the old connection hasn't noticed it's gone yet
+            session.writer.transport.abort()
+            session.detach()
+        else:
+            session.expiry.cancel()
+        session.expiry = None
+        handler.unwatch()
+        greeting = shared(type="INFO", message="success",
+                          operation="RESUME")
+        # the reply ends in a newline so the client can read it alone,
+        # whatever the session's codec makes of the frames after it
+        if not session.take_over(handler, offset, greeting.encoded + b"\n"):
+            await handler.send(shared(type="WARNING",
+                                      message="No se pudo reanudar "
+                                      "la sesión, los mensajes perdidos "
+                                      "ya no están disponibles",
+                                      operation="RESUME"))
+            await self.cleanup(session)
+            raise asyncio.CancelledError("Reanudación fallida")
+        # the session writes to the connection from now on
+        await handler.outbox.close()
+        logging.debug("Session of %s resumed", username)
+        return session
+
     async def recv_messages(self, handler):
-        while True:
-            response = await handler.recv()
-            match response:
-                case {"type": "STATUS",
-                      "status": ("AWAY" | "ACTIVE" | "BUSY") as status}:
-                    if status == handler.status:
-                        await handler.send(
-                            Message({"type": "WARNING",
-                                     "message": f"El estado ya es {status}",
-                                     "operation": "STATUS",
-                                     "status": status})
-                        )
-                    else:
-                        handler.status = status
-                        await handler.send(
-                            Message({"type": "INFO",
-                                     "message": "success",
-                                     "operation": "STATUS"})
-                        )
-                        await self.send_to_all(
-                            handler.username,
-                            Message({"type": "NEW_STATUS",
-                                     "username": handler.username,
-                                     "status": status})
-                        )
-
-                case {"type": "USERS"}:
-                    await handler.send(
-                        Message({"type": "USER_LIST",
-                                 "usernames": list(self.users.keys())})
-                    )
+        async for response in handler.messages():
+            method, fields = Server.commands.resolve(response)
+            kind = response["type"]
+            if kind not in EXEMPT:
+                retry = handler.limiter.take(kind, time.monotonic())
+                if retry:
+                    self.throttled[kind] += 1
+                    await handler.send(Message({
+                        "type": "WARNING",
+                        "message": "Demasiados mensajes, espera "
+                        f"{retry:.1f} segundos",
+                        "operation": kind,
+                        "retry_after": round(retry, 3)}))
+                    continue
+            self.handled[kind] += 1
+            start = time.perf_counter_ns()
+            await method(self, handler, **fields)
+            self.handling[kind].record(
+                (time.perf_counter_ns() - start) // 1000)
 
-                case {"type": "MESSAGE", "username": str(username),
-                      "message": str(message)}:
-                    if username == handler.username:
-                        await handler.send(
-                            Message({"type": "WARNING",
-                                     "operation": "MESSAGE",
-                                     "message":
-                                     "No puedes mandarte mensajes a tí mismo"})
-                        )
-
-                    elif username not in self.users:
-                        await handler.send(
-                            Message({"type": "WARNING",
-                                     "operation": "MESSAGE",
-                                     "message":
-                                     f"El usuario {username} no existe"})
-                        )
+    @commands.handler("STATUS", status=("AWAY", "ACTIVE", "BUSY"))
+    async def change_status(self, handler, status):
+        if status == handler.status:
+            await handler.send(
+                shared(type="WARNING",
+                       message=f"El estado ya es {status}",
+                       operation="STATUS",
+                       status=status)
+            )
+        else:
+            handler.status = status
+            await self.publish(Message({"type": "USER_STATUS",
+                                        "username": handler.username,
+                                        "status": status}))
+            await handler.send(
+                shared(type="INFO",
+                       message="success",
+                       operation="STATUS")
+            )
+            await self.send_to_all(
+                handler.username,
+                Message({"type": "NEW_STATUS",
+                         "username": handler.username,
+                         "status": status})
+            )
 
-                    else:
-                        await self.send_private_message(
-                            handler.username, username,
-                            Message({"type": "MESSAGE_FROM",
-                                     "username": handler.username,
-                                     "message": message})
-                        )
-
-                case {"type": "PUBLIC_MESSAGE", "message": str(message)}:
-                    await self.send_to_all(
-                        handler.username,
-                        Message({"type": "PUBLIC_MESSAGE_FROM",
-                                 "username": handler.username,
-                                 "message": message})
-                    )
+    @commands.handler("USERS", since=optional(int), after=optional(str),
+                      limit=optional(int))
+    async def list_users(self, handler, since, after, limit):
+        await handler.send(self.listing(
+            {"type": "USER_LIST"}, self.state.users.keys(),
+            self.state.directory, since, after, limit))
 
-                case {"type": "NEW_ROOM", "roomname": str(roomname)}:
-                    if roomname not in self.rooms:
-                        room = Server.Room(roomname, {handler.username}, set())
-                        self.rooms[room.name] = room
-                        await handler.send(
-                            Message({"type": "INFO",
-                                     "message": "success",
-                                     "operation": "NEW_ROOM",
-                                     "roomname": roomname})
-                        )
+    def listing(self, fields, names, log, since, after, limit):
+        """A reply to USERS or ROOM_USERS: the changes since a version while
+        they're kept, else a page of the sorted names when paging, else all
+        the names, whichever fits in a frame."""
+        if since is not None and log.covers(since):
+            added, removed = log.since(since)
+            if fitting(added + removed) == len(added) + len(removed):
+                return Message({**fields, "type": fields["type"] + "_DELTA",
+                                "version": log.version, "since": since,
+                                "added": added, "removed": removed})
+        if since is None and after is None and limit is None:
+            names = list(names)
+            if fitting(names) == len(names):
+                return Message({**fields, "usernames": names,
+                                "version": log.version})
+        # pages come from a sorted copy that may be a few versions old,
+        # the client catches up asking for the changes since its version
+        version, ordered = log.sorted(names)
+        limit = max(1, min(limit or USERS_PAGE_SIZE, MAX_USERS_PAGE_SIZE))
+        start = 0 if after is None else bisect.bisect_right(ordered, after)
+        page = ordered[start:start + limit]
+        count = max(1, fitting(page))
+        # the cursor repeats the last name of every page but the last one
+        while count > 1 and start + count < len(ordered) and fitting(
+                page[:count], USERS_PAGE_BYTES
+                - len(page[count - 1].encode("utf8"))) < count:
+            count -= 1
+        page = page[:count]
+        return Message({**fields, "usernames": page, "version": version,
+                        "cursor": page[-1] if start + count < len(ordered)
+                        else None})
 
-                    else:
-                        await handler.send(
-                            Message({"type": "WARNING",
-                                     "message":
-                                     f"El cuarto '{roomname}' ya existe",
-                                     "operation": "NEW_ROOM",
-                                     "roomname": roomname})
-                        )
-
-                case {"type": "INVITE", "roomname": str(roomname),
-                      "usernames": list(usernames)}:
-                    if roomname not in self.rooms:
-                        await handler.send(Message({"type": "WARNING",
-                                                    "message":
-                                                    f"El cuarto '{roomname}' "
-                                                    "no existe",
-                                                    "operation": "INVITE",
-                                                    "roomname": roomname}))
-
-                    elif (handler.username not in
-                          (room := self.rooms[roomname]).users):
-                        await handler.send(Message({"type": "WARNING",
-                                                    "message":
-                                                    "No eres miembro del "
-                                                    f"cuarto '{roomname}'",
-                                                    "operation": "INVITE",
-                                                    "roomname": roomname}))
-
-                    # walrus operator allows leaking, PEP 572 Appendix B
-                    elif any([(username := name) not in self.users
-                              for name in usernames]):
-                        await handler.send(Message({"type": "WARNING",
-                                                    "message":
-                                                    f"El usuario '{username}' "
-                                                    "no existe",
-                                                    "operation": "NEW_ROOM",
-                                                    "username": username}))
+    @commands.handler("MESSAGE", username=str, message=str)
+    async def private_message(self, handler, username, message):
+        if username == handler.username:
+            await handler.send(
+                shared(type="WARNING",
+                       operation="MESSAGE",
+                       message="No puedes mandarte mensajes a tí mismo")
+            )
 
-                    else:
-                        invite = Message({"type": "INVITATION",
-                                          "message": f"{handler.username} te "
-                                          f"invita al cuarto '{roomname}'",
-                                          "username": handler.username,
-                                          "roomname": roomname})
-                        for username in usernames:
-                            if (username not in room.users
-                                    and username not in room.invites):
-                                await self.users[username].send(invite)
-                                room.invites.add(username)
-                        await handler.send(Message({"type": "INFO",
-                                                    "message": "success",
-                                                    "operation": "INVITE",
-                                                    "roomname": roomname}))
-
-                case {"type": "JOIN_ROOM", "roomname": str(roomname)}:
-                    if roomname not in self.rooms:
-                        await handler.send(
-                            Message({"type": "WARNING",
-                                     "message": "El cuarto "
-                                     f"{roomname} no existe",
-                                     "operation": "JOIN_ROOM",
-                                     "roomname": roomname})
-                            )
-
-                    elif (handler.username in
-                          (room := self.rooms[roomname]).users):
-                        await handler.send(
-                            Message({"type": "WARNING",
-                                     "message": "El usuario ya se "
-                                     f"unió al cuarto {roomname}",
-                                     "operation": "JOIN_ROOM",
-                                     "roomname": roomname})
-                            )
-
-                    elif handler.username not in room.invites:
-                        await handler.send(
-                            Message({"type": "WARNING",
-                                     "message": "El usuario no ha "
-                                     "sido invitado al cuarto "
-                                     f"{roomname}",
-                                     "operation": "JOIN_ROOM",
-                                     "roomname": roomname})
-                            )
+        elif (username not in self.state.users
+              and self.mailboxes is not None
+              and username in self.mailboxes.known):
+            frame = Message({"type": "MESSAGE_FROM",
+                             "username": handler.username,
+                             "message": message})
+            if self.mailboxes.put(username, frame.encoded):
+                await handler.send(
+                    Message({"type": "INFO",
+                             "operation": "MESSAGE",
+                             "message": f"El usuario {username} no está "
+                             "conectado, recibirá el mensaje al conectarse",
+                             "username": username})
+                )
+            else:
+                await handler.send(
+                    Message({"type": "WARNING",
+                             "operation": "MESSAGE",
+                             "message": f"El buzón de {username} está lleno",
+                             "username": username})
+                )
 
-                    else:
-                        room.invites.discard(handler.username)
-                        room.users.add(handler.username)
-                        await handler.send(Message({"type": "INFO",
-                                                    "message": "success",
-                                                    "operation": "JOIN_ROOM",
-                                                    "roomname": roomname}))
-                        await self.send_to_all(handler.username,
-                                               Message({"type": "JOINED_ROOM",
-                                                        "roomname": roomname,
-                                                        "username":
-                                                        handler.username}))
-
-                case {"type": "ROOM_USERS", "roomname": str(roomname)}:
-                    if roomname not in self.rooms:
-                        await handler.send(
-                            Message({"type": "WARNING",
-                                     "message": f"El cuarto '{roomname}' "
-                                     " no existe",
-                                     "operation": "ROOM_USERS",
-                                     "roomname": roomname})
-                        )
-
-                    elif (handler.username not in
-                          (room := self.rooms[roomname]).users):
-                        await handler.send(
-                            Message({"type": "WARNING",
-                                     "message": "El usuario no se ha "
-                                     f"unido al cuarto '{roomname}'",
-                                     "operation": "ROOM_USERS",
-                                     "roomname": roomname})
-                        )
+        elif username not in self.state.users:
+            await handler.send(
+                Message({"type": "WARNING",
+                         "operation": "MESSAGE",
+                         "message": f"El usuario {username} no existe"})
+            )
 
-                    else:
-                        await handler.send(
-                            Message({"type": "ROOM_USER_LIST",
-                                     "usernames": list(room.users)})
-                        )
-
-                case {"type": "ROOM_MESSAGE", "roomname": str(roomname),
-                      "message": str(message)}:
-                    if roomname not in self.rooms:
-                        await handler.send(
-                            Message({"type": "WARNING",
-                                     "message": f"El cuarto '{roomname}' "
-                                     " no existe",
-                                     "operation": "ROOM_MESSAGE",
-                                     "roomname": roomname})
-                        )
-
-                    elif (handler.username not in
-                          (room := self.rooms[roomname]).users):
-                        await handler.send(
-                            Message({"type": "WARNING",
-                                     "message": "El usuario no se ha "
-                                     f"unido al cuarto '{roomname}'",
-                                     "operation": "ROOM_MESSAGE",
-                                     "roomname": roomname})
-                        )
+        else:
+            await self.send_private_message(
+                handler.username, username,
+                Message({"type": "MESSAGE_FROM",
+                         "username": handler.username,
+                         "message": message})
+            )
 
-                    else:
-                        await self.send_to_room(
-                            room, handler.username,
-                            Message({"type": "ROOM_MESSAGE_FROM",
-                                     "roomname": roomname,
-                                     "username": handler.username,
-                                     "message": message})
-                        )
-
-                case {"type": "LEAVE_ROOM", "roomname": roomname}:
-                    if roomname not in self.rooms:
-                        await handler.send(
-                            Message({"type": "WARNING",
-                                     "message": f"El cuarto '{roomname}' "
-                                     " no existe",
-                                     "operation": "LEAVE_ROOM",
-                                     "roomname": roomname})
-                        )
-
-                    elif (handler.username not in
-                          (room := self.rooms[roomname]).users):
-                        await handler.send(
-                            Message({"type": "WARNING",
-                                     "message": "El usuario no se ha "
-                                     f"unido al cuarto '{roomname}'",
-                                     "operation": "LEAVE_ROOM",
-                                     "roomname": roomname})
-                        )
+    @commands.handler("PUBLIC_MESSAGE", message=str)
+    async def public_message(self, handler, message):
+        message = Message({"type": "PUBLIC_MESSAGE_FROM",
+                           "username": handler.username,
+                           "message": message})
+        self.record(PUBLIC, message)
+        await self.send_to_all(handler.username, message)
 
-                    else:
-                        await handler.send(
-                            Message({"type": "INFO",
-                                     "message": "success",
-                                     "operation": "LEAVE_ROOM",
-                                     "roomname": roomname})
-                        )
-                        room.users.discard(handler.username)
-                        if not room.users:
-                            self.rooms.pop(roomname)
-                        else:
-                            await self.send_to_room(
-                                room, handler.username,
-                                Message({"type": "LEFT_ROOM",
-                                         "roomname": roomname,
-                                         "username": handler.username})
-                            )
-
-                case {"type": "DISCONNECT"}:
-                    raise asyncio.CancelledError("Disconnect")
-                case _:
-                    raise MessageException("Bad format: "
-                                           + response.__repr__())
+    @commands.handler("NEW_ROOM", roomname=str)
+    async def new_room(self, handler, roomname):
+        if (roomname not in self.state.rooms
+                and await self.claim("room", roomname)):
+            self.state.create_room(roomname, handler.username)
+            await self.publish(Message({"type": "ROOM_JOIN",
+                                        "roomname": roomname,
+                                        "username": handler.username}))
+            await handler.send(
+                Message({"type": "INFO",
+                         "message": "success",
+                         "operation": "NEW_ROOM",
+                         "roomname": roomname})
+            )
+
+        else:
+            await handler.send(
+                Message({"type": "WARNING",
+                         "message": f"El cuarto '{roomname}' ya existe",
+                         "operation": "NEW_ROOM",
+                         "roomname": roomname})
+            )
+
+    @commands.handler("INVITE", roomname=str, usernames=list)
+    async def invite(self, handler, roomname, usernames):
+        if roomname not in self.state.rooms:
+            await handler.send(Message({"type": "WARNING",
+                                        "message": f"El cuarto '{roomname}' "
+                                        "no existe",
+                                        "operation": "INVITE",
+                                        "roomname": roomname}))
+
+        elif (handler.username not in
+              (room := self.state.rooms[roomname]).users):
+            await handler.send(Message({"type": "WARNING",
+                                        "message": "No eres miembro del "
+                                        f"cuarto '{roomname}'",
+                                        "operation": "INVITE",
+                                        "roomname": roomname}))
+
+        # walrus operator allows leaking, PEP 572 Appendix B
+        elif any([(username := name) not in self.state.users
+                  for name in usernames]):
+            await handler.send(Message({"type": "WARNING",
+                                        "message": f"El usuario '{username}' "
+                                        "no existe",
+                                        "operation": "INVITE",
+                                        "username": username}))
+
+        else:
+            invite = Message({"type": "INVITATION",
+                              "message": f"{handler.username} te "
+                              f"invita al cuarto '{roomname}'",
+                              "username": handler.username,
+                              "roomname": roomname})
+            invited = []
+            for username in usernames:
+                if (username not in room.users
+                        and username not in room.invites):
+                    invited.append(self.state.users[username])
+                    self.state.invite(room, username)
+                    await self.publish(Message({"type": "ROOM_INVITE",
+                                                "roomname": roomname,
+                                                "username": username}))
+            await self.deliver(invited, invite)
+            await handler.send(Message({"type": "INFO",
+                                        "message": "success",
+                                        "operation": "INVITE",
+                                        "roomname": roomname}))
+
+    @commands.handler("JOIN_ROOM", roomname=str)
+    async def join_room(self, handler, roomname):
+        if roomname not in self.state.rooms:
+            await handler.send(
+                Message({"type": "WARNING",
+                         "message": "El cuarto "
+                         f"{roomname} no existe",
+                         "operation": "JOIN_ROOM",
+                         "roomname": roomname})
+                )
+
+        elif (handler.username in
+              (room := self.state.rooms[roomname]).users):
+            await handler.send(
+                Message({"type": "WARNING",
+                         "message": "El usuario ya se "
+                         f"unió al cuarto {roomname}",
+                         "operation": "JOIN_ROOM",
+                         "roomname": roomname})
+                )
+
+        elif handler.username not in room.invites:
+            await handler.send(
+                Message({"type": "WARNING",
+                         "message": "El usuario no ha "
+                         "sido invitado al cuarto "
+                         f"{roomname}",
+                         "operation": "JOIN_ROOM",
+                         "roomname": roomname})
+                )
+
+        else:
+            self.state.join(room, handler.username)
+            await self.publish(Message({"type": "ROOM_JOIN",
+                                        "roomname": roomname,
+                                        "username": handler.username}))
+            await handler.send(Message({"type": "INFO",
+                                        "message": "success",
+                                        "operation": "JOIN_ROOM",
+                                        "roomname": roomname}))
+            await self.send_to_all(handler.username,
+                                   Message({"type": "JOINED_ROOM",
+                                            "roomname": roomname,
+                                            "username":
+                                            handler.username}))
+
+    @commands.handler("ROOM_USERS", roomname=str, since=optional(int),
+                      after=optional(str), limit=optional(int))
+    async def room_users(self, handler, roomname, since, after, limit):
+        if roomname not in self.state.rooms:
+            await handler.send(
+                Message({"type": "WARNING",
+                         "message": f"El cuarto '{roomname}' "
+                         " no existe",
+                         "operation": "ROOM_USERS",
+                         "roomname": roomname})
+            )
+
+        elif (handler.username not in
+              (room := self.state.rooms[roomname]).users):
+            await handler.send(
+                Message({"type": "WARNING",
+                         "message": "El usuario no se ha "
+                         f"unido al cuarto '{roomname}'",
+                         "operation": "ROOM_USERS",
+                         "roomname": roomname})
+            )
+
+        else:
+            await handler.send(self.listing(
+                {"type": "ROOM_USER_LIST", "roomname": roomname},
+                room.users, room.log, since, after, limit))
+
+    @commands.handler("ROOM_MESSAGE", roomname=str, message=str)
+    async def room_message(self, handler, roomname, message):
+        if roomname not in self.state.rooms:
+            await handler.send(
+                Message({"type": "WARNING",
+                         "message": f"El cuarto '{roomname}' "
+                         " no existe",
+                         "operation": "ROOM_MESSAGE",
+                         "roomname": roomname})
+            )
+
+        elif (handler.username not in
+              (room := self.state.rooms[roomname]).users):
+            await handler.send(
+                Message({"type": "WARNING",
+                         "message": "El usuario no se ha "
+                         f"unido al cuarto '{roomname}'",
+                         "operation": "ROOM_MESSAGE",
+                         "roomname": roomname})
+            )
+
+        else:
+            message = Message({"type": "ROOM_MESSAGE_FROM",
+                               "roomname": roomname,
+                               "username": handler.username,
+                               "message": message})
+            self.record(roomname, message)
+            await self.send_to_room(room, handler.username, message)
+
+    @commands.handler("LEAVE_ROOM", roomname=str)
+    async def leave_room(self, handler, roomname):
+        if roomname not in self.state.rooms:
+            await handler.send(
+                Message({"type": "WARNING",
+                         "message": f"El cuarto '{roomname}' "
+                         " no existe",
+                         "operation": "LEAVE_ROOM",
+                         "roomname": roomname})
+            )
+
+        elif (handler.username not in
+              (room := self.state.rooms[roomname]).users):
+            await handler.send(
+                Message({"type": "WARNING",
+                         "message": "El usuario no se ha "
+                         f"unido al cuarto '{roomname}'",
+                         "operation": "LEAVE_ROOM",
+                         "roomname": roomname})
+            )
+
+        else:
+            await handler.send(
+                Message({"type": "INFO",
+                         "message": "success",
+                         "operation": "LEAVE_ROOM",
+                         "roomname": roomname})
+            )
+            left = self.state.leave(room, handler.username)
+            await self.publish(Message({"type": "ROOM_LEAVE",
+                                        "roomname": roomname,
+                                        "username": handler.username}))
+            if left:
+                await self.send_to_room(
+                    room, handler.username,
+                    Message({"type": "LEFT_ROOM",
+                             "roomname": roomname,
+                             "username": handler.username})
+                )
+
+    @commands.handler("STATS", token=str)
+    async def stats(self, handler, token):
+        if self.stats_token is None or not hmac.compare_digest(
+                token.encode("utf8"), self.stats_token.encode("utf8")):
+            await handler.send(
+                shared(type="WARNING",
+                       message="No tienes permiso de ver las "
+                       "estadísticas",
+                       operation="STATS")
+            )
+        else:
+            await handler.send(
+                Message({"type": "STATS_REPORT",
+                         "stats": self.metrics.snapshot()})
+            )
+
+    @commands.handler("HISTORY", roomname=optional(str),
+                      before=optional(int), limit=optional(int, PAGE_SIZE))
+    async def room_history(self, handler, roomname, before, limit):
+        if self.history is None:
+            await handler.send(
+                shared(type="WARNING",
+                       message="El historial no está habilitado",
+                       operation="HISTORY")
+            )
+
+        elif roomname is not None and roomname not in self.state.rooms:
+            await handler.send(
+                Message({"type": "WARNING",
+                         "message": f"El cuarto '{roomname}' no existe",
+                         "operation": "HISTORY",
+                         "roomname": roomname})
+            )
+
+        elif (roomname is not None and handler.username not in
+              self.state.rooms[roomname].users):
+            await handler.send(
+                Message({"type": "WARNING",
+                         "message": "El usuario no se ha "
+                         f"unido al cuarto '{roomname}'",
+                         "operation": "HISTORY",
+                         "roomname": roomname})
+            )
+
+        else:
+            records, cursor = self.history.read(
+                roomname, before, max(1, min(limit, MAX_PAGE_SIZE)))
+            fields = {"type": "HISTORY_LIST", "cursor": cursor}
+            if roomname is not None:
+                fields["roomname"] = roomname
+            await handler.send(history_frame(fields, records))
+
+    @commands.handler("SUBSCRIBE", events=optional(list),
+                      mute=optional(list))
+    async def subscribe(self, handler, events, mute):
+        try:
+            bits = handler.events if events is None else mask(events)
+        except ValueError as e:
+            raise MessageException(str(e)) from None
+        if mute is not None:
+            if not all(isinstance(username, str) for username in mute):
+                raise MessageException("Expected a list of usernames")
+            handler.muted = frozenset(mute) or None
+        handler.events = bits
+        self.state.subscribe(handler.username, bits)
+        await handler.send(Message({"type": "INFO", "message": "success",
+                                    "operation": "SUBSCRIBE",
+                                    "events": names(bits),
+                                    "mute": sorted(handler.muted or ())}))
+
+    @commands.handler("PING")
+    async def ping(self, handler):
+        await handler.send(PONG)
+
+    @commands.handler("PONG")
+    async def pong(self, handler):
+        pass
+
+    @commands.handler("DISCONNECT")
+    async def disconnect(self, handler):
+        raise asyncio.CancelledError("Disconnect")
 
     async def send_to_all(self, username, message):
-        logging.debug(f"Sending to all:{message.__repr__()}")
-        for name, user in self.users.items():
-            if name == username:
-                continue
-            await user.send(message)
+        logging.debug("Sending to all: %r", message)
+        start = time.perf_counter_ns()
+        # only the users that take its event class, not every connection
+        event = CLASSES.get(message["type"])
+        users = (self.state.local if event is None
+                 else self.state.listeners[event])
+        await self.deliver((user for name, user in users.items()
+                            if name != username), message)
+        if self.cluster is not None:
+            await self.cluster.broadcast(message, username)
+        self.fanout["all"].record((time.perf_counter_ns() - start) // 1000)
 
     async def send_to_room(self, room, username, message):
-        logging.debug(f"Room message from: {username}")
-        logging.debug(message.__repr__())
-        for name in room.users:
-            if name == username:
-                continue
-            await self.users[name].send(message)
+        logging.debug("Room message from %s: %r", username, message)
+        start = time.perf_counter_ns()
+        users = [self.state.users[name] for name in room.users
+                 if name != username]
+        await self.deliver(users, message)
+        if self.cluster is not None:
+            # the nodes without members keep the room's history too
+            reached = {user.node for user in users}
+            for node in list(self.cluster.links):
+                if node not in reached:
+                    await self.cluster.forward(node, [], message)
+        self.fanout["room"].record((time.perf_counter_ns() - start) // 1000)
 
     async def send_private_message(self, username, receiver, message):
-        logging.debug(f"Private message: {username} -> {receiver}")
-        logging.debug(message.__repr__())
-        await self.users[receiver].send(message)
+        logging.debug("Private message %s -> %s: %r", username, receiver,
+                      message)
+        await self.deliver((self.state.users[receiver],), message)
+
+    async def deliver(self, users, message):
+        # presence messages always go to everyone, so the clients that
+        # take PRESENCE_UPDATE get them in the next batch instead
+        kind = message["type"]
+        batched = self.presence is not None and kind in PRESENCE
+        event = CLASSES.get(kind, 0)
+        sender = message.get("username")
+        blocked = []
+        remote = {}
+        for user in users:
+            if user.node is not None:
+                remote.setdefault(user.node, []).append(user.username)
+            elif (event and not user.events & event
+                  or user.muted and sender in user.muted):
+                continue
+            elif batched and "PRESENCE_UPDATE" in user.capabilities:
+                continue
+            elif user.post(message):
+                blocked.append(user)
+        if batched:
+            self.presence.add(message)
+        for node, usernames in remote.items():
+            await self.cluster.forward(node, usernames, message)
+        for user in blocked:
+            await user.outbox.wait()
+
+    def send_presence(self, message):
+        event = CLASSES[message["type"]]
+        for user in self.state.listeners[event].values():
+            if "PRESENCE_UPDATE" in user.capabilities:
+                user.post(message)
+
+    async def flush_mailbox(self, user):
+        # the file is read in a thread and sent in batches, so a large
+        # backlog neither stalls the loop nor overflows the outbox
+        username = user.username
+        path = self.mailboxes.detach(username)
+        if path is None:
+            return
+        frames = await asyncio.to_thread(self.mailboxes.read, path)
+        if user.node is not None:
+            for frame in frames:
+                await self.cluster.forward(user.node, [username],
+                                           Message.from_encoded(frame))
+            return
+        wire = frames if user.codec is None else [
+            Message.from_trusted(frame).wire(user.codec) for frame in frames]
+        for start, batch in batches(wire):
+            await user.outbox.put(batch)
+            await user.outbox.drain()
+            if user.outbox.closed:
+                # the connection ended before getting everything, keep the
+                # rest and the batch it may not have got, at the risk of
+                # delivering that one twice
+                for frame in frames[start:]:
+                    self.mailboxes.put(username, frame)
+                return
+
+    def remote_login(self, user):
+        if self.mailboxes is not None:
+            self.mailboxes.register(user.username)
+            task = asyncio.create_task(self.flush_mailbox(user))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    def record(self, roomname, message):
+        if self.history is not None:
+            self.history.append(roomname, message.encoded)
+
+    def forget_room(self, roomname):
+        if self.history is not None:
+            self.history.drop(roomname)
+
+    def outbox_bytes(self):
+        # only the handlers with something queued, the rest are 0
+        return {username: user.outbox.size
+                for username, user in self.state.local.items()
+                if user.outbox.size}
+
+    async def claim(self, kind, name):
+        if self.cluster is None:
+            return True
+        return await self.cluster.claim(kind, name)
+
+    async def publish(self, event):
+        if self.cluster is not None:
+            await self.cluster.publish(event)
+
+    async def evict(self, username):
+        # another node won the username, forget ours without telling the
+        # rest of the chat it left
+        user = self.state.users[username]
+        self.state.remove_user(username)
+        if user.node is None:
+            user.username = None
+            transport = user.writer.transport
+            warning = Message({"type": "WARNING",
+                               "message": f"El usuario {username} ya existe",
+                               "operation": "IDENTIFY",
+                               "username": username})
+            transport.write(warning.wire(user.codec))
+            transport.close()
+
+    async def node_down(self, node):
+        # the node can't tell its users left, so tell the local ones here
+        for username, user in list(self.state.users.items()):
+            if user.node != node:
+                continue
+            for room in self.state.remove_user(username):
+                await self.deliver(
+                    (self.state.local[name] for name in room.users
+                     if name in self.state.local),
+                    Message({"type": "LEFT_ROOM",
+                             "roomname": room.name,
+                             "username": username})
+                )
+            await self.deliver(self.state.listeners[
+                                   CLASSES["DISCONNECTED"]].values(),
+                               Message({"type": "DISCONNECTED",
+                                        "username": username}))
 
     async def cleanup(self, handler):
+        if handler.token is not None:
+            del self.sessions[handler.token]
+            if handler.expiry is not None:
+                handler.expiry.cancel()
         if handler.username is not None:
-            del self.users[handler.username]
-            for room in self.rooms.values():
-                if handler.username in room.users:
-                    room.users.discard(handler.username)
-                    await self.send_to_room(
-                        room, handler.username,
-                        Message({"type": "LEFT_ROOM",
-                                 "roomname": room.name,
-                                 "username":
-                                 handler.username})
-                    )
-                elif handler.username in room.invites:
-                    room.invites.discard(handler.username)
+            await self.publish(Message({"type": "USER_DOWN",
+                                        "username": handler.username}))
+            for room in self.state.remove_user(handler.username):
+                await self.send_to_room(
+                    room, handler.username,
+                    Message({"type": "LEFT_ROOM",
+                             "roomname": room.name,
+                             "username":
+                             handler.username})
+                )
 
             await self.send_to_all(
                     handler.username,
                     Message({"type": "DISCONNECTED",
                              "username": handler.username})
                 )
-            handler.writer.close()
-            await handler.writer.wait_closed()
-            logging.debug(f"Cleaned-up handler for {handler.username}")
+        await handler.close()
+        logging.debug("Cleaned-up handler for %s", handler.username)
+
 
 class ClientHandler(BaseChat):
-    def __init__(self, reader, writer):
-        self.reader = reader
-        self.writer = writer
+    __slots__ = ("limiter", "outbox", "username", "status", "capabilities",
+                 "events", "muted", "token", "expiry", "timer", "seen",
+                 "capture", "connection")
+    node = None
+
+    def __init__(self, reader, writer, policy=None, capture=None,
+                 limits=LIMITS):
+        self.attach(reader, writer)
+        self.limiter = RateLimiter(limits)
+        self.outbox = Outbox(writer, policy)
         self.username = None
         self.status = "ACTIVE"
+        self.capabilities = frozenset()
+        # event classes it wants and the users it doesn't want to hear from
+        self.events = ALL
+        self.muted = None
+        self.token = None
+        self.expiry = None
+        self.timer = None
+        self.seen = time.monotonic()
+        self.capture = capture
+        self.connection = None
+        if capture is not None:
+            self.connection = capture.open(writer.get_extra_info("peername"))
+
+    async def recv_frame(self):
+        frame = await super().recv_frame()
+        self.seen = time.monotonic()
+        if self.capture is not None:
+            # captures hold JSON, whatever the codec
+            if self.codec is not None:
+                frame = self.codec.decode(frame).encoded
+            self.capture.frame(self.connection, frame)
+        return frame
+
+    async def send(self, message):
+        await self.outbox.put(message.wire(self.codec))
+
+    def post(self, message):
+        return self.outbox.offer(message.wire(self.codec),
+                                 message["type"] in DROPPABLE)
+
+    def use(self, codec):
+        super().use(codec)
+        self.outbox.codec = codec
+
+    def detach(self):
+        """The connection is gone, keep what the client misses in the ring
+        while the session lasts."""
+        self.unwatch()
+        self.outbox.suspend()
+        self.writer.close()
+        if self.capture is not None:
+            self.capture.close(self.connection)
+            self.connection = None
+
+    def take_over(self, handler, offset, greeting):
+        """Continue this session on the connection of handler."""
+        if not self.outbox.resume(handler.writer, offset, greeting):
+            return False
+        self.reader = handler.reader
+        self.writer = handler.writer
+        self.decoder = (handler.decoder if self.codec is None
+                        else self.codec.decoder())
+        self.frames = handler.frames
+        self.connection = handler.connection
+        self.seen = handler.seen
+        return True
+
+    def unwatch(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    async def close(self):
+        self.unwatch()
+        if self.capture is not None and self.connection is not None:
+            self.capture.close(self.connection)
+        await self.outbox.close()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
 
 
-async def main(host, port):
-    server = Server(host, port)
+async def main(host, port, **options):
+    server = Server(host, port, **options)
     await server.run()
 
 
+def fitting(names, max_bytes=USERS_PAGE_BYTES):
+    """How many of names, from the first, fit in max_bytes of a list."""
+    size = 0
+    for count, name in enumerate(names):
+        # the quotes and the separator around it
+        size += len(name.encode("utf8")) + 4
+        if size > max_bytes:
+            return count
+    return len(names)
+
+
+def options(args, index=None):
+    """Server keyword arguments from the command line; worker index gets
+    its own capture file, metrics port and history directory."""
+    options = {"policy": SlowConsumerPolicy(args.slow_consumer,
+                                            args.high_water, args.low_water),
+               "stats_token": args.stats_token,
+               "resume_grace": args.resume_grace,
+               "resume_bytes": args.resume_bytes,
+               "login_timeout": args.login_timeout,
+               "ping_interval": args.ping_interval,
+               "idle_timeout": args.idle_timeout,
+               "write_timeout": args.write_timeout,
+               "limits": {**LIMITS, **dict(args.rate_limit)},
+               "max_connections": args.max_connections,
+               "login_rate": args.login_rate,
+               "presence_window": args.presence_window,
+               "codecs": [codec for name, codec in CODECS.items()
+                          if name not in args.no_codec],
+               "read_limit": args.read_limit,
+               "write_limit": args.write_limit,
+               "sockets": SocketOptions(args.backlog, not args.no_nodelay,
+                                        args.sndbuf, args.rcvbuf),
+               "binds": args.bind}
+    if args.capture is not None:
+        options["capture"] = CaptureWriter(
+            args.capture if index is None else f"{args.capture}.{index}")
+    if args.metrics is not None:
+        options["metrics"] = (args.metrics[0], args.metrics[1] + (index or 0))
+    if args.history is not None:
+        options["history"] = History(
+            args.history if index is None
+            else os.path.join(args.history, f"worker-{index}"),
+            args.history_segment_bytes, segments=args.history_segments)
+    if args.mailbox is not None:
+        options["mailboxes"] = Mailboxes(
+            args.mailbox if index is None
+            else os.path.join(args.mailbox, f"worker-{index}"),
+            args.mailbox_bytes, args.mailbox_ttl)
+    return options
+
+
+def config_args(line):
+    """Arguments from a line of an @FILE configuration: option = value, or
+    just option for a flag; blank lines and those starting with # are
+    skipped."""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return []
+    option, equals, value = line.partition("=")
+    option = "--" + option.strip().removeprefix("--")
+    return [f"{option}={value.strip()}"] if equals else [option]
+
+
+def worker(index, workers, sockets, args):
+    nodes = {f"worker-{i}": os.path.join(sockets, f"worker-{i}.sock")
+             for i in range(workers)}
+    cluster = Cluster(f"worker-{index}", nodes)
+    try:
+        asyncio.run(main(args.host, args.port, cluster=cluster,
+                         reuse_port=True, **options(args, index)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logs.shutdown()
+
+
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(fromfile_prefix_chars="@")
+    parser.convert_arg_line_to_args = config_args
     parser.add_argument("-m", "--host", help="host address",
                         default=socket.gethostname())
     parser.add_argument("-p", "--port", type=int, default=8080)
     parser.add_argument("--silent", action="store_true",
                         help="do not show debug info")
+    parser.add_argument("--log-level", default="DEBUG",
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR",
+                                 "CRITICAL"])
+    parser.add_argument("--log-format", default="text", choices=logs.FORMATS,
+                        help="json writes one object per line")
+    parser.add_argument("--log-sample", type=logs.parse_sample,
+                        action="append", default=[], metavar="TYPE=N",
+                        help="log only one in N debug and info records "
+                        "about messages of TYPE, repeat for each type")
+    parser.add_argument("--slow-consumer", default="disconnect",
+                        choices=SlowConsumerPolicy.ACTIONS,
+                        help="action taken when a client's outbound buffer "
+                        "exceeds the high-water mark")
+    parser.add_argument("--high-water", type=int, default=HIGH_WATER,
+                        help="outbound buffer bytes that trigger the "
+                        "slow consumer action")
+    parser.add_argument("--low-water", type=int, default=LOW_WATER,
+                        help="outbound buffer bytes below which a blocked "
+                        "sender resumes")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="number of processes sharing the port through "
+                        "SO_REUSEPORT")
+    parser.add_argument("--cluster", type=parse_address,
+                        metavar="HOST:PORT",
+                        help="address this node listens on for other nodes "
+                        "of a federated chat")
+    parser.add_argument("--peer", type=parse_address, action="append",
+                        default=[], metavar="HOST:PORT",
+                        help="cluster address of another node, repeat for "
+                        "each node")
+    parser.add_argument("--capture", metavar="FILE",
+                        help="record every inbound frame to FILE for "
+                        "bench.replay, with --workers each worker writes "
+                        "FILE.N")
+    parser.add_argument("--metrics", type=parse_address, metavar="HOST:PORT",
+                        help="serve metrics in the Prometheus text format "
+                        "over HTTP, with --workers worker N uses PORT+N")
+    parser.add_argument("--stats-token", metavar="TOKEN",
+                        help="token clients must send in STATS messages, "
+                        "STATS is refused without it")
+    parser.add_argument("--history", metavar="DIR",
+                        help="keep the messages of rooms and the public "
+                        "chat in DIR for HISTORY, with --workers worker N "
+                        "uses DIR/worker-N")
+    parser.add_argument("--history-segment-bytes", type=int,
+                        default=SEGMENT_BYTES,
+                        help="size of each history segment file")
+    parser.add_argument("--history-segments", type=int, default=SEGMENTS,
+                        help="segments kept for each room, older ones are "
+                        "deleted")
+    parser.add_argument("--mailbox", metavar="DIR",
+                        help="keep private messages for known users that "
+                        "are offline in DIR, with --workers worker N uses "
+                        "DIR/worker-N")
+    parser.add_argument("--mailbox-bytes", type=int, default=MAX_BYTES,
+                        help="size limit of each user's mailbox")
+    parser.add_argument("--mailbox-ttl", type=float, default=TTL,
+                        help="seconds a message waits in a mailbox before "
+                        "it's discarded")
+    parser.add_argument("--resume-grace", type=float, default=RESUME_GRACE,
+                        help="seconds a dropped client has to resume its "
+                        "session before it's disconnected, 0 disables "
+                        "resuming; there's no resuming with --workers or "
+                        "--cluster")
+    parser.add_argument("--resume-bytes", type=int, default=RING_BYTES,
+                        help="bytes of recent messages kept for each "
+                        "session to resend on resume")
+    parser.add_argument("--login-timeout", type=float, default=LOGIN_TIMEOUT,
+                        help="seconds a connection has to IDENTIFY or "
+                        "RESUME, 0 waits forever")
+    parser.add_argument("--ping-interval", type=float, default=PING_INTERVAL,
+                        help="seconds of silence from a client that asked "
+                        "for PING after which it's sent one, 0 disables "
+                        "pings")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                        help="seconds of silence from a client that asked "
+                        "for PING after which its connection is dropped, 0 "
+                        "disables it")
+    parser.add_argument("--write-timeout", type=float, default=WRITE_TIMEOUT,
+                        help="seconds a client may go without reading what "
+                        "it's sent before its connection is dropped, 0 "
+                        "disables it")
+    parser.add_argument("--rate-limit", type=parse_limit, action="append",
+                        default=[], metavar="TYPE=RATE[/BURST]",
+                        help="messages of TYPE each client may send per "
+                        "second, * for all messages, a RATE of 0 lifts the "
+                        "limit; repeat for each type, defaults to " + ", ".join(
+                            f"{kind}={rate:g}/{burst:g}"
+                            for kind, (rate, burst) in LIMITS.items()))
+    parser.add_argument("--max-connections", type=int, default=0,
+                        help="connections refused beyond this many, 0 for "
+                        "no limit; with --workers it's per worker")
+    parser.add_argument("--login-rate", type=parse_rate,
+                        metavar="RATE[/BURST]",
+                        help="new connections accepted per second, with "
+                        "--workers it's per worker")
+    parser.add_argument("--presence-window", type=float, default=WINDOW,
+                        help="seconds of presence changes merged into each "
+                        "PRESENCE_UPDATE, 0 turns PRESENCE_UPDATE off")
+    parser.add_argument("--no-codec", action="append", default=[],
+                        choices=CODECS, metavar="CODEC",
+                        help="don't offer clients this codec, BINARY or "
+                        "DEFLATE, can be repeated")
+    parser.add_argument("--read-limit", type=int, default=READ_LIMIT,
+                        help="bytes buffered from each client before "
+                        "reading its socket pauses, lower saves memory "
+                        "with many idle clients")
+    parser.add_argument("--write-limit", type=int, default=WRITE_LIMIT,
+                        help="bytes buffered for each client's socket "
+                        "before its outbox waits for it to drain")
+    parser.add_argument("--backlog", type=int, default=BACKLOG,
+                        help="connections the system queues for each "
+                        "listener until the server accepts them")
+    parser.add_argument("--no-nodelay", action="store_true",
+                        help="keep Nagle's algorithm on client connections, "
+                        "fewer packets for more latency")
+    parser.add_argument("--sndbuf", type=int, default=0,
+                        help="SO_SNDBUF of client connections, 0 keeps the "
+                        "system's")
+    parser.add_argument("--rcvbuf", type=int, default=0,
+                        help="SO_RCVBUF of client connections, 0 keeps the "
+                        "system's")
+    parser.add_argument("--bind", type=parse_bind, action="append",
+                        default=[], metavar="HOST:PORT|unix:PATH",
+                        help="also listen on this address or Unix socket, "
+                        "can be repeated")
+    parser.add_argument("--loop", default="asyncio", choices=LOOPS,
+                        help="event loop to run on, uvloop has to be "
+                        "installed")
     args = parser.parse_args()
-    format = "%(levelname)s [%(name)s: %(lineno)d] %(message)s"
-    if args.silent:
-        logging.basicConfig(level=logging.CRITICAL, format=format)
-    else:
-        logging.basicConfig(level=logging.DEBUG, format=format)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.peer and args.cluster is None:
+        parser.error("--peer requires --cluster")
+    if args.cluster is not None and args.workers > 1:
+        parser.error("--cluster can't be combined with --workers")
+    if not 0 <= args.low_water <= args.high_water:
+        parser.error("--low-water must be between 0 and --high-water")
+    if args.history_segment_bytes < 1 or args.history_segments < 1:
+        parser.error("--history-segment-bytes and --history-segments must "
+                     "be positive")
+    if args.read_limit < 1 or args.write_limit < 1:
+        parser.error("--read-limit and --write-limit must be positive")
+    if args.backlog < 1 or args.sndbuf < 0 or args.rcvbuf < 0:
+        parser.error("--backlog must be positive, --sndbuf and --rcvbuf "
+                     "can't be negative")
+    if args.workers > 1 and any(isinstance(address, str)
+                                for address in args.bind):
+        parser.error("a Unix socket --bind can't be combined with --workers")
+    try:
+        use_loop(args.loop)
+    except ImportError:
+        parser.error(f"--loop {args.loop} is not installed")
+    logs.setup("CRITICAL" if args.silent else args.log_level,
+               args.log_format, args.log_sample)
     try:
-        asyncio.run(main(args.host, args.port))
+        if args.workers > 1:
+            with tempfile.TemporaryDirectory(prefix="pumachat-") as sockets:
+                run_workers(args.workers, worker, args.workers, sockets,
+                            args)
+        else:
+            # stop the way Ctrl-C does, so the capture and logs are closed
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            cluster = None
+            if args.cluster is not None:
+                # node ids are the cluster addresses, the same on every node
+                nodes = {f"{host}:{port}": (host, port)
+                         for host, port in [args.cluster, *args.peer]}
+                cluster = Cluster("{}:{}".format(*args.cluster), nodes)
+            asyncio.run(main(args.host, args.port, cluster=cluster,
+                             **options(args)))
     except KeyboardInterrupt:
         pass
     finally:
         logging.info("Cerrando el servidor")
+        logs.shutdown()
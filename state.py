@@ -0,0 +1,176 @@
+from subscriptions import EVENTS
+import sys
+
+CHANGELOG = 4096
+ROOM_CHANGELOG = 256
+
+
+class Changelog:
+    """A version that grows with each name added to or removed from a set,
+    and the latest of those changes, so clients can ask what changed since
+    the version they saw.
+
+    Between size and twice size changes are kept. A sorted copy of the
+    names is kept for paging while the changes since it are.
+    """
+
+    __slots__ = ("size", "version", "changes", "snapshot")
+
+    def __init__(self, size=CHANGELOG):
+        self.size = size
+        self.version = 0
+        self.changes = []
+        self.snapshot = None
+
+    def record(self, name, added):
+        self.version += 1
+        self.changes.append((name, added))
+        if len(self.changes) > 2 * self.size:
+            del self.changes[:-self.size]
+
+    def covers(self, version):
+        """Whether all the changes after version are kept."""
+        return self.version - len(self.changes) <= version <= self.version
+
+    def since(self, version):
+        """The names added and removed after a version it covers."""
+        first = {}
+        last = {}
+        for name, added in self.changes[len(self.changes)
+                                        - (self.version - version):]:
+            first.setdefault(name, added)
+            last[name] = added
+        # a name added and removed again, or the other way around, is
+        # where it was
+        return ([name for name, added in last.items()
+                 if added and first[name]],
+                [name for name, added in last.items()
+                 if not added and not first[name]])
+
+    def sorted(self, names):
+        """(version, names in order) as of a version it covers."""
+        if self.snapshot is None or not self.covers(self.snapshot[0]):
+            self.snapshot = (self.version, sorted(names))
+        return self.snapshot
+
+
+class Room:
+    __slots__ = ("name", "users", "invites", "log")
+
+    def __init__(self, name, users=(), invites=()):
+        self.name = name
+        self.users = set(users)
+        self.invites = set(invites)
+        self.log = Changelog(ROOM_CHANGELOG)
+
+    def __repr__(self):
+        return (f"Room(name={self.name!r}, users={self.users!r}, "
+                f"invites={self.invites!r})")
+
+
+class ChatState:
+    """Connected users and rooms, indexed both ways.
+
+    Besides room -> members and room -> invitees, every user keeps the names
+    of the rooms they joined or were invited to, so per-user operations
+    only touch that user's rooms no matter how many rooms exist. When the
+    chat spans several nodes, users holds every user and local only those
+    connected to this node, and listeners those of them that take each
+    event class. The directory logs who came and went, and on_remove_room,
+    if given, is called with the name of each room that's removed.
+
+    Usernames are interned, so the rooms, sets and logs that hold one all
+    point to the same string.
+    """
+
+    def __init__(self, on_remove_room=None):
+        self.on_remove_room = on_remove_room
+        self.directory = Changelog()
+        self.users = {}
+        self.local = {}
+        self.listeners = {bit: {} for bit in EVENTS.values()}
+        self.rooms = {}
+        self.memberships = {}
+        self.invitations = {}
+
+    def add_user(self, username, user, local=True):
+        username = sys.intern(username)
+        self.users[username] = user
+        self.directory.record(username, True)
+        if local:
+            self.local[username] = user
+            self.subscribe(username, user.events)
+        self.memberships[username] = set()
+        self.invitations[username] = set()
+
+    def subscribe(self, username, events):
+        """Make a local user a listener of the event classes in events."""
+        user = self.local[username]
+        for bit, listeners in self.listeners.items():
+            if events & bit:
+                listeners[username] = user
+            else:
+                listeners.pop(username, None)
+
+    def remove_user(self, username):
+        """Forget a user, returning the rooms they left that still exist."""
+        del self.users[username]
+        self.directory.record(username, False)
+        if self.local.pop(username, None) is not None:
+            for listeners in self.listeners.values():
+                listeners.pop(username, None)
+        for roomname in self.invitations.pop(username):
+            self.rooms[roomname].invites.discard(username)
+        left = []
+        for roomname in self.memberships.pop(username):
+            room = self.rooms[roomname]
+            room.users.discard(username)
+            room.log.record(username, False)
+            if room.users:
+                left.append(room)
+            else:
+                self.remove_room(room)
+        return left
+
+    def ensure_room(self, roomname):
+        room = self.rooms.get(roomname)
+        if room is None:
+            room = self.rooms[roomname] = Room(roomname)
+        return room
+
+    def create_room(self, roomname, owner):
+        room = self.ensure_room(roomname)
+        self.join(room, owner)
+        return room
+
+    def remove_room(self, room):
+        del self.rooms[room.name]
+        for username in room.invites:
+            self.invitations[username].discard(room.name)
+        if self.on_remove_room is not None:
+            self.on_remove_room(room.name)
+
+    def invite(self, room, username):
+        username = sys.intern(username)
+        room.invites.add(username)
+        self.invitations[username].add(room.name)
+
+    def join(self, room, username):
+        username = sys.intern(username)
+        room.invites.discard(username)
+        self.invitations[username].discard(room.name)
+        if username not in room.users:
+            room.users.add(username)
+            room.log.record(username, True)
+        self.memberships[username].add(room.name)
+
+    def leave(self, room, username):
+        """Remove a member, returns False when that emptied the room."""
+        if username in room.users:
+            room.users.discard(username)
+            room.log.record(username, False)
+        self.memberships[username].discard(room.name)
+        if not room.users:
+            self.remove_room(room)
+            return False
+        return True
@@ -0,0 +1,35 @@
+# event classes a client can SUBSCRIBE to, one bit each
+PUBLIC = 1
+PRESENCE = 2
+ROOMS = 4
+ROOM_MESSAGES = 8
+EVENTS = {"PUBLIC": PUBLIC, "PRESENCE": PRESENCE, "ROOMS": ROOMS,
+          "ROOM_MESSAGES": ROOM_MESSAGES}
+ALL = PUBLIC | PRESENCE | ROOMS | ROOM_MESSAGES
+
+# the class of each message type that can be filtered out, the rest are
+# always delivered
+CLASSES = {
+    "PUBLIC_MESSAGE_FROM": PUBLIC,
+    "NEW_USER": PRESENCE,
+    "NEW_STATUS": PRESENCE,
+    "DISCONNECTED": PRESENCE,
+    "PRESENCE_UPDATE": PRESENCE,
+    "JOINED_ROOM": ROOMS,
+    "LEFT_ROOM": ROOMS,
+    "ROOM_MESSAGE_FROM": ROOM_MESSAGES,
+}
+
+
+def mask(events):
+    """The bitmask of a list of event class names."""
+    bits = 0
+    for event in events:
+        if not isinstance(event, str) or event not in EVENTS:
+            raise ValueError(f"Unknown event class {event!r}")
+        bits |= EVENTS[event]
+    return bits
+
+
+def names(bits):
+    return [event for event, bit in EVENTS.items() if bits & bit]
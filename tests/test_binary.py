@@ -0,0 +1,86 @@
+from binary import BINARY, KEYS, TYPES, pack, unpack
+from compression import DEFLATE
+from framing import HEADER
+from message import Message
+from utils import MessageException
+from tests.test_compression import CodecPeer
+from tests.test_session import ServerTestCase
+import unittest
+import logging
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+def payload(fields):
+    return pack(fields)[HEADER.size:]
+
+
+class BinaryTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        for fields in [
+            {"type": "NEW_USER", "username": "Kim"},
+            {"type": "PRESENCE_UPDATE", "users": {"Kim": "AWAY",
+                                                  "Luis": None}},
+            {"type": "X", "value": [True, False, None, 0.5, "ñandú"]},
+            {"ints": [0, 127, 128, 255, 256, 65535, 65536, 2 ** 32,
+                      2 ** 64 - 1, -1, -32, -33, -2 ** 63]},
+            {"long": "a" * 31, "longer": "b" * 255, "longest": "c" * 70000,
+             "list": list(range(20)), "map": {str(i): i for i in range(20)}},
+            {"type": 5}, {"type": None}, {"type": ["PING"]},
+        ]:
+            self.assertEqual(fields, unpack(payload(fields)))
+
+    def test_interned(self):
+        fields = {"type": "PUBLIC_MESSAGE_FROM", "username": "Kim",
+                  "message": "hola"}
+        data = payload(fields)
+        self.assertEqual(bytes([0x83, KEYS.index("type"),
+                                TYPES.index("PUBLIC_MESSAGE_FROM")]),
+                         data[:3])
+        self.assertLess(len(data), len(Message(fields).encoded) // 2)
+
+    def test_invalid(self):
+        data = payload({"type": "NEW_USER", "username": "Kim"})
+        for bad in [data[:-1], data + b"\x00", b"\x92\x01\x02", b"\xc1",
+                    b"\x81\x7f\x00", b"\x81\x01\xa2\xff\xfe", b""]:
+            with self.assertRaises(MessageException):
+                unpack(bad)
+        with self.assertRaises(TypeError):
+            pack({"type": "PING", "at": object()})
+
+    def test_decoder(self):
+        messages = [Message({"type": "PING"}),
+                    Message({"type": "MESSAGE_FROM", "username": "Kim",
+                             "message": "hola"})]
+        data = b"".join(message.wire(BINARY) for message in messages)
+        decoder = BINARY.decoder()
+        frames = []
+        for i in range(len(data)):
+            frames.extend(decoder.feed(data[i:i + 1]))
+        self.assertEqual(messages, [BINARY.decode(frame) for frame in frames])
+
+
+class ServerBinaryTestCase(ServerTestCase):
+    async def test_negotiate(self):
+        kim = CodecPeer(BINARY)
+        self.peers.append(kim)
+        info = await kim.login(self.server, "Kim")
+        self.assertEqual(["BINARY"], info["capabilities"])
+        luis, _ = await self.login("Luis")
+        await kim.expect(type="NEW_USER", username="Luis")
+        await kim.request(type="MESSAGE", username="Luis", message="hola")
+        await luis.expect(type="MESSAGE_FROM", message="hola")
+        await luis.request(type="PUBLIC_MESSAGE", message="adiós")
+        await kim.expect(type="PUBLIC_MESSAGE_FROM", message="adiós")
+
+    async def test_first_codec(self):
+        kim = CodecPeer(DEFLATE)
+        self.peers.append(kim)
+        await kim.connect(self.server)
+        await kim.request(type="IDENTIFY", username="Kim",
+                          capabilities=["DEFLATE", "BINARY"])
+        info = await kim.reply()
+        self.assertEqual(["DEFLATE"], info["capabilities"])
+        kim.use(DEFLATE)
+        await kim.request(type="USERS")
+        await kim.expect(type="USER_LIST")
@@ -0,0 +1,97 @@
+from capture import CaptureWriter, read_capture, OPEN, FRAME, CLOSE
+from server import Server
+from timers import TimingWheel
+from tests.test_cluster import Peer, wait_until
+from unittest import mock
+import unittest
+import tempfile
+import logging
+import asyncio
+import os
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+class CaptureTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "capture")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        capture = CaptureWriter(self.path)
+        first = capture.open(("127.0.0.1", 4000))
+        second = capture.open()
+        capture.frame(first, b'{"type": "USERS"}')
+        capture.close(second)
+        capture.shutdown()
+        records = list(read_capture(self.path))
+        self.assertEqual([(OPEN, first, b"('127.0.0.1', 4000)"),
+                          (OPEN, second, b""),
+                          (FRAME, first, b'{"type": "USERS"}'),
+                          (CLOSE, second, b"")],
+                         [(kind, connection, payload)
+                          for kind, connection, _, payload in records])
+        times = [elapsed for _, _, elapsed, _ in records]
+        self.assertEqual(sorted(times), times)
+
+    def test_truncated(self):
+        capture = CaptureWriter(self.path)
+        capture.frame(capture.open(), b'{"type": "USERS"}')
+        capture.shutdown()
+        with open(self.path, "r+b") as file:
+            file.truncate(os.path.getsize(self.path) - 1)
+        self.assertEqual([OPEN], [kind for kind, *_ in
+                                  read_capture(self.path)])
+
+    def test_not_a_capture(self):
+        with open(self.path, "wb") as file:
+            file.write(b"{}")
+        with self.assertRaises(ValueError):
+            list(read_capture(self.path))
+
+
+class ServerCaptureTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_capture(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "capture")
+        server = Server("127.0.0.1", 0, capture=CaptureWriter(path))
+        await server.start()
+        peer = Peer()
+        await peer.login(server, "Kim")
+        await peer.request(type="USERS")
+        await peer.expect(type="USER_LIST")
+        await peer.request(type="DISCONNECT")
+        while server.state.users:
+            await asyncio.sleep(0.01)
+        peer.close()
+        server.listener.close()
+        server.capture.shutdown()
+        records = [(kind, payload) for kind, _, _, payload in
+                   read_capture(path)]
+        self.assertEqual(OPEN, records[0][0])
+        self.assertEqual([(FRAME, b'{"type": "IDENTIFY", "username": "Kim"}'),
+                          (FRAME, b'{"type": "USERS"}'),
+                          (FRAME, b'{"type": "DISCONNECT"}'),
+                          (CLOSE, b"")], records[1:])
+
+    async def test_flushed_while_running(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "capture")
+        server = Server("127.0.0.1", 0, capture=CaptureWriter(path),
+                        wheel=TimingWheel(0.01))
+        self.addCleanup(server.wheel.close)
+        with mock.patch("server.CAPTURE_FLUSH", 0.02):
+            await server.start()
+            peer = Peer()
+            await peer.login(server, "Kim")
+            # the header and the records of the connection and its IDENTIFY
+            await wait_until(lambda: os.path.getsize(path)
+                             and len(list(read_capture(path))) == 2)
+        peer.close()
+        server.listener.close()
+        server.capture.shutdown()
@@ -13,7 +13,9 @@ class ClientTestCase(unittest.IsolatedAsyncioTestCase):
     async def asyncSetUp(self):
         self.server = Server(socket.gethostname(), 8080)
         self.client = Client(socket.gethostname(), 8080)
-        self.server_task = asyncio.create_task(self.server.run())
+        await self.server.start()
+        self.server_task = asyncio.create_task(
+            self.server.listener.serve_forever())
         await self.client.connect()
 
     async def test_identify(self):
@@ -0,0 +1,244 @@
+from cluster import Cluster
+from history import History
+from server import Server
+from message import Message
+from utils import BaseChat
+import unittest
+import tempfile
+import logging
+import asyncio
+import os
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+class Peer(BaseChat):
+    async def connect(self, server):
+        port = server.listener.sockets[0].getsockname()[1]
+        self.attach(*await asyncio.open_connection("127.0.0.1", port))
+
+    async def request(self, **message):
+        await self.send(Message(message))
+
+    async def expect(self, **fields):
+        async def matching():
+            while True:
+                message = await self.recv()
+                if fields.items() <= message.items():
+                    return message
+        return await asyncio.wait_for(matching(), 2)
+
+    async def login(self, server, username):
+        await self.connect(server)
+        await self.request(type="IDENTIFY", username=username)
+        return await self.expect()
+
+    def close(self):
+        self.writer.close()
+
+
+async def wait_until(condition):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), 2)
+
+
+class ClusterTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.sockets = tempfile.TemporaryDirectory()
+        nodes = {node: os.path.join(self.sockets.name, f"{node}.sock")
+                 for node in ["a", "b"]}
+        self.servers = [Server("127.0.0.1", 0, cluster=Cluster(node, nodes))
+                        for node in nodes]
+        for server in self.servers:
+            await server.start()
+        await wait_until(lambda: all(server.cluster.links
+                                     for server in self.servers))
+        self.peers = []
+
+    async def asyncTearDown(self):
+        for peer in self.peers:
+            peer.close()
+        for server in self.servers:
+            server.listener.close()
+            await server.cluster.stop()
+        self.sockets.cleanup()
+
+    async def login(self, node, username):
+        peer = Peer()
+        self.peers.append(peer)
+        response = await peer.login(self.servers[node], username)
+        self.assertEqual("success", response["message"])
+        return peer
+
+    async def test_duplicate_username(self):
+        await self.login(0, "Kim")
+        peer = Peer()
+        self.peers.append(peer)
+        response = await peer.login(self.servers[1], "Kim")
+        self.assertEqual("WARNING", response["type"])
+
+    async def test_no_resume(self):
+        kim = Peer()
+        self.peers.append(kim)
+        await kim.connect(self.servers[0])
+        await kim.request(type="IDENTIFY", username="Kim",
+                          capabilities=["RESUME"])
+        info = await kim.expect()
+        self.assertEqual([], info["capabilities"])
+        self.assertNotIn("token", info)
+
+    async def test_messages(self):
+        kim = await self.login(0, "Kim")
+        luis = await self.login(1, "Luis")
+        await kim.expect(type="NEW_USER", username="Luis")
+        await luis.request(type="PUBLIC_MESSAGE", message="hola")
+        await kim.expect(type="PUBLIC_MESSAGE_FROM", username="Luis",
+                         message="hola")
+        await kim.request(type="MESSAGE", username="Luis", message="hey")
+        await luis.expect(type="MESSAGE_FROM", username="Kim", message="hey")
+        await luis.request(type="USERS")
+        response = await luis.expect(type="USER_LIST")
+        self.assertEqual({"Kim", "Luis"}, set(response["usernames"]))
+
+    async def test_rooms(self):
+        kim = await self.login(0, "Kim")
+        luis = await self.login(1, "Luis")
+        await kim.request(type="NEW_ROOM", roomname="Sala")
+        await kim.expect(type="INFO", operation="NEW_ROOM")
+        await luis.request(type="NEW_ROOM", roomname="Sala")
+        await luis.expect(type="WARNING", operation="NEW_ROOM")
+        await kim.request(type="INVITE", roomname="Sala", usernames=["Luis"])
+        await luis.expect(type="INVITATION", roomname="Sala")
+        await luis.request(type="JOIN_ROOM", roomname="Sala")
+        await luis.expect(type="INFO", operation="JOIN_ROOM")
+        await kim.expect(type="JOINED_ROOM", username="Luis")
+        await luis.request(type="ROOM_MESSAGE", roomname="Sala",
+                           message="hola")
+        await kim.expect(type="ROOM_MESSAGE_FROM", username="Luis")
+        await luis.request(type="DISCONNECT")
+        await kim.expect(type="LEFT_ROOM", roomname="Sala", username="Luis")
+        await kim.expect(type="DISCONNECTED", username="Luis")
+        self.assertEqual({"Kim"}, self.servers[0].state.rooms["Sala"].users)
+
+    async def test_stale_room_history(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        history = History(directory.name)
+        history.append("Sala", Message({"type": "ROOM_MESSAGE_FROM",
+                                        "roomname": "Sala", "username": "Kim",
+                                        "message": "viejo"}).encoded)
+        history.close()
+        path = os.path.join(self.sockets.name, "c.sock")
+        server = Server("127.0.0.1", 0, cluster=Cluster("c", {"c": path}),
+                        history=History(directory.name))
+        self.addCleanup(server.history.close)
+        await server.start()
+        server.listener.close()
+        await server.cluster.stop()
+        self.assertEqual(([], None), server.history.read("Sala"))
+
+    async def test_room_history(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for index, server in enumerate(self.servers):
+            server.history = History(os.path.join(directory.name, str(index)))
+            self.addCleanup(server.history.close)
+        kim = await self.login(0, "Kim")
+        luis = await self.login(1, "Luis")
+        await kim.request(type="NEW_ROOM", roomname="Sala")
+        await kim.request(type="ROOM_MESSAGE", roomname="Sala",
+                          message="hola")
+        await kim.request(type="INVITE", roomname="Sala", usernames=["Luis"])
+        await luis.expect(type="INVITATION", roomname="Sala")
+        await luis.request(type="JOIN_ROOM", roomname="Sala")
+        await luis.request(type="HISTORY", roomname="Sala")
+        page = await luis.expect(type="HISTORY_LIST")
+        self.assertEqual(["hola"], [m["message"] for m in page["messages"]])
+
+    async def test_bad_event(self):
+        link = self.servers[1].cluster.links["a"]
+        await link.send(Message({"type": "SYNC", "users": [],
+                                 "rooms": [["Sala"]]}))
+        await link.send(Message({"type": "USER_UP", "username": "Zoe",
+                                 "status": "ACTIVE"}))
+        await wait_until(lambda: "Zoe" in self.servers[0].state.users)
+        self.assertIs(link, self.servers[1].cluster.links["a"])
+
+    async def test_node_down(self):
+        kim = await self.login(0, "Kim")
+        await self.login(1, "Luis")
+        await kim.expect(type="NEW_USER", username="Luis")
+        await self.servers[1].cluster.stop()
+        await kim.expect(type="DISCONNECTED", username="Luis")
+        self.assertEqual({"Kim"}, set(self.servers[0].state.users))
+
+
+class FederationTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.nodes = {}
+        for node in ["a", "b", "c"]:
+            listener = await asyncio.start_server(lambda r, w: None,
+                                                  "127.0.0.1", 0)
+            self.nodes[node] = listener.sockets[0].getsockname()
+            listener.close()
+            await listener.wait_closed()
+        self.servers = {}
+        self.peers = []
+
+    async def start(self, node, nodes):
+        server = Server("127.0.0.1", 0, cluster=Cluster(node, nodes))
+        await server.start()
+        self.servers[node] = server
+        return server
+
+    async def asyncTearDown(self):
+        for peer in self.peers:
+            peer.close()
+        for server in self.servers.values():
+            server.listener.close()
+            await server.cluster.stop()
+
+    async def login(self, node, username):
+        peer = Peer()
+        self.peers.append(peer)
+        await peer.login(self.servers[node], username)
+        return peer
+
+    async def test_three_nodes(self):
+        for node in self.nodes:
+            await self.start(node, self.nodes)
+        await wait_until(lambda: all(len(server.cluster.links) == 2
+                                     for server in self.servers.values()))
+        kim = await self.login("a", "Kim")
+        luis = await self.login("b", "Luis")
+        fer = await self.login("c", "Fer")
+        await kim.expect(type="NEW_USER", username="Fer")
+        await fer.request(type="PUBLIC_MESSAGE", message="hola")
+        await kim.expect(type="PUBLIC_MESSAGE_FROM", username="Fer")
+        await luis.expect(type="PUBLIC_MESSAGE_FROM", username="Fer")
+        await fer.request(type="STATUS", status="AWAY")
+        await kim.expect(type="NEW_STATUS", username="Fer", status="AWAY")
+        self.assertEqual("AWAY", self.servers["b"].state.users["Fer"].status)
+        await luis.request(type="DISCONNECT")
+        await kim.expect(type="DISCONNECTED", username="Luis")
+        await fer.expect(type="DISCONNECTED", username="Luis")
+
+    async def test_partition_conflict(self):
+        nodes = {node: self.nodes[node] for node in ["a", "b"]}
+        await self.start("a", nodes)
+        # b starts cut off from a, so both grant the same username
+        b = await self.start("b", {"b": nodes["b"]})
+        kims = {"a": await self.login("a", "Kim"),
+                "b": await self.login("b", "Kim")}
+        b.cluster.nodes = nodes
+        b.cluster._tasks.append(asyncio.create_task(b.cluster.connect("a")))
+        winner = "a" if b.cluster.prevails("Kim", "a", "b") else "b"
+        loser = "b" if winner == "a" else "a"
+        await kims[loser].expect(type="WARNING", username="Kim")
+        await wait_until(lambda: "Kim" in self.servers[loser].state.users)
+        for server in self.servers.values():
+            self.assertEqual(winner,
+                             server.state.users["Kim"].node or
+                             server.cluster.node)
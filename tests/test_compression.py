@@ -0,0 +1,139 @@
+from compression import DEFLATE, DeflateDecoder, compress
+from framing import HEADER
+from message import Message
+from utils import MessageException
+from tests.test_cluster import Peer
+from tests.test_session import ServerTestCase
+import unittest
+import logging
+import zlib
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+class CodecPeer(Peer):
+    offset = 0
+
+    def __init__(self, wants=DEFLATE):
+        self.wants = wants
+
+    async def recv_frame(self):
+        frame = await super().recv_frame()
+        if self.codec is None:
+            self.offset += len(frame)
+        else:
+            self.offset += self.decoder.sizes.popleft()
+        return frame
+
+    def use(self, codec):
+        super().use(codec)
+        self.decoder = codec.decoder(track_sizes=True)
+
+    async def reply(self):
+        line = await self.reader.readline()
+        self.offset += len(line)
+        return Message.from_encoded(line)
+
+    async def login(self, server, username, *capabilities):
+        await self.connect(server)
+        await self.request(type="IDENTIFY", username=username,
+                           capabilities=[self.wants.name, *capabilities])
+        info = await self.reply()
+        self.use(self.wants)
+        return info
+
+    async def resume(self, server, username, token):
+        offset = self.offset
+        await self.connect(server)
+        await self.request(type="RESUME", username=username, token=token,
+                           offset=offset)
+        reply = await self.reply()
+        self.offset = offset
+        self.use(self.wants)
+        return reply
+
+
+class DeflateDecoderTestCase(unittest.TestCase):
+    frames = [b'{"type": "NEW_USER", "username": "Kim"}',
+              b'{"type": "PUBLIC_MESSAGE_FROM", "username": "Kim", '
+              b'"message": "' + b"hola " * 100 + b'"}']
+
+    def test_round_trip(self):
+        decoder = DeflateDecoder(track_sizes=True)
+        wire = [compress(frame) for frame in self.frames]
+        self.assertEqual(self.frames, decoder.feed(b"".join(wire)))
+        self.assertEqual([len(frame) for frame in wire], list(decoder.sizes))
+        self.assertLess(len(wire[1]), len(self.frames[1]) // 4)
+
+    def test_split(self):
+        decoder = DeflateDecoder()
+        data = b"".join(compress(frame) for frame in self.frames)
+        frames = []
+        for i in range(len(data)):
+            frames.extend(decoder.feed(data[i:i + 1]))
+        self.assertEqual(self.frames, frames)
+        self.assertEqual(b"", decoder.pending)
+
+    def test_too_large(self):
+        decoder = DeflateDecoder(max_frame_size=100)
+        with self.assertRaises(MessageException):
+            decoder.feed(HEADER.pack(101))
+        # small on the wire, but not once inflated
+        with self.assertRaises(MessageException):
+            decoder.feed(compress(b" " * 1000))
+
+    def test_invalid(self):
+        decoder = DeflateDecoder()
+        with self.assertRaises(MessageException):
+            decoder.feed(HEADER.pack(3) + b"abc")
+        payload = zlib.compress(b"{}")
+        with self.assertRaises(MessageException):
+            decoder.feed(HEADER.pack(len(payload)) + payload)
+
+    def test_wire(self):
+        message = Message({"type": "NEW_USER", "username": "Kim"})
+        frame = message.wire(DEFLATE)
+        self.assertIs(frame, message.wire(DEFLATE))
+        self.assertIs(message.encoded, message.wire(None))
+        message["username"] = "Luis"
+        self.assertEqual([message.encoded],
+                         DEFLATE.decoder().feed(message.wire(DEFLATE)))
+
+
+class ServerDeflateTestCase(ServerTestCase):
+    async def test_negotiate(self):
+        kim = CodecPeer()
+        self.peers.append(kim)
+        info = await kim.login(self.server, "Kim")
+        self.assertEqual(["DEFLATE"], info["capabilities"])
+        luis, _ = await self.login("Luis")
+        await kim.expect(type="NEW_USER", username="Luis")
+        await kim.request(type="PUBLIC_MESSAGE", message="hola")
+        await luis.expect(type="PUBLIC_MESSAGE_FROM", message="hola")
+        await kim.request(type="USERS")
+        users = await kim.expect(type="USER_LIST")
+        self.assertEqual({"Kim", "Luis"}, set(users["usernames"]))
+
+    async def test_resume(self):
+        kim = CodecPeer()
+        self.peers.append(kim)
+        token = (await kim.login(self.server, "Kim", "RESUME"))["token"]
+        luis, _ = await self.login("Luis")
+        await kim.expect(type="NEW_USER", username="Luis")
+        await self.drop(token)
+        await luis.request(type="MESSAGE", username="Kim", message="adiós")
+        reply = await kim.resume(self.server, "Kim", token)
+        self.assertEqual("success", reply["message"])
+        await kim.expect(type="MESSAGE_FROM", message="adiós")
+
+    async def test_disabled(self):
+        self.server.capabilities.discard("DEFLATE")
+        kim = Peer()
+        self.peers.append(kim)
+        await kim.connect(self.server)
+        await kim.request(type="IDENTIFY", username="Kim",
+                          capabilities=["DEFLATE"])
+        info = await kim.expect()
+        self.assertEqual([], info["capabilities"])
+        await kim.request(type="USERS")
+        await kim.expect(type="USER_LIST")
@@ -0,0 +1,168 @@
+from connection import Connection, answers, QUIET_RUN
+from mailboxes import Mailboxes
+from binary import BINARY
+from message import Message
+from server import Server
+from timers import TimingWheel
+import subprocess
+import unittest
+import tempfile
+import logging
+import asyncio
+import sys
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+class AnswersTestCase(unittest.TestCase):
+    def test_answers(self):
+        self.assertTrue(answers("STATUS", Message(
+            {"type": "INFO", "message": "success", "operation": "STATUS"})))
+        self.assertTrue(answers("USERS", Message(
+            {"type": "USER_LIST", "usernames": []})))
+        self.assertFalse(answers("STATUS", Message(
+            {"type": "WARNING", "message": "x", "operation": "USERS"})))
+        self.assertFalse(answers("USERS", Message(
+            {"type": "NEW_USER", "username": "Kim"})))
+
+    def test_lazy_ui(self):
+        code = "import sys, client; print('prompt_toolkit' in sys.modules)"
+        output = subprocess.run([sys.executable, "-c", code], check=True,
+                                capture_output=True, text=True).stdout
+        self.assertEqual("False", output.strip())
+
+
+class ConnectionTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = Server("127.0.0.1", 0, wheel=TimingWheel(0.01),
+                             limits={}, presence_window=0)
+        await self.server.start()
+        self.port = self.server.listener.sockets[0].getsockname()[1]
+        self.connections = []
+
+    async def asyncTearDown(self):
+        for connection in self.connections:
+            await connection.close()
+        self.server.listener.close()
+
+    async def login(self, username, codecs=()):
+        connection = Connection("127.0.0.1", self.port, codecs)
+        self.connections.append(connection)
+        await connection.connect()
+        reply = await connection.login(username)
+        self.assertEqual("INFO", reply["type"])
+        return connection
+
+    async def test_pipelined(self):
+        kim = await self.login("Kim")
+        futures = [await kim.request(type="NEW_ROOM", roomname="Sala"),
+                   await kim.request(type="PUBLIC_MESSAGE", message="hola",
+                                     confirm=True),
+                   await kim.request(type="MESSAGE", username="Kim",
+                                     message="yo", confirm=True),
+                   await kim.request(type="PUBLIC_MESSAGE", message="adiós",
+                                     confirm=True),
+                   await kim.request(type="USERS"),
+                   await kim.request(type="NEW_ROOM", roomname="Sala")]
+        new, public, private, quiet, users, status = await asyncio.wait_for(
+            asyncio.gather(*futures[:-1], kim.ask(type="STATUS",
+                                                  status="AWAY")), 2)
+        self.assertEqual(("INFO", "NEW_ROOM"),
+                         (new["type"], new["operation"]))
+        self.assertIsNone(public)
+        self.assertEqual(("WARNING", "MESSAGE"),
+                         (private["type"], private["operation"]))
+        self.assertIsNone(quiet)
+        self.assertEqual(["Kim"], users["usernames"])
+        self.assertEqual("WARNING", (await futures[-1])["type"])
+        self.assertEqual("INFO", status["type"])
+        self.assertFalse(kim.pending)
+
+    async def test_quiet(self):
+        kim = await self.login("Kim")
+        for n in range(2 * QUIET_RUN):
+            self.assertIsNone(await kim.request(type="PUBLIC_MESSAGE",
+                                                message=str(n)))
+        self.assertIsNone(await kim.request(type="MESSAGE", username="Kim",
+                                            message="yo"))
+        self.assertEqual(2, [kind for kind, _ in kim.pending].count("PING"))
+        await kim.sync()
+        self.assertFalse(kim.pending)
+        warning = await asyncio.wait_for(anext(kim.events()), 2)
+        self.assertEqual(("WARNING", "MESSAGE"),
+                         (warning["type"], warning["operation"]))
+
+    async def test_mixed(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.server.mailboxes = Mailboxes(directory.name)
+        await (await self.login("Fer")).close()
+        kim = await self.login("Kim")
+        await self.login("Luis")
+        sent = [await kim.request(type="MESSAGE", username=username,
+                                  message="hola", confirm=confirm)
+                for username, confirm in [("Nadie", False), ("Luis", True),
+                                          ("Nadie", True), ("Fer", False),
+                                          ("Fer", True), ("Luis", False)]]
+        replies = await asyncio.wait_for(asyncio.gather(
+            *(future for future in sent if future is not None)), 2)
+        self.assertEqual([None, "WARNING", "INFO"],
+                         [reply and reply["type"] for reply in replies])
+        await kim.sync()
+        self.assertFalse(kim.pending)
+        events = [event async for event in self.until_closed(kim)]
+        self.assertEqual([("WARNING", "MESSAGE"), ("INFO", "MESSAGE")],
+                         [(event["type"], event["operation"])
+                          for event in events if "operation" in event])
+
+    async def until_closed(self, connection):
+        events = connection.events()
+        await connection.close()
+        async for event in events:
+            yield event
+
+    async def test_events(self):
+        kim = await self.login("Kim", [BINARY])
+        luis = await self.login("Luis")
+        await luis.request(type="PUBLIC_MESSAGE", message="hola")
+        await luis.sync()
+        events = kim.events()
+        self.assertEqual("NEW_USER", (await anext(events))["type"])
+        message = await asyncio.wait_for(anext(events), 2)
+        self.assertEqual(("PUBLIC_MESSAGE_FROM", "hola"),
+                         (message["type"], message["message"]))
+        await luis.close()
+        self.assertEqual("DISCONNECTED",
+                         (await asyncio.wait_for(anext(events), 2))["type"])
+
+    async def test_closed(self):
+        kim = await self.login("Kim")
+        kim.token = None
+        kim.writer.transport.abort()
+        with self.assertRaises(ConnectionResetError):
+            await asyncio.wait_for(kim.ask(type="USERS"), 2)
+        self.assertEqual([], [event async for event in kim.events()])
+        with self.assertRaises(ConnectionResetError):
+            await kim.request(type="USERS")
+
+    async def test_evicted(self):
+        kim = await self.login("Kim", [BINARY])
+        kim.token = None
+        await self.server.evict("Kim")
+        events = [event async for event in kim.events()]
+        self.assertEqual([("WARNING", "IDENTIFY")],
+                         [(event["type"], event["operation"])
+                          for event in events])
+
+    async def test_resume(self):
+        kim = await self.login("Kim", [BINARY])
+        luis = await self.login("Luis")
+        events = kim.events()
+        await asyncio.wait_for(anext(events), 2)
+        kim.writer.transport.abort()
+        await luis.request(type="MESSAGE", username="Kim", message="hola")
+        message = await asyncio.wait_for(anext(events), 2)
+        self.assertEqual(("MESSAGE_FROM", "hola"),
+                         (message["type"], message["message"]))
+        reply = await asyncio.wait_for(kim.ask(type="USERS"), 2)
+        self.assertEqual({"Kim", "Luis"}, set(reply["usernames"]))
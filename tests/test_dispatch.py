@@ -0,0 +1,64 @@
+from dispatch import Dispatcher, optional
+from message import Message
+import utils
+import unittest
+import logging
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+class Chat:
+    commands = Dispatcher()
+
+    def __init__(self):
+        self.calls = []
+
+    @commands.handler("STATUS", status=("AWAY", "ACTIVE"))
+    async def change_status(self, handler, status):
+        self.calls.append((handler, status))
+
+    @commands.handler("INVITE", roomname=str, usernames=list)
+    async def invite(self, handler, roomname, usernames):
+        self.calls.append((handler, roomname, usernames))
+
+    @commands.handler("LEAVE", roomname=None)
+    async def leave(self, handler, roomname):
+        self.calls.append((handler, roomname))
+
+    @commands.handler("HISTORY", before=optional(int), limit=optional(int, 5))
+    async def history(self, handler, before, limit):
+        self.calls.append((handler, before, limit))
+
+
+class DispatcherTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.chat = Chat()
+
+    async def dispatch(self, message):
+        await Chat.commands.dispatch(self.chat, "handler", Message(message))
+
+    async def test_dispatch(self):
+        await self.dispatch({"type": "STATUS", "status": "AWAY"})
+        await self.dispatch({"type": "INVITE", "roomname": "Sala",
+                             "usernames": ["Kim"], "extra": 1})
+        await self.dispatch({"type": "LEAVE", "roomname": 1})
+        await self.dispatch({"type": "HISTORY"})
+        await self.dispatch({"type": "HISTORY", "before": 3, "limit": 1})
+        self.assertEqual([("handler", "AWAY"),
+                          ("handler", "Sala", ["Kim"]),
+                          ("handler", 1),
+                          ("handler", None, 5),
+                          ("handler", 3, 1)], self.chat.calls)
+
+    async def test_bad_format(self):
+        for message in [{"type": "STATUS", "status": "GONE"},
+                        {"type": "INVITE", "roomname": "Sala",
+                         "usernames": "Kim"},
+                        {"type": "LEAVE"},
+                        {"type": "HISTORY", "before": "3"},
+                        {"type": "UNKNOWN"},
+                        {"type": ["STATUS"]},
+                        {"status": "AWAY"}]:
+            with self.assertRaises(utils.MessageException):
+                await self.dispatch(message)
+        self.assertEqual([], self.chat.calls)
@@ -0,0 +1,58 @@
+import framing
+import utils
+import unittest
+import logging
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+class FrameDecoderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.decoder = framing.FrameDecoder()
+
+    def test_single_frame(self):
+        self.assertEqual([b'{"type": "USERS"}'],
+                         self.decoder.feed(b'{"type": "USERS"}'))
+
+    def test_braces_in_strings(self):
+        frame = b'{"type": "PUBLIC_MESSAGE", "message": "} {\\" }"}'
+        self.assertEqual([frame], self.decoder.feed(frame))
+
+    def test_nested_objects(self):
+        frame = b'{"a": {"b": {"c": []}}, "d": "x"}'
+        self.assertEqual([frame], self.decoder.feed(frame))
+
+    def test_pipelined_frames(self):
+        frames = [b'{"n": %d}' % i for i in range(5)]
+        self.assertEqual(frames, self.decoder.feed(b"\n".join(frames)))
+
+    def test_split_frames(self):
+        stream = b'\x00{"message": "a\\"}b"}\n{"n": {"m": 1}}'
+        for split in range(len(stream)):
+            decoder = framing.FrameDecoder()
+            frames = decoder.feed(stream[:split]) + decoder.feed(stream[split:])
+            self.assertEqual([b'{"message": "a\\"}b"}', b'{"n": {"m": 1}}'],
+                             frames)
+
+    def test_byte_at_a_time(self):
+        stream = b'{"message": "\\\\"}{"x": "\\\\\\""}'
+        frames = []
+        for i in range(len(stream)):
+            frames += self.decoder.feed(stream[i:i + 1])
+        self.assertEqual([b'{"message": "\\\\"}', b'{"x": "\\\\\\""}'], frames)
+
+    def test_pending(self):
+        self.decoder.feed(b'{"a": 1}{"b"')
+        self.assertEqual(b'{"b"', self.decoder.pending)
+
+    def test_max_frame_size(self):
+        decoder = framing.FrameDecoder(max_frame_size=16)
+        self.assertEqual([b'{"a": 1}'], decoder.feed(b'{"a": 1}'))
+        with self.assertRaises(utils.MessageException):
+            decoder.feed(b'{"message": "' + b"x" * 32)
+        with self.assertRaises(utils.MessageException):
+            decoder.feed(b'{"message": "' + b"x" * 8 + b'"}')
+
+    def test_garbage(self):
+        with self.assertRaises(utils.MessageException):
+            self.decoder.feed(b'["foo"]')
@@ -0,0 +1,172 @@
+from history import History, PUBLIC, ENTRY
+from server import Server
+from tests.test_cluster import Peer
+import unittest
+import tempfile
+import logging
+import json
+import os
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+def record(n):
+    return json.dumps({"type": "ROOM_MESSAGE_FROM", "message": str(n)},
+                      ensure_ascii=False).encode("utf8")
+
+
+class HistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.history = self.open()
+
+    def tearDown(self):
+        self.history.close()
+        self.directory.cleanup()
+
+    def open(self, **limits):
+        return History(self.directory.name, **{
+            "segment_bytes": 256, "segment_records": 4, "segments": 3,
+            **limits})
+
+    def test_pages(self):
+        for n in range(10):
+            self.history.append("Sala", record(n))
+        self.history.append(PUBLIC, record("público"))
+        records, cursor = self.history.read("Sala", limit=4)
+        self.assertEqual([record(n) for n in range(6, 10)], records)
+        records, cursor = self.history.read("Sala", cursor, 4)
+        self.assertEqual([record(n) for n in range(2, 6)], records)
+        records, cursor = self.history.read("Sala", cursor, 4)
+        self.assertEqual([record(0), record(1)], records)
+        self.assertIsNone(cursor)
+        self.assertEqual(([record("público")], None),
+                         self.history.read(PUBLIC))
+        self.assertEqual(([], None), self.history.read("Otra"))
+
+    def test_retention(self):
+        for n in range(20):
+            self.history.append("Sala", record(n))
+        channel = self.history.channel("Sala")
+        self.assertEqual([8, 12, 16], channel.firsts)
+        self.assertEqual(6, len(os.listdir(channel.directory)))
+        records, cursor = self.history.read("Sala", limit=100)
+        self.assertEqual([record(n) for n in range(8, 20)], records)
+        self.assertIsNone(cursor)
+
+    def test_rotation_by_size(self):
+        self.history.close()
+        self.history = self.open(segment_bytes=len(record(0)) * 2,
+                                 segment_records=100)
+        for n in range(5):
+            self.history.append("Sala", record(n))
+        self.assertEqual([2, 4], self.history.channel("Sala").firsts[1:])
+
+    def test_reopen(self):
+        for n in range(6):
+            self.history.append("Sala", record(n))
+        self.history.close()
+        self.history = self.open()
+        self.history.append("Sala", record(6))
+        records, _ = self.history.read("Sala", limit=100)
+        self.assertEqual([record(n) for n in range(7)], records)
+
+    def test_page_bytes(self):
+        for n in range(10):
+            self.history.append("Sala", record(n))
+        size = len(record(0)) + 2
+        records, cursor = self.history.read("Sala", limit=4,
+                                            max_bytes=2 * size)
+        self.assertEqual([record(8), record(9)], records)
+        records, cursor = self.history.read("Sala", cursor, 4, 0)
+        self.assertEqual([record(7)], records)
+        self.assertEqual(7, cursor)
+
+    def test_drop(self):
+        for n in range(6):
+            self.history.append("Sala", record(n))
+        self.history.append("Otra", record(0))
+        self.history.drop("Sala")
+        self.assertEqual(([], None), self.history.read("Sala"))
+        self.history.append(PUBLIC, record("público"))
+        self.history.drop_rooms()
+        self.history.close()
+        self.history = self.open()
+        self.assertEqual(([], None), self.history.read("Otra"))
+        self.assertEqual(([record("público")], None),
+                         self.history.read(PUBLIC))
+
+    def test_torn_record(self):
+        self.history.append("Sala", record(0))
+        channel = self.history.channel("Sala")
+        self.history.close()
+        # an index entry pointing past the log, as after a torn append
+        index = os.path.join(channel.directory, f"{0:020d}.idx")
+        with open(index, "r+b") as file:
+            file.seek(ENTRY.size)
+            file.write(ENTRY.pack(10 ** 6))
+        self.history = self.open()
+        self.assertEqual(([record(0)], None), self.history.read("Sala"))
+
+
+class ServerHistoryTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.server = Server("127.0.0.1", 0,
+                             history=History(self.directory.name))
+        await self.server.start()
+        self.peers = []
+
+    async def asyncTearDown(self):
+        for peer in self.peers:
+            peer.close()
+        self.server.listener.close()
+        self.server.history.close()
+        self.directory.cleanup()
+
+    async def login(self, username):
+        peer = Peer()
+        self.peers.append(peer)
+        await peer.login(self.server, username)
+        return peer
+
+    async def test_history(self):
+        kim = await self.login("Kim")
+        luis = await self.login("Luis")
+        await kim.request(type="NEW_ROOM", roomname="Sala")
+        await kim.request(type="ROOM_MESSAGE", roomname="Sala",
+                          message="uno")
+        await kim.request(type="ROOM_MESSAGE", roomname="Sala",
+                          message="dos")
+        await kim.request(type="PUBLIC_MESSAGE", message="hola")
+        await luis.expect(type="PUBLIC_MESSAGE_FROM")
+        await luis.request(type="HISTORY", roomname="Sala")
+        await luis.expect(type="WARNING", operation="HISTORY")
+        await kim.request(type="INVITE", roomname="Sala", usernames=["Luis"])
+        await luis.request(type="JOIN_ROOM", roomname="Sala")
+        await luis.request(type="HISTORY", roomname="Sala", limit=1)
+        page = await luis.expect(type="HISTORY_LIST")
+        self.assertEqual("Sala", page["roomname"])
+        self.assertEqual(["dos"], [m["message"] for m in page["messages"]])
+        await luis.request(type="HISTORY", roomname="Sala",
+                           before=page["cursor"])
+        page = await luis.expect(type="HISTORY_LIST")
+        self.assertEqual(["uno"], [m["message"] for m in page["messages"]])
+        self.assertIsNone(page["cursor"])
+        await luis.request(type="HISTORY")
+        page = await luis.expect(type="HISTORY_LIST")
+        self.assertEqual([{"type": "PUBLIC_MESSAGE_FROM", "username": "Kim",
+                           "message": "hola"}], page["messages"])
+
+    async def test_removed_room(self):
+        kim = await self.login("Kim")
+        await kim.request(type="NEW_ROOM", roomname="Sala")
+        await kim.request(type="ROOM_MESSAGE", roomname="Sala",
+                          message="secreto")
+        await kim.request(type="LEAVE_ROOM", roomname="Sala")
+        await kim.expect(type="INFO", operation="LEAVE_ROOM")
+        luis = await self.login("Luis")
+        await luis.request(type="NEW_ROOM", roomname="Sala")
+        await luis.request(type="HISTORY", roomname="Sala")
+        page = await luis.expect(type="HISTORY_LIST")
+        self.assertEqual([], page["messages"])
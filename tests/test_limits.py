@@ -0,0 +1,82 @@
+from limits import TokenBucket, RateLimiter, parse_limit, parse_rate
+from server import Server
+from tests.test_cluster import Peer
+import unittest
+import logging
+import asyncio
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+class LimitsTestCase(unittest.TestCase):
+    def test_bucket(self):
+        bucket = TokenBucket(2, 3, now=0)
+        self.assertEqual([0, 0, 0], [bucket.take(0) for _ in range(3)])
+        self.assertEqual(0.5, bucket.take(0))
+        self.assertEqual(0, bucket.take(0.5))
+        # never fills past the burst
+        self.assertEqual([0, 0, 0], [bucket.take(100) for _ in range(3)])
+        self.assertGreater(bucket.take(100), 0)
+
+    def test_limiter(self):
+        limiter = RateLimiter({"*": (1, 3), "PUBLIC_MESSAGE": (1, 1),
+                               "USERS": (0, 0)})
+        self.assertEqual(0, limiter.take("PUBLIC_MESSAGE", 0))
+        self.assertEqual(1, limiter.take("PUBLIC_MESSAGE", 0))
+        # the throttled message took no token from "*"
+        self.assertEqual([0, 0], [limiter.take("USERS", 0) for _ in range(2)])
+        self.assertEqual(1, limiter.take("USERS", 0))
+        self.assertEqual({"*", "PUBLIC_MESSAGE"}, set(limiter.buckets))
+
+    def test_parse(self):
+        self.assertEqual(("*", (10.0, 10.0)), parse_limit("*=10"))
+        self.assertEqual(("MESSAGE", (0.5, 5.0)), parse_limit("MESSAGE=0.5/5"))
+        self.assertEqual((0.5, 1), parse_rate("0.5"))
+        for text in ["MESSAGE", "=1", "MESSAGE=x", "MESSAGE=1/0",
+                     "MESSAGE=-1"]:
+            with self.assertRaises(ValueError):
+                parse_limit(text)
+
+
+class AdmissionTestCase(unittest.IsolatedAsyncioTestCase):
+    async def start(self, **limits):
+        self.server = Server("127.0.0.1", 0, **limits)
+        await self.server.start()
+        self.addCleanup(self.server.listener.close)
+
+    async def test_throttled(self):
+        await self.start(limits={"PUBLIC_MESSAGE": (1, 2)})
+        peer = Peer()
+        await peer.login(self.server, "Kim")
+        for _ in range(3):
+            await peer.request(type="PUBLIC_MESSAGE", message="hola")
+        warning = await peer.expect(type="WARNING")
+        self.assertEqual("PUBLIC_MESSAGE", warning["operation"])
+        self.assertGreater(warning["retry_after"], 0)
+        self.assertEqual(1, self.server.throttled["PUBLIC_MESSAGE"])
+        peer.close()
+
+    async def refused(self):
+        peer = Peer()
+        await peer.connect(self.server)
+        warning = await peer.expect()
+        self.assertEqual(("WARNING", "IDENTIFY"),
+                         (warning["type"], warning["operation"]))
+        self.assertGreater(warning["retry_after"], 0)
+        self.assertEqual(b"", await asyncio.wait_for(peer.reader.read(), 2))
+
+    async def test_full(self):
+        await self.start(max_connections=1)
+        peer = Peer()
+        await peer.login(self.server, "Kim")
+        await self.refused()
+        self.assertEqual(1, self.server.rejected["full"])
+        peer.close()
+
+    async def test_login_rate(self):
+        await self.start(login_rate=(0.1, 1))
+        peer = Peer()
+        await peer.login(self.server, "Kim")
+        await self.refused()
+        self.assertEqual(1, self.server.rejected["logins"])
+        peer.close()
@@ -0,0 +1,79 @@
+from listeners import SocketOptions, parse_bind
+from server import Server, config_args
+from tests.test_cluster import Peer
+import tempfile
+import unittest
+import logging
+import asyncio
+import socket
+import os
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+class UnixPeer(Peer):
+    def __init__(self, path):
+        self.path = path
+
+    async def connect(self, server):
+        self.attach(*await asyncio.open_unix_connection(self.path))
+
+
+class ParseTestCase(unittest.TestCase):
+    def test_parse_bind(self):
+        self.assertEqual(("127.0.0.1", 8080), parse_bind("127.0.0.1:8080"))
+        self.assertEqual(("::1", 8080), parse_bind("[::1]:8080"))
+        self.assertEqual("/tmp/chat.sock", parse_bind("unix:/tmp/chat.sock"))
+        for bad in ["unix:", "localhost", "localhost:http"]:
+            with self.assertRaises(ValueError):
+                parse_bind(bad)
+
+    def test_config_args(self):
+        self.assertEqual([], config_args("  # comment\n"))
+        self.assertEqual([], config_args("\n"))
+        self.assertEqual(["--backlog=1024"], config_args("backlog = 1024\n"))
+        self.assertEqual(["--no-nodelay"], config_args("--no-nodelay"))
+        self.assertEqual(["--rate-limit=MESSAGE=5/10"],
+                         config_args("rate-limit = MESSAGE=5/10"))
+
+
+class ListenersTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "chat.sock")
+        self.server = Server(
+            "127.0.0.1", 0, binds=[self.path, ("127.0.0.1", 0)],
+            sockets=SocketOptions(backlog=16, nodelay=False, rcvbuf=4096))
+        await self.server.start()
+        self.peers = []
+
+    async def asyncTearDown(self):
+        for peer in self.peers:
+            peer.close()
+        for listener in [self.server.listener, *self.server.listeners]:
+            listener.close()
+        self.directory.cleanup()
+
+    async def test_binds(self):
+        kim = UnixPeer(self.path)
+        luis = Peer()
+        self.peers += [kim, luis]
+        await kim.login(self.server, "Kim")
+        port = self.server.listeners[1].sockets[0].getsockname()[1]
+        luis.attach(*await asyncio.open_connection("127.0.0.1", port))
+        await luis.request(type="IDENTIFY", username="Luis")
+        await luis.expect(type="INFO", operation="IDENTIFY")
+        await kim.expect(type="NEW_USER", username="Luis")
+        await kim.request(type="MESSAGE", username="Luis", message="hola")
+        await luis.expect(type="MESSAGE_FROM", username="Kim")
+
+    async def test_options(self):
+        luis = Peer()
+        self.peers.append(luis)
+        await luis.login(self.server, "Luis")
+        sock = self.server.state.local["Luis"].writer.get_extra_info("socket")
+        self.assertEqual(0, sock.getsockopt(socket.IPPROTO_TCP,
+                                            socket.TCP_NODELAY))
+        # Linux doubles the size asked for
+        self.assertIn(sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+                      [4096, 8192])
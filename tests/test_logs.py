@@ -0,0 +1,65 @@
+from message import Message
+import unittest
+import logging
+import json
+import logs
+import io
+
+
+class LogsTestCase(unittest.TestCase):
+    def setUp(self):
+        root = logging.getLogger()
+        self.saved = (root.handlers[:], root.level)
+        self.stream = io.StringIO()
+
+    def tearDown(self):
+        logs.shutdown()
+        root = logging.getLogger()
+        root.handlers[:], level = self.saved
+        root.setLevel(level)
+
+    def lines(self):
+        logs.shutdown()
+        return self.stream.getvalue().splitlines()
+
+    def test_deferred_text(self):
+        logs.setup(logging.INFO, stream=self.stream)
+        logging.debug("hidden %r", Message({"type": "USERS"}))
+        logging.info("Sending to all: %r", Message({"type": "USERS"}))
+        lines = self.lines()
+        self.assertEqual(1, len(lines))
+        self.assertTrue(lines[0].startswith("INFO [root: "))
+        self.assertTrue(lines[0].endswith("] Sending to all: "
+                                          "{'type': 'USERS'}"))
+
+    def test_json(self):
+        logs.setup(logging.DEBUG, "json", stream=self.stream)
+        logging.debug("Private message %s: %r", "Kim",
+                      Message({"type": "MESSAGE_FROM", "message": "hola"}),
+                      extra={"node": "a"})
+        entry = json.loads(self.lines()[0])
+        self.assertEqual("DEBUG", entry["level"])
+        self.assertEqual("a", entry["node"])
+        self.assertEqual([{"type": "MESSAGE_FROM", "message": "hola"}],
+                         entry["frames"])
+
+    def test_sampling(self):
+        logs.setup(logging.DEBUG, sample=[("PUBLIC_MESSAGE_FROM", 3)],
+                   stream=self.stream)
+        for i in range(7):
+            logging.debug("%d %r", i, Message(
+                {"type": "PUBLIC_MESSAGE_FROM"}))
+            logging.debug("%d %r", i, Message({"type": "NEW_USER"}))
+        logging.warning("%r", Message({"type": "PUBLIC_MESSAGE_FROM"}))
+        lines = self.lines()
+        self.assertEqual(["0", "3", "6"],
+                         [line.split()[3] for line in lines
+                          if "PUBLIC" in line and "DEBUG" in line])
+        self.assertEqual(7, sum("NEW_USER" in line for line in lines))
+        self.assertIn("WARNING", lines[-1])
+
+    def test_parse_sample(self):
+        self.assertEqual(("MESSAGE", 10), logs.parse_sample("MESSAGE=10"))
+        for text in ["MESSAGE", "=10", "MESSAGE=0", "MESSAGE=x"]:
+            with self.assertRaises(ValueError):
+                logs.parse_sample(text)
@@ -0,0 +1,122 @@
+from mailboxes import Mailboxes, batches
+from server import Server
+from tests.test_cluster import Peer, wait_until
+from message import Message
+from unittest import mock
+import unittest
+import socket
+import struct
+import tempfile
+import logging
+import time
+import os
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+class MailboxesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.mailboxes = Mailboxes(self.directory.name, max_bytes=100,
+                                   ttl=60)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def deliver(self, username):
+        path = self.mailboxes.detach(username)
+        return [] if path is None else self.mailboxes.read(path)
+
+    def test_deliver(self):
+        self.mailboxes.register("Kim")
+        self.assertTrue(self.mailboxes.put("Kim", b'{"n": 1}'))
+        self.assertTrue(self.mailboxes.put("Kim", b'{"n": 2}'))
+        self.assertEqual([b'{"n": 1}', b'{"n": 2}'], self.deliver("Kim"))
+        self.assertEqual([], self.deliver("Kim"))
+        self.assertEqual({"Kim"}, Mailboxes(self.directory.name).known)
+
+    def test_full(self):
+        frame = b"x" * 30
+        for _ in range(2):
+            self.assertTrue(self.mailboxes.put("Kim", frame))
+        self.assertFalse(self.mailboxes.put("Kim", frame))
+        self.assertEqual([frame, frame], self.deliver("Kim"))
+
+    def test_expiry(self):
+        frame = b"x" * 30
+        self.mailboxes.put("Kim", frame)
+        self.mailboxes.put("Kim", frame)
+        later = time.time() + 61
+        with mock.patch("time.time", return_value=later):
+            # expired messages make room for new ones
+            self.assertTrue(self.mailboxes.put("Kim", b"new"))
+            self.assertEqual([b"new"], self.deliver("Kim"))
+
+    def test_interrupted_delivery(self):
+        self.mailboxes.put("Kim", b"old")
+        self.mailboxes.detach("Kim")
+        self.mailboxes.put("Kim", b"new")
+        mailboxes = Mailboxes(self.directory.name)
+        path = mailboxes.detach("Kim")
+        self.assertEqual([b"old", b"new"], mailboxes.read(path))
+        self.assertEqual([], os.listdir(self.directory.name))
+
+    def test_batches(self):
+        frames = [b"a" * 4, b"b" * 4, b"c" * 4]
+        self.assertEqual([(0, b"aaaabbbb"), (2, b"cccc")],
+                         list(batches(frames, 8)))
+
+
+class ServerMailboxTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.server = Server("127.0.0.1", 0,
+                             mailboxes=Mailboxes(self.directory.name))
+        await self.server.start()
+        self.peers = []
+
+    async def asyncTearDown(self):
+        for peer in self.peers:
+            peer.close()
+        self.server.listener.close()
+        self.directory.cleanup()
+
+    async def login(self, username):
+        peer = Peer()
+        self.peers.append(peer)
+        await peer.login(self.server, username)
+        return peer
+
+    async def test_offline_message(self):
+        kim = await self.login("Kim")
+        await kim.request(type="DISCONNECT")
+        await wait_until(lambda: "Kim" not in self.server.state.users)
+        luis = await self.login("Luis")
+        await luis.request(type="MESSAGE", username="Kim", message="hola")
+        await luis.expect(type="INFO", operation="MESSAGE", username="Kim")
+        await luis.request(type="MESSAGE", username="Fer", message="hola")
+        await luis.expect(type="WARNING", operation="MESSAGE")
+        kim = await self.login("Kim")
+        await kim.expect(type="MESSAGE_FROM", username="Luis",
+                         message="hola")
+
+    async def test_dropped_during_delivery(self):
+        mailboxes = self.server.mailboxes
+        mailboxes.max_bytes = 2 ** 24
+        mailboxes.register("Kim")
+        frame = Message({"type": "MESSAGE_FROM", "username": "Luis",
+                         "message": "x" * 2 ** 14}).encoded
+        for _ in range(512):
+            mailboxes.put("Kim", frame)
+        kim = Peer()
+        await kim.connect(self.server)
+        await kim.request(type="IDENTIFY", username="Kim")
+        await kim.expect(type="INFO", operation="IDENTIFY")
+        # a reset rather than a clean close, with most of it still unsent
+        kim.writer.get_extra_info("socket").setsockopt(
+            socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        kim.writer.transport.abort()
+        await wait_until(lambda: "Kim" not in self.server.state.users)
+        self.assertGreater(mailboxes.size("Kim"), 0)
+        kim = await self.login("Kim")
+        await kim.expect(type="MESSAGE_FROM", username="Luis")
@@ -35,3 +35,23 @@ class MessagetTestCase(unittest.TestCase):
             message.Message.from_encoded(
                 b'["foo", {"bar": ["baz", null, 1.0, 2]}]'
             )
+
+    def test_from_trusted(self):
+        encoded = bytes('{"name": "José", "rooms": []}', "utf-8")
+        msg = message.Message.from_trusted(encoded)
+        self.assertIs(encoded, msg.encoded)
+        self.assertEqual([], msg["rooms"])
+        msg["name"] = "Úrsula"
+        self.assertEqual(bytes('{"name": "Úrsula", "rooms": []}', "utf-8"),
+                         msg.encoded)
+
+    def test_shared(self):
+        info = message.shared(type="INFO", operation="STATUS")
+        self.assertIs(info, message.shared(type="INFO", operation="STATUS"))
+        self.assertIs(info.encoded, info.encoded)
+        self.assertEqual(b'{"type": "INFO", "operation": "STATUS"}',
+                         info.encoded)
+        with self.assertRaises(TypeError):
+            info["operation"] = "USERS"
+        with self.assertRaises(TypeError):
+            del info["type"]
@@ -0,0 +1,88 @@
+from metrics import Histogram, Registry
+from server import Server
+from tests.test_cluster import Peer
+import unittest
+import logging
+import asyncio
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+class HistogramTestCase(unittest.TestCase):
+    def test_quantiles(self):
+        histogram = Histogram()
+        for value in range(1, 10001):
+            histogram.record(value)
+        self.assertEqual(10000, histogram.count)
+        self.assertEqual(10000, histogram.max)
+        for fraction in [0.5, 0.9, 0.99]:
+            exact = 10000 * fraction
+            self.assertLessEqual(exact, histogram.quantile(fraction))
+            self.assertLess(histogram.quantile(fraction), exact * 1.04)
+
+    def test_small_values_are_exact(self):
+        histogram = Histogram()
+        for value in [0, 3, 3, 7]:
+            histogram.record(value)
+        self.assertEqual(3, histogram.quantile(0.5))
+        self.assertEqual(7, histogram.quantile(1))
+
+
+class RegistryTestCase(unittest.TestCase):
+    def test_snapshot_and_render(self):
+        registry = Registry()
+        counter = registry.counter("messages_total", "type")
+        histograms = registry.histogram("handle_microseconds")
+        registry.gauge("outbox_bytes", lambda: {'K"m': 10}, "user")
+        counter["USERS"] += 2
+        histograms[None].record(5)
+        snapshot = registry.snapshot()
+        self.assertEqual({"USERS": 2}, snapshot["messages_total"])
+        self.assertEqual(1, snapshot["handle_microseconds"]["count"])
+        self.assertEqual({'K"m': 10}, snapshot["outbox_bytes"])
+        lines = registry.render().splitlines()
+        self.assertIn('pumachat_messages_total{type="USERS"} 2', lines)
+        self.assertIn('pumachat_handle_microseconds{quantile="0.5"} 5',
+                      lines)
+        self.assertIn("pumachat_handle_microseconds_count 1", lines)
+        self.assertIn('pumachat_outbox_bytes{user="K\\"m"} 10', lines)
+
+
+class ServerMetricsTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = Server("127.0.0.1", 0, metrics=("127.0.0.1", 0),
+                             stats_token="secreto")
+        await self.server.start()
+        self.peer = Peer()
+        await self.peer.login(self.server, "Kim")
+
+    async def asyncTearDown(self):
+        self.peer.close()
+        self.server.listener.close()
+        self.server.scraper.close()
+
+    async def test_stats(self):
+        await self.peer.request(type="USERS")
+        await self.peer.request(type="STATS", token="otro")
+        await self.peer.expect(type="WARNING", operation="STATS")
+        await self.peer.request(type="STATS", token="secreto")
+        stats = (await self.peer.expect(type="STATS_REPORT"))["stats"]
+        self.assertEqual(1, stats["messages_total"]["USERS"])
+        self.assertEqual(1, stats["handle_microseconds"]["USERS"]["count"])
+        self.assertEqual(1, stats["users"])
+
+    async def test_slow_consumers(self):
+        self.server.policy.counters["dropped"] += 3
+        snapshot = self.server.metrics.snapshot()
+        self.assertEqual({"dropped": 3}, snapshot["slow_consumers_total"])
+        self.assertIn('pumachat_slow_consumers_total{outcome="dropped"} 3',
+                      self.server.metrics.render().splitlines())
+
+    async def test_scrape(self):
+        port = self.server.scraper.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        self.assertTrue(response.startswith(b"HTTP/1.0 200 OK"))
+        self.assertIn(b"\npumachat_local_users 1\n", response)
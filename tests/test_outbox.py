@@ -0,0 +1,148 @@
+from outbox import Outbox, Ring, SlowConsumerPolicy
+import unittest
+import logging
+import asyncio
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+class StalledTransport:
+    def __init__(self):
+        self.written = []
+        self.closed = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.closed = True
+
+
+class StalledWriter:
+    def __init__(self):
+        self.transport = StalledTransport()
+        self.written = self.transport.written
+        self.batches = []
+        self.unblocked = asyncio.Event()
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def writelines(self, data):
+        self.batches.append(len(data))
+        for chunk in data:
+            self.write(chunk)
+
+    async def drain(self):
+        await self.unblocked.wait()
+
+
+class OutboxTestCase(unittest.IsolatedAsyncioTestCase):
+    def make_outbox(self, action):
+        self.policy = SlowConsumerPolicy(action, high_water=4, low_water=2)
+        self.writer = StalledWriter()
+        outbox = Outbox(self.writer, self.policy)
+        outbox.start()
+        return outbox
+
+    async def stall(self, outbox):
+        outbox.offer(b"0")
+        await asyncio.sleep(0)
+        self.assertEqual([b"0"], self.writer.written)
+
+    async def test_flush(self):
+        outbox = self.make_outbox(SlowConsumerPolicy.DISCONNECT)
+        outbox.offer(b"a")
+        outbox.offer(b"b")
+        await asyncio.sleep(0)
+        self.assertEqual([b"a", b"b"], self.writer.written)
+        self.assertEqual([2], self.writer.batches)
+        self.assertEqual(0, outbox.size)
+
+    async def test_stalled_reader_does_not_block_producer(self):
+        outbox = self.make_outbox(SlowConsumerPolicy.DISCONNECT)
+        await self.stall(outbox)
+        for frame in [b"a", b"b", b"c", b"d"]:
+            self.assertFalse(outbox.offer(frame))
+        self.assertEqual(4, outbox.size)
+        self.assertFalse(self.writer.transport.closed)
+
+    async def test_disconnect(self):
+        outbox = self.make_outbox(SlowConsumerPolicy.DISCONNECT)
+        await self.stall(outbox)
+        for frame in [b"a", b"b", b"c", b"d", b"e"]:
+            outbox.offer(frame)
+        self.assertTrue(outbox.closed)
+        self.assertTrue(self.writer.transport.closed)
+        self.assertEqual(Outbox.error.encoded, self.writer.written[-1])
+        self.assertEqual(1, self.policy.counters["disconnected"])
+        self.assertFalse(outbox.offer(b"f"))
+
+    async def test_disconnect_ring(self):
+        outbox = self.make_outbox(SlowConsumerPolicy.DISCONNECT)
+        outbox.ring = Ring()
+        await self.stall(outbox)
+        for frame in [b"a", b"b", b"c", b"d", b"e"]:
+            outbox.offer(frame)
+        outbox.offer(b"f")
+        offset = sum(map(len, self.writer.written))
+        self.assertEqual(b"abcdef", outbox.ring.since(offset))
+
+    async def test_drop_presence(self):
+        outbox = self.make_outbox(SlowConsumerPolicy.DROP)
+        await self.stall(outbox)
+        outbox.offer(b"p", droppable=True)
+        outbox.offer(b"a")
+        outbox.offer(b"q", droppable=True)
+        outbox.offer(b"b")
+        outbox.offer(b"r", droppable=True)
+        self.assertEqual([b"a", b"b"], list(outbox.frames))
+        self.assertEqual(3, self.policy.counters["dropped"])
+        self.assertFalse(outbox.closed)
+
+    async def test_drop_keeps_chat_messages(self):
+        outbox = self.make_outbox(SlowConsumerPolicy.DROP)
+        await self.stall(outbox)
+        for frame in [b"a", b"b", b"c", b"d", b"e"]:
+            outbox.offer(frame)
+        self.assertTrue(outbox.closed)
+        self.assertEqual(1, self.policy.counters["disconnected"])
+
+    async def test_block(self):
+        outbox = self.make_outbox(SlowConsumerPolicy.BLOCK)
+        await self.stall(outbox)
+        for frame in [b"a", b"b", b"c", b"d"]:
+            await outbox.put(frame)
+        put = asyncio.create_task(outbox.put(b"e"))
+        await asyncio.sleep(0)
+        self.assertFalse(put.done())
+        self.writer.unblocked.set()
+        await asyncio.wait_for(put, 1)
+        self.assertEqual(1, self.policy.counters["blocked"])
+        await asyncio.sleep(0)
+        self.assertEqual([b"0", b"a", b"b", b"c", b"d", b"e"],
+                         self.writer.written)
+
+    async def test_close_flushes(self):
+        outbox = self.make_outbox(SlowConsumerPolicy.DISCONNECT)
+        self.writer.unblocked.set()
+        outbox.offer(b"a")
+        await outbox.close()
+        self.assertTrue(outbox.task.done())
+        self.assertEqual([b"a"], self.writer.written)
+
+    async def test_close_timeout(self):
+        outbox = self.make_outbox(SlowConsumerPolicy.DISCONNECT)
+        await self.stall(outbox)
+        outbox.offer(b"a")
+        await outbox.close(timeout=0.01)
+        self.assertTrue(outbox.task.done())
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            SlowConsumerPolicy("ignore")
+        with self.assertRaises(ValueError):
+            SlowConsumerPolicy(high_water=1, low_water=2)
@@ -0,0 +1,92 @@
+from message import Message
+from presence import Presence
+from server import Server
+from tests.test_cluster import Peer
+import unittest
+import logging
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+def status(username, status):
+    return Message({"type": "NEW_STATUS", "username": username,
+                    "status": status})
+
+
+class PresenceTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.sent = []
+        self.presence = Presence(self.sent.append, window=60)
+
+    async def asyncTearDown(self):
+        self.presence.close()
+
+    def flush(self):
+        self.presence.flush()
+        return [message["users"] for message in self.sent[-1:]]
+
+    async def test_merge(self):
+        self.presence.add(Message({"type": "NEW_USER", "username": "Kim"}))
+        self.presence.add(Message({"type": "NEW_USER", "username": "Luis"}))
+        self.presence.add(status("Luis", "AWAY"))
+        self.assertEqual([{"Kim": "ACTIVE", "Luis": "AWAY"}], self.flush())
+
+    async def test_flapping(self):
+        self.presence.add(Message({"type": "NEW_USER", "username": "Kim"}))
+        self.flush()
+        self.sent.clear()
+        self.presence.add(status("Kim", "AWAY"))
+        self.presence.add(status("Kim", "ACTIVE"))
+        self.presence.add(Message({"type": "DISCONNECTED",
+                                   "username": "Kim"}))
+        self.presence.add(Message({"type": "NEW_USER", "username": "Kim"}))
+        self.assertEqual([], self.flush())
+        self.presence.add(Message({"type": "DISCONNECTED",
+                                   "username": "Kim"}))
+        self.assertEqual([{"Kim": None}], self.flush())
+
+
+class ServerPresenceTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = Server("127.0.0.1", 0, presence_window=0.3)
+        await self.server.start()
+        self.peers = []
+
+    async def asyncTearDown(self):
+        for peer in self.peers:
+            peer.close()
+        self.server.listener.close()
+        self.server.presence.close()
+
+    async def login(self, username, **identify):
+        peer = Peer()
+        self.peers.append(peer)
+        await peer.connect(self.server)
+        await peer.request(type="IDENTIFY", username=username, **identify)
+        return peer, await peer.expect()
+
+    async def test_batched(self):
+        kim, info = await self.login(
+            "Kim", capabilities=["PRESENCE_UPDATE", "OTHER"])
+        self.assertEqual(["PRESENCE_UPDATE"], info["capabilities"])
+        legacy, info = await self.login("Luis")
+        self.assertNotIn("capabilities", info)
+        await self.login("Fer")
+        await legacy.request(type="STATUS", status="AWAY")
+        await legacy.request(type="STATUS", status="ACTIVE")
+        await legacy.expect(type="NEW_USER", username="Fer")
+        update = await kim.expect(type="PRESENCE_UPDATE")
+        self.assertEqual({"Kim": "ACTIVE", "Luis": "ACTIVE",
+                          "Fer": "ACTIVE"}, update["users"])
+        await kim.request(type="USERS")
+        # nothing else came before the reply
+        self.assertEqual("USER_LIST", (await kim.expect())["type"])
+
+    async def test_bad_capabilities(self):
+        luis, _ = await self.login("Luis")
+        kim, _ = await self.login("Kim", capabilities="PRESENCE_UPDATE")
+        await luis.request(type="USERS")
+        # Kim was never announced nor listed
+        self.assertEqual(["Luis"], (await luis.expect())["usernames"])
+        kim, info = await self.login("Kim", capabilities=[])
+        self.assertEqual("success", info["message"])
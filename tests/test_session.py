@@ -0,0 +1,142 @@
+from outbox import Ring
+from server import Server
+from timers import TimingWheel
+from tests.test_cluster import Peer, wait_until
+import unittest
+import logging
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+class SessionPeer(Peer):
+    offset = 0
+
+    async def recv_frame(self):
+        frame = await super().recv_frame()
+        self.offset += len(frame)
+        return frame
+
+    async def login(self, server, username):
+        await self.connect(server)
+        await self.request(type="IDENTIFY", username=username,
+                           capabilities=["RESUME"])
+        return await self.expect()
+
+    async def resume(self, server, username, token):
+        offset = self.offset
+        await self.connect(server)
+        await self.request(type="RESUME", username=username, token=token,
+                           offset=offset)
+        reply = await self.expect()
+        self.offset = offset
+        return reply
+
+
+class RingTestCase(unittest.TestCase):
+    def test_since(self):
+        ring = Ring(8)
+        for frame in [b"aaa", b"bbb", b"ccc"]:
+            ring.append(frame)
+        self.assertEqual((3, 9), (ring.start, ring.end))
+        self.assertEqual(b"bbbccc", ring.since(3))
+        self.assertEqual(b"bccc", ring.since(5))
+        self.assertEqual(b"", ring.since(9))
+        self.assertIsNone(ring.since(2))
+        self.assertIsNone(ring.since(10))
+
+
+class ServerTestCase(unittest.IsolatedAsyncioTestCase):
+    grace = 30
+
+    async def asyncSetUp(self):
+        self.server = Server("127.0.0.1", 0, resume_grace=self.grace,
+                             wheel=TimingWheel(0.01))
+        await self.server.start()
+        self.peers = []
+
+    async def asyncTearDown(self):
+        for peer in self.peers:
+            peer.close()
+        self.server.listener.close()
+        for session in list(self.server.sessions.values()):
+            if session.expiry is not None:
+                session.expiry.cancel()
+
+    async def login(self, username):
+        peer = SessionPeer()
+        self.peers.append(peer)
+        info = await peer.login(self.server, username)
+        return peer, info["token"]
+
+    async def drop(self, token):
+        self.peers[0].close()
+        await wait_until(lambda: self.server.sessions[token].expiry
+                         is not None)
+
+
+class SessionTestCase(ServerTestCase):
+    async def test_resume(self):
+        kim, token = await self.login("Kim")
+        luis, _ = await self.login("Luis")
+        await kim.expect(type="NEW_USER", username="Luis")
+        await self.drop(token)
+        await luis.request(type="PUBLIC_MESSAGE", message="hola")
+        await luis.request(type="MESSAGE", username="Kim", message="adiós")
+        reply = await kim.resume(self.server, "Kim", token)
+        self.assertEqual({"type": "INFO", "message": "success",
+                          "operation": "RESUME"}, reply)
+        await kim.expect(type="PUBLIC_MESSAGE_FROM", message="hola")
+        await kim.expect(type="MESSAGE_FROM", message="adiós")
+        await kim.request(type="USERS")
+        users = await kim.expect()
+        self.assertEqual({"Kim", "Luis"}, set(users["usernames"]))
+        # Luis never saw Kim leave
+        await luis.request(type="USERS")
+        self.assertEqual("USER_LIST", (await luis.expect())["type"])
+
+    async def test_bad_token(self):
+        _, token = await self.login("Kim")
+        await self.drop(token)
+        peer = SessionPeer()
+        self.peers.append(peer)
+        reply = await peer.resume(self.server, "Kim", "x" + token)
+        self.assertEqual("WARNING", reply["type"])
+        self.assertIn("Kim", self.server.state.users)
+
+
+    async def test_lost(self):
+        kim, token = await self.login("Kim")
+        await self.drop(token)
+        kim.offset += 1000
+        reply = await kim.resume(self.server, "Kim", token)
+        self.assertEqual("WARNING", reply["type"])
+        self.assertIn("ya no están disponibles", reply["message"])
+        self.assertNotIn("Kim", self.server.state.users)
+
+    async def test_not_asked(self):
+        kim = Peer()
+        self.peers.append(kim)
+        info = await kim.login(self.server, "Kim")
+        self.assertNotIn("token", info)
+        luis, _ = await self.login("Luis")
+        kim.close()
+        await luis.expect(type="DISCONNECTED", username="Kim")
+        again = Peer()
+        self.peers.append(again)
+        info = await again.login(self.server, "Kim")
+        self.assertEqual("INFO", info["type"])
+
+
+class ExpiryTestCase(ServerTestCase):
+    grace = 0.05
+
+    async def test_expiry(self):
+        _, token = await self.login("Kim")
+        luis, _ = await self.login("Luis")
+        self.peers[0].close()
+        await luis.expect(type="DISCONNECTED", username="Kim")
+        self.assertNotIn(token, self.server.sessions)
+        peer = SessionPeer()
+        self.peers.append(peer)
+        reply = await peer.resume(self.server, "Kim", token)
+        self.assertEqual("WARNING", reply["type"])
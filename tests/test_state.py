@@ -0,0 +1,207 @@
+from state import ChatState, Changelog
+from server import Server
+from subscriptions import ALL, PUBLIC, PRESENCE
+from tests.test_cluster import Peer
+import unittest
+import logging
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+class User:
+    events = ALL
+
+
+class ChatStateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.state = ChatState()
+        for username in ["Kim", "Luis", "Fer"]:
+            self.state.add_user(username, User())
+        self.room = self.state.create_room("Sala 1", "Kim")
+
+    def assertConsistent(self):
+        for room in self.state.rooms.values():
+            for username in room.users:
+                self.assertIn(room.name, self.state.memberships[username])
+            for username in room.invites:
+                self.assertIn(room.name, self.state.invitations[username])
+        for username, roomnames in self.state.memberships.items():
+            for roomname in roomnames:
+                self.assertIn(username, self.state.rooms[roomname].users)
+        for username, roomnames in self.state.invitations.items():
+            for roomname in roomnames:
+                self.assertIn(username, self.state.rooms[roomname].invites)
+
+    def test_invite_and_join(self):
+        self.state.invite(self.room, "Luis")
+        self.assertEqual({"Sala 1"}, self.state.invitations["Luis"])
+        self.state.join(self.room, "Luis")
+        self.assertEqual({"Kim", "Luis"}, self.room.users)
+        self.assertEqual(set(), self.room.invites)
+        self.assertEqual({"Sala 1"}, self.state.memberships["Luis"])
+        self.assertConsistent()
+
+    def test_leave(self):
+        self.state.invite(self.room, "Luis")
+        self.state.join(self.room, "Luis")
+        self.assertTrue(self.state.leave(self.room, "Kim"))
+        self.assertConsistent()
+        self.state.invite(self.room, "Fer")
+        self.assertFalse(self.state.leave(self.room, "Luis"))
+        self.assertNotIn("Sala 1", self.state.rooms)
+        self.assertEqual(set(), self.state.invitations["Fer"])
+        self.assertConsistent()
+
+    def test_remove_user(self):
+        other = self.state.create_room("Sala 2", "Luis")
+        self.state.invite(other, "Kim")
+        self.state.invite(self.room, "Luis")
+        self.state.join(self.room, "Luis")
+        left = self.state.remove_user("Kim")
+        self.assertEqual([self.room], left)
+        self.assertEqual(set(), other.invites)
+        self.assertNotIn("Kim", self.state.users)
+        self.assertNotIn("Kim", self.state.memberships)
+        self.assertConsistent()
+        self.assertEqual([], self.state.remove_user("Luis"))
+        self.assertEqual({}, self.state.rooms)
+        self.assertConsistent()
+
+    def test_listeners(self):
+        self.state.subscribe("Kim", PUBLIC)
+        self.assertEqual({"Kim", "Luis", "Fer"},
+                         set(self.state.listeners[PUBLIC]))
+        self.assertEqual({"Luis", "Fer"}, set(self.state.listeners[PRESENCE]))
+        self.state.remove_user("Luis")
+        self.assertEqual({"Fer"}, set(self.state.listeners[PRESENCE]))
+
+    def test_interned(self):
+        username = "".join(["Ú", "rsula"])
+        self.state.add_user(username, User())
+        room = self.state.ensure_room("Sala 2")
+        self.state.invite(room, "".join(["Ú", "rsula"]))
+        self.state.join(room, "".join(["Ú", "rsula"]))
+        stored, = room.users
+        self.assertIs(next(name for name in self.state.users
+                           if name == username), stored)
+
+
+class ChangelogTestCase(unittest.TestCase):
+    def test_since(self):
+        log = Changelog(size=4)
+        for name, added in [("Kim", True), ("Luis", True), ("Kim", False),
+                            ("Fer", True), ("Fer", False), ("Luis", False),
+                            ("Luis", True)]:
+            log.record(name, added)
+        self.assertEqual(7, log.version)
+        self.assertEqual((["Luis"], []), log.since(0))
+        self.assertEqual(([], ["Kim"]), log.since(2))
+        # Fer came and went, Luis went and came back
+        self.assertEqual(([], []), log.since(3))
+        self.assertEqual(([], []), log.since(7))
+
+    def test_covers(self):
+        log = Changelog(size=2)
+        for n in range(5):
+            log.record(f"user{n}", True)
+        # the changelog was cut to the last two changes
+        self.assertFalse(log.covers(2))
+        self.assertTrue(log.covers(3))
+        self.assertEqual((["user3", "user4"], []), log.since(3))
+        self.assertFalse(log.covers(6))
+
+    def test_sorted(self):
+        log = Changelog(size=2)
+        log.record("b", True)
+        snapshot = log.sorted({"b", "a"})
+        self.assertEqual((1, ["a", "b"]), snapshot)
+        log.record("c", True)
+        self.assertIs(snapshot, log.sorted({"a", "b", "c"}))
+        for name in "defg":
+            log.record(name, True)
+        self.assertEqual(6, log.sorted({"a"})[0])
+
+    def test_state(self):
+        state = ChatState()
+        state.add_user("Kim", User())
+        version = state.directory.version
+        state.add_user("Luis", User())
+        room = state.create_room("Sala", "Kim")
+        state.join(room, "Kim")
+        state.join(room, "Luis")
+        self.assertEqual(2, room.log.version)
+        state.remove_user("Luis")
+        self.assertEqual(([], []), state.directory.since(version))
+        self.assertEqual(3, room.log.version)
+
+
+class ServerDirectoryTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = Server("127.0.0.1", 0)
+        await self.server.start()
+        self.peers = []
+
+    async def asyncTearDown(self):
+        for peer in self.peers:
+            peer.close()
+        self.server.listener.close()
+
+    async def login(self, username):
+        peer = Peer()
+        self.peers.append(peer)
+        await peer.login(self.server, username)
+        return peer
+
+    async def test_users(self):
+        kim = await self.login("Kim")
+        await kim.request(type="USERS")
+        version = (await kim.expect(type="USER_LIST"))["version"]
+        await self.login("Luis")
+        await self.login("Fer")
+        await kim.request(type="USERS", since=version)
+        delta = await kim.expect(type="USER_LIST_DELTA")
+        self.assertEqual((["Luis", "Fer"], []),
+                         (delta["added"], delta["removed"]))
+        await kim.request(type="USERS", limit=2)
+        page = await kim.expect(type="USER_LIST")
+        self.assertEqual((["Fer", "Kim"], "Kim"),
+                         (page["usernames"], page["cursor"]))
+        await kim.request(type="USERS", after=page["cursor"], limit=2)
+        page = await kim.expect(type="USER_LIST")
+        self.assertEqual((["Luis"], None),
+                         (page["usernames"], page["cursor"]))
+        # a version the changelog doesn't have starts over
+        await kim.request(type="USERS", since=10 ** 6)
+        page = await kim.expect(type="USER_LIST")
+        self.assertEqual(["Fer", "Kim", "Luis"], page["usernames"])
+
+    async def test_page_bytes(self):
+        kim = await self.login("Kim")
+        long = [letter * 20000 for letter in "abcd"]
+        for username in long:
+            await self.login(username)
+        # all of them don't fit in a frame, nor does the cursor after c
+        await kim.request(type="USERS")
+        page = await kim.expect(type="USER_LIST")
+        self.assertEqual((["Kim", *long[:2]], long[1]),
+                         (page["usernames"], page["cursor"]))
+        await kim.request(type="USERS", after=page["cursor"])
+        page = await kim.expect(type="USER_LIST")
+        self.assertEqual((long[2:], None),
+                         (page["usernames"], page["cursor"]))
+
+    async def test_room_users(self):
+        kim = await self.login("Kim")
+        await self.login("Luis")
+        await kim.request(type="NEW_ROOM", roomname="Sala")
+        await kim.request(type="ROOM_USERS", roomname="Sala")
+        listing = await kim.expect(type="ROOM_USER_LIST")
+        self.assertEqual(["Kim"], listing["usernames"])
+        await kim.request(type="INVITE", roomname="Sala", usernames=["Luis"])
+        await self.peers[1].request(type="JOIN_ROOM", roomname="Sala")
+        await kim.expect(type="JOINED_ROOM")
+        await kim.request(type="ROOM_USERS", roomname="Sala",
+                          since=listing["version"])
+        delta = await kim.expect(type="ROOM_USER_LIST_DELTA")
+        self.assertEqual(("Sala", ["Luis"]),
+                         (delta["roomname"], delta["added"]))
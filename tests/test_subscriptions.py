@@ -0,0 +1,55 @@
+from subscriptions import mask, names, PUBLIC, ROOMS
+from server import Server
+from tests.test_cluster import Peer
+import unittest
+import logging
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+class SubscriptionsTestCase(unittest.TestCase):
+    def test_mask(self):
+        self.assertEqual(PUBLIC | ROOMS, mask(["ROOMS", "PUBLIC"]))
+        self.assertEqual(["PUBLIC", "ROOMS"], names(PUBLIC | ROOMS))
+        for events in [["OTHER"], [1]]:
+            with self.assertRaises(ValueError):
+                mask(events)
+
+
+class ServerSubscriptionsTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = Server("127.0.0.1", 0)
+        await self.server.start()
+        self.peers = []
+
+    async def asyncTearDown(self):
+        for peer in self.peers:
+            peer.close()
+        self.server.listener.close()
+
+    async def login(self, username):
+        peer = Peer()
+        self.peers.append(peer)
+        await peer.login(self.server, username)
+        return peer
+
+    async def test_filters(self):
+        kim = await self.login("Kim")
+        await kim.request(type="SUBSCRIBE", events=["PUBLIC"], mute=["Fer"])
+        info = await kim.expect(type="INFO", operation="SUBSCRIBE")
+        self.assertEqual((["PUBLIC"], ["Fer"]), (info["events"], info["mute"]))
+        luis = await self.login("Luis")
+        fer = await self.login("Fer")
+        await fer.request(type="PUBLIC_MESSAGE", message="uno")
+        await fer.request(type="MESSAGE", username="Kim", message="dos")
+        await luis.request(type="STATUS", status="AWAY")
+        await luis.request(type="PUBLIC_MESSAGE", message="tres")
+        # no NEW_USER, NEW_STATUS nor anything from Fer came first
+        message = await kim.expect()
+        self.assertEqual(("PUBLIC_MESSAGE_FROM", "tres"),
+                         (message["type"], message["message"]))
+
+    async def test_unknown_event(self):
+        kim = await self.login("Kim")
+        await kim.request(type="SUBSCRIBE", events=["EVERYTHING"])
+        await kim.expect(type="ERROR")
@@ -0,0 +1,86 @@
+from server import Server
+from timers import TimingWheel
+from tests.test_cluster import Peer, wait_until
+import unittest
+import logging
+import asyncio
+
+logging.basicConfig(level=logging.CRITICAL)
+
+
+class TimingWheelTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_order(self):
+        wheel = TimingWheel(0.01, slots=4)
+        fired = []
+        for delay in [0.07, 0.01, 0.03]:
+            wheel.schedule(delay, fired.append, delay)
+        wheel.schedule(0.02, fired.append, "cancelled").cancel()
+        await wait_until(lambda: len(fired) == 3)
+        # 0.07 is almost two turns of a 4 slot wheel away
+        self.assertEqual([0.01, 0.03, 0.07], fired)
+        self.assertEqual(0, wheel.pending)
+        self.assertIsNone(wheel.handle)
+
+    async def test_reschedule(self):
+        wheel = TimingWheel(0.01)
+        fired = []
+
+        def again(n):
+            fired.append(n)
+            if n:
+                wheel.schedule(0, again, n - 1)
+        wheel.schedule(0, again, 3)
+        await wait_until(lambda: fired == [3, 2, 1, 0])
+        wheel.close()
+
+
+class HeartbeatTestCase(unittest.IsolatedAsyncioTestCase):
+    async def start(self, **timeouts):
+        self.server = Server("127.0.0.1", 0, wheel=TimingWheel(0.01),
+                             **timeouts)
+        await self.server.start()
+        self.addCleanup(self.server.listener.close)
+        self.addCleanup(self.server.wheel.close)
+
+    async def closed(self, peer):
+        async def eof():
+            while await peer.reader.read(4096):
+                pass
+        await asyncio.wait_for(eof(), 2)
+
+    async def login(self, *capabilities):
+        peer = Peer()
+        self.addCleanup(peer.close)
+        await peer.connect(self.server)
+        await peer.request(type="IDENTIFY", username="Kim",
+                           capabilities=list(capabilities))
+        self.assertEqual("success", (await peer.expect())["message"])
+        return peer
+
+    async def test_login_timeout(self):
+        await self.start(login_timeout=0.05)
+        peer = Peer()
+        await peer.connect(self.server)
+        await self.closed(peer)
+
+    async def test_ping(self):
+        await self.start(ping_interval=0.02, idle_timeout=0.5)
+        peer = await self.login("PING")
+        await peer.expect(type="PING")
+        await peer.request(type="PING")
+        await peer.expect(type="PONG")
+
+    async def test_idle_timeout(self):
+        await self.start(ping_interval=0.02, idle_timeout=0.05,
+                         resume_grace=0)
+        peer = await self.login("PING")
+        await self.closed(peer)
+        await wait_until(lambda: not self.server.state.users)
+
+    async def test_no_pings(self):
+        await self.start(ping_interval=0.02, idle_timeout=0.05)
+        peer = await self.login()
+        await asyncio.sleep(0.2)
+        await peer.request(type="USERS")
+        message = await peer.expect()
+        self.assertEqual(["Kim"], message["usernames"])
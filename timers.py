@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import math
+
+TICK = 1
+SLOTS = 512
+
+
+class Timer:
+    __slots__ = ("tick", "callback", "args", "cancelled")
+
+    def __init__(self, tick, callback, args):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimingWheel:
+    """Timers hashed by their deadline tick into a ring of slots.
+
+    A single loop callback advances the wheel once per tick and runs the
+    due timers of the slots it passes, so any number of timers costs one
+    event loop timer. Deadlines are rounded up to the next tick, and timers
+    more than a turn away wait in their slot for the turns to pass.
+    Cancelled timers are dropped when their slot comes up.
+    """
+
+    def __init__(self, tick=TICK, slots=SLOTS):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current = None
+        self.pending = 0
+        self.handle = None
+        self.advancing = False
+        self.loop = None
+
+    def schedule(self, delay, callback, *args):
+        """Run callback(*args) in about delay seconds, returns a Timer
+        that can be cancelled."""
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        now = self.loop.time()
+        if self.handle is None and self.pending == 0:
+            self.current = math.floor(now / self.tick)
+        # the slot of the current tick was already run
+        tick = max(math.ceil((now + delay) / self.tick), self.current + 1)
+        timer = Timer(tick, callback, args)
+        self.slots[tick % len(self.slots)].append(timer)
+        self.pending += 1
+        if self.handle is None and not self.advancing:
+            self._next()
+        return timer
+
+    def _next(self):
+        self.handle = self.loop.call_at((self.current + 1) * self.tick,
+                                        self._advance)
+
+    def _advance(self):
+        self.handle = None
+        self.advancing = True
+        now = math.floor(self.loop.time() / self.tick)
+        while self.current < now and self.pending:
+            self.current += 1
+            index = self.current % len(self.slots)
+            due = []
+            kept = []
+            for timer in self.slots[index]:
+                if timer.cancelled:
+                    self.pending -= 1
+                elif timer.tick <= self.current:
+                    due.append(timer)
+                    self.pending -= 1
+                else:
+                    kept.append(timer)
+            self.slots[index] = kept
+            for timer in due:
+                try:
+                    timer.callback(*timer.args)
+                except Exception:
+                    logging.exception("Timer callback failed")
+        self.current = now
+        self.advancing = False
+        if self.pending:
+            self._next()
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        for slot in self.slots:
+            slot.clear()
+        self.pending = 0
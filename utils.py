@@ -1,14 +1,50 @@
+from collections import deque
+import asyncio
+import framing
 import message
 
 
 class BaseChat:
+    __slots__ = ("reader", "writer", "codec", "decoder", "frames")
+
+    def attach(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.codec = None
+        self.decoder = framing.FrameDecoder()
+        self.frames = deque()
+
+    def use(self, codec):
+        """Encode and decode every frame from now on with codec."""
+        self.codec = codec
+        self.decoder = codec.decoder()
+
     async def send(self, message):
-        self.writer.write(message.encoded)
+        self.writer.write(message.wire(self.codec))
         await self.writer.drain()
 
+    async def recv_frame(self):
+        while not self.frames:
+            data = await self.reader.read(framing.READ_SIZE)
+            if not data:
+                raise asyncio.IncompleteReadError(self.decoder.pending, None)
+            self.frames.extend(self.decoder.feed(data))
+        return self.frames.popleft()
+
     async def recv(self):
-        data = await self.reader.readuntil(b"}")
-        return message.Message.from_encoded(data.lstrip(b"\x00\n"))
+        frame = await self.recv_frame()
+        if self.codec is None:
+            return message.Message.from_encoded(frame)
+        return self.codec.decode(frame)
+
+    async def messages(self):
+        while True:
+            try:
+                yield await self.recv()
+            except asyncio.IncompleteReadError as e:
+                if e.partial:
+                    raise
+                return
 
 
 class MessageException(Exception):